@@ -13,14 +13,25 @@
 
 # -*- test-case-name: slogger.test.test_bot -*-
 
+import math
+import os
 import time
+import urllib
 
 from twisted.words.protocols import irc
-from twisted.internet import reactor, protocol
+from twisted.internet import protocol, threads
 from twisted.python import log
 
 import settings
+import directory
+import history
 import loggers
+import mentions
+import plugins
+import presence
+import pubsub
+import roster
+import watches
 from events import *
 from elasticsearch import ESLogLine
 
@@ -31,36 +42,119 @@ class LogBot(irc.IRCClient):
     ignorelist = []
     _user_left_FP = None
     log_user = "af3aF&G@#*@#*(#@#*(@&&FHU#IU#HJAF#(@F@#J"
+    # the most messages the last command sends
+    max_last = 50
+    # when the bot was last disconnected before this connection, and when it
+    # reconnected
+    gap = None
+    # the (lower case) channels that were logged when the bot was
+    # disconnected, and haven't logged the gap since rejoining
+    gap_channels = frozenset()
 
     def writeLog(self, user, channel, event, message=None):
-        current_time = time.time()
-        msg = (current_time, user, channel, event, self.factory.irc_host, message)
+        """
+        Log an event to all the loggers.  The event is built once and shared,
+        so that it is only ever formatted once no matter how many loggers
+        there are.
+        """
+        log_event = loggers.LogEvent(time.time(), user, channel, event,
+                                     self.factory.irc_host, message)
         for logger in self.loggers:
-            logger.log(*msg)
+            logger.log(log_event)
 
     def connectionMade(self):
         irc.IRCClient.connectionMade(self)
         self.loggers = [
-            loggers.PyLogger(),
-            loggers.BufferedMultiChannelFileLogger(
-                self.factory.log_path, self.factory.channels),
-            loggers.BufferedSearchLogger()]
-
-        self.writeLog(self.log_user, None, CONNECT_EVENT)
+            self.factory.pipeline,
+            self.factory.mentions,
+            self.factory.watches]
+        self.factory.watches.notify = self.msg
+        self.factory.client = self
+
+        if self.factory.disconnected_at is not None:
+            self.gap = (self.factory.disconnected_at, time.time())
+            self.gap_channels = set(
+                channel.lower()
+                for channel in self.factory.disconnected_channels)
+            self.factory.disconnected_at = None
+        self.writeLog(self.log_user, None, CONNECT_EVENT, self._gap_message())
 
     def connectionLost(self, reason):
         irc.IRCClient.connectionLost(self, reason)
         self.writeLog(self.log_user, None, DISCONNECT_EVENT)
+        self.factory.watches.notify = None
+        self.factory.client = None
+        self.factory.roster.clear()
+        # nothing is logged until the bot reconnects
+        if self.factory.disconnected_at is None:
+            self.factory.disconnected_at = time.time()
+            self.factory.disconnected_channels = list(self.factory.channels)
+
+    def _gap_message(self):
+        """
+        @return: a message saying when the bot was disconnected before this
+            connection, or C{None} if it wasn't
+        """
+        if self.gap is None:
+            return None
+        start, end = self.gap
+        return ('disconnected from %s to %s (%d seconds) - nothing was '
+                'logged in between' % (
+                    time.asctime(time.localtime(start)),
+                    time.asctime(time.localtime(end)), end - start))
+
+    def irc_RPL_WELCOME(self, prefix, params):
+        """
+        The server welcomes the bot by the nick it knows it by, which may not
+        be the one the bot asked for (if it was too long, say)
+        """
+        self._attemptedNick = params[0]
+        irc.IRCClient.irc_RPL_WELCOME(self, prefix, params)
 
     def signedOn(self):
         """Called when bot has succesfully signed on to server."""
+        # the connection works, so the next reconnect can be quick again
+        self.factory.resetDelay()
         self.setNick(self._attemptedNick)
         for channel_name in self.factory.channels:
             self.join(channel_name)
 
     def joined(self, channel):
-        """This will get called when the bot joins the channel."""
-        self.writeLog(self.log_user, channel, JOIN_EVENT)
+        """
+        This will get called when the bot joins the channel - after a
+        reconnect, the first join of each channel that was being logged is
+        logged with when the bot was disconnected
+        """
+        message = None
+        if channel.lower() in self.gap_channels:
+            self.gap_channels.discard(channel.lower())
+            message = self._gap_message()
+        self.writeLog(self.log_user, channel, JOIN_EVENT, message)
+
+    def left(self, channel):
+        """
+        When the bot leaves a channel, forget who is in it - and the channel
+        itself, if it has been parted for good
+        """
+        self.factory.roster.forget(channel)
+        if not self.factory.logs_channel(channel):
+            self.factory.pipeline.forget(channel)
+
+    def kickedFrom(self, channel, kicker, message):
+        """
+        When the bot is kicked from a channel, forget who is in it
+        """
+        self.factory.roster.forget(channel)
+
+    def irc_RPL_NAMREPLY(self, prefix, params):
+        """
+        Some of the names of the users in a channel, sent when the bot joins
+        it
+        """
+        self.factory.roster.names(params[2], params[3].split())
+
+    def irc_RPL_ENDOFNAMES(self, prefix, params):
+        self.factory.roster.end_of_names(params[1])
 
     def privmsg(self, user, channel, msg):
         """This will get called when the bot receives a message."""
@@ -70,43 +164,92 @@ class LogBot(irc.IRCClient):
 
     def userJoined(self, user, channel):
         """
-        When the user joins a channel, log the join
+        When the user joins a channel, log the join, and tell them when they
+        last left it and how many times they were mentioned since, if they
+        have left it before
         """
         self.writeLog(user, channel, JOIN_EVENT)
-        # TODO: this is temporary
+        self.factory.roster.joined(user, channel)
+        now = time.time()
         if not self._user_is_self(user):
             last_exit_dict = self._get_user_last_exit_time(user, channel)
             last_exit_time = last_exit_dict.get(channel, None)
-            self.msg(user, (
-                "The last time you left this channel was: %s. "
+            if last_exit_time is not None:
+                self.msg(user, self._missed_message(
+                    user, channel, last_exit_time, now))
+        self.factory.presence.joined(user, channel, now)
+
+    def _missed_message(self, user, channel, last_exit_time, now):
+        """
+        @return: the message telling a user who has rejoined a channel what
+            they missed
+        """
+        url = '%s/?%s' % (
+            self.factory.web_url, urllib.urlencode([
+                ('channel', channel), ('from', int(last_exit_time)),
+                ('to', int(math.ceil(now)))]))
+        mentioned = self.factory.mentions.count(user, channel,
+                                                last_exit_time, now)
+        left = time.asctime(time.localtime(last_exit_time))
+        if mentioned:
+            return ("You were mentioned %d time%s in %s since you left at "
+                    "%s: %s" % (mentioned, mentioned != 1 and 's' or '',
+                                channel, left, url))
+        return ("The last time you left this channel was: %s. "
                 "Please see the history since you left here: %s" % (
-                    time.asctime(time.localtime(last_exit_time)),
-                    'this is not ready yet')))
+                    left, url))
 
     def userLeft(self, user, channel):
         """
         When the user leaves a channel, log the leave
         """
         self.writeLog(user, channel, LEAVE_EVENT)
+        self.factory.roster.left(user, channel)
+        self.factory.presence.left(user, channel, time.time())
+
+    def userKicked(self, kickee, channel, kicker, message):
+        """
+        When a user is kicked from a channel, log it as them leaving
+        """
+        self.writeLog(kickee, channel, LEAVE_EVENT, message)
+        self.factory.roster.left(kickee, channel)
+        self.factory.presence.left(kickee, channel, time.time())
+
+    def userQuit(self, user, quitMessage):
+        """
+        When a user quits, log them leaving each of the channels they were in
+        """
+        now = time.time()
+        channels = set(self.factory.roster.quit(user))
+        channels.update(self.factory.presence.quit(user, now))
+        for channel in sorted(channels):
+            self.factory.presence.left(user, channel, now)
+            self.writeLog(user, channel, LEAVE_EVENT, quitMessage)
 
     def _user_is_self(self, user):
         """
-        Is this user the bot?  Currently there is no good way of determining
-        what the server thinks the bot's username is (if it's truncated for
-        instance).  So right now, check it against the nick, and hope for the
-        best.
+        Is this user the bot?  The bot's nick is the one the server welcomed
+        it by, kept up to date as it changes.
 
         @param user: username
         @type user: C{str}
 
         @return: true if the user is the logbot, false otherwise
         """
-        return user == self.nickname
+        return user.lower() == self.nickname.lower()
+
+    def is_admin(self, user):
+        """
+        Can this user join and part channels?  Admins are the nicks in
+        C{settings.IRC_ADMINS}.
+        """
+        return user.lower() in [admin.lower() for admin in
+                                getattr(settings, 'IRC_ADMINS', [])]
 
     def _get_user_last_exit_time(self, user, channel=None):
         """
-        When the user last exited this channel.  This should probably go
-        elsewhere.  Also, async.
+        When the user last exited this channel, according to the factory's
+        L{presence.Presence}
 
         @param user: the username of the user
         @type user: C{str}
@@ -119,8 +262,7 @@ class LogBot(irc.IRCClient):
         @return: C{dict} mapping channel names to exit times in seconds since
             the epoch
         """
-        results = {}
-        return results
+        return self.factory.presence.last_left(user, channel)
 
     # Commands
 
@@ -140,67 +282,118 @@ class LogBot(irc.IRCClient):
         if reply_to:
             msg = msg.strip()
             split = msg.split(None, 1)
+            if not split:
+                return
             command = split[0]
             try:
                 args = split[1]
             except IndexError:
                 args = None
 
-            # TODO: Plugin system and shit
-            if command.lower() == 'help':
-                if args == 'search':
-                    reply = 'search <lucene query> - searches for messages'
-                elif args == 'ignore':
-                    reply = 'ignore <optional: nick> - ignores you, or a given nick'
-                elif args == 'unignore':
-                    reply = 'unignore <optional: nick> - unignores you, or a given nick'
-                elif args == 'stats':
-                    reply = 'stats - returns some stats'
-                else:
-                    reply = 'commands: search, ignore, unignore'
-            elif command.lower() == 'search':
-                reply = self.do_search(args, channel, user)
-            elif command.lower() == 'ignore':
-                reply = self.do_ignore(args or user)
-            elif command.lower() == 'unignore':
-                reply = self.do_unignore(args or user)
-            else:
-                reply = 'logger and searchbot - try "help"'
+            # commands run once there is room for them, and may reply later -
+            # logging carries on meanwhile
+            d = plugins.registry.run(command, self, user, channel, args)
+            d.addCallback(self._reply, reply_to)
+            return d
 
-            if reply:
-                self.msg(reply_to, reply)
+    def _reply(self, reply, reply_to):
+        """
+        Send a command's reply - a message for whoever asked, or a C{list} of
+        C{(recipient, message)} to send
+        """
+        if isinstance(reply, list):
+            for recipient, message in reply:
+                self.msg(recipient, message)
+        elif reply:
+            self.msg(reply_to, reply)
 
     def do_search(self, query, channel, user):
-        try:
-            results = list(ESLogLine.objects.filter(query))
-        except Exception as e:
-            log.msg('ES Search Failed! - %s' % e)
-            if 'SearchPhaseExecutionException' in str(e):
-                return 'Invalid Query'
-            else:
-                return 'Something went wrong, please try again later'
+        """
+        Searches for messages in a thread
 
+        @return: a Deferred that fires with the reply - the results are
+            part of it, so they aren't sent if the search times out
+        """
         reply_to = channel
         if channel == self.nickname:
             reply_to = user
 
+        d = threads.deferToThread(
+            lambda: list(ESLogLine.objects.filter(query)))
+        d.addCallbacks(self._search_results, self._search_failed,
+                       callbackArgs=(reply_to, user))
+        return d
+
+    def _search_failed(self, failure):
+        log.msg('ES Search Failed! - %s' % failure.value)
+        if 'SearchPhaseExecutionException' in str(failure.value):
+            return 'Invalid Query'
+        else:
+            return 'Something went wrong, please try again later'
+
+    def _search_results(self, results, reply_to, user):
+        """
+        @return: the C{(recipient, message)} replies for the results
+        """
+        messages = ['[%s] <%s> %s' % (str(result.time), str(result.user),
+                                      str(result.message))
+                    for result in results]
+        count = '%s results returned' % len(results)
         # If small number of results, reply wherever
         if len(results) < 2:
-            self.msg(reply_to, '%s results returned' % len(results))
-            for result in results:
-                self.msg(reply_to, "[%s] <%s> %s" % (str(result.time),
-                                                     str(result.user),
-                                                     str(result.message)))
+            return [(reply_to, message) for message in [count] + messages]
         # if a large amount of results, reply in a PM
-        elif (len(results) >= 2) and (len(results) < 10):
-            self.msg(reply_to, '%s results returned' % len(results))
-            for result in results:
-                self.msg(user, "[%s] <%s> %s" % (str(result.time),
-                                                 str(result.user),
-                                                 str(result.message)))
+        elif len(results) < 10:
+            return [(reply_to, count)] + [(user, message)
+                                          for message in messages]
         # if a *really* large amount of results, say no
         else:
-            self.msg(reply_to, '%s results returned, narrow your search' % len(results))
+            return [(reply_to, '%s, narrow your search' % (count,))]
+
+    def do_last(self, args, channel, user):
+        """
+        Sends the user the last messages in a channel, from the recent
+        history - by default, the channel they asked in, or the first logged
+        channel if they asked in private
+        """
+        count = 10
+        if channel == self.nickname:
+            channel = (self.factory.channels or [None])[0]
+        for arg in (args or '').split():
+            if arg.startswith('#'):
+                channel = arg
+            elif arg.isdigit():
+                count = min(int(arg), self.max_last)
+            else:
+                return 'last <optional: channel> <optional: count>'
+        if channel is None:
+            return "I'm not logging any channels - say which channel"
+
+        events = history.history.last(channel, count,
+                                      (MSG_EVENT, CTCPQUERY_EVENT))
+        if not events:
+            return 'Nothing has been said in %s lately' % (channel,)
+        for event in events:
+            self.msg(user, "[%s] <%s> %s" % (event.time_string, event.user,
+                                             event.message))
+
+    def do_watch(self, args, user):
+        try:
+            self.factory.watches.add(user, args, self.is_admin(user))
+        except watches.WatchError as e:
+            return str(e)
+        return "I'll let you know when anyone says %s" % (args.strip(),)
+
+    def do_unwatch(self, args, user):
+        if self.factory.watches.remove(user, args):
+            return "I've stopped watching for %s" % (args.strip(),)
+        return "You weren't watching for %s" % ((args or '').strip(),)
+
+    def do_watches(self, user):
+        terms = self.factory.watches.watches(user)
+        if not terms:
+            return "You aren't watching for anything"
+        return 'You are watching for: %s' % (', '.join(terms),)
 
     def do_ignore(self, args):
         self.writeLog(args, None, IGNORE_EVENT)
@@ -231,31 +424,297 @@ class LogBot(irc.IRCClient):
         old_nick = prefix.split('!')[0]
         new_nick = params[0]
         self.writeLog(old_nick, None, NICK_EVENT, new_nick)
+        if self._user_is_self(old_nick):
+            self.nickChanged(new_nick)
+        self.factory.roster.renamed(old_nick, new_nick)
+        self.factory.presence.renamed(old_nick, new_nick, time.time())
 
     def ctcpQuery_ACTION(self, user, channel, data):
         user = user.split('!', 1)[0]
         self.writeLog(user, channel, CTCPQUERY_EVENT, data)
 
     def alterCollidedNick(self, nickname):
-        return settings.ALT_NICK
+        return self.factory.alt_nick
+
+
+def get_networks():
+    """
+    The IRC networks to log, from C{settings.IRC_NETWORKS} - or if that isn't
+    set, the single network described by C{settings.IRC_HOST} and friends,
+    which also provide the defaults for anything a network leaves out
+
+    @return: C{list} of C{dict}s, with the C{host}, C{port}, C{nick},
+        C{alt_nick} and C{channels} of each network
+    """
+    default = {'host': settings.IRC_HOST, 'port': settings.IRC_PORT,
+               'nick': settings.NICK, 'alt_nick': settings.ALT_NICK,
+               'channels': settings.IRC_CHANNELS}
+    networks = getattr(settings, 'IRC_NETWORKS', None)
+    if not networks:
+        return [default]
+    networks = [dict(default, **network) for network in networks]
+    check_channels(networks)
+    return networks
+
+
+def check_channels(networks):
+    """
+    Checks that no channel is logged on more than one network - the log
+    files, the search index and the web interface all tell channels apart by
+    their names alone
+
+    @raise ValueError: if one is
+    """
+    hosts = {}
+    for network in networks:
+        for channel in network['channels']:
+            host = hosts.setdefault(channel.lower(), network['host'])
+            if host != network['host']:
+                raise ValueError(
+                    '%s is logged on both %s and %s - channel names must be '
+                    'unique across networks' % (channel, host,
+                                                network['host']))
+
+
+def network_path(path, network, networks):
+    """
+    The path of a file kept for each network - the path itself if there is
+    only one network, otherwise the path with the network's host added to it,
+    so that C{presence.json} becomes C{presence.irc.example.net.json}.  The
+    worker processes (see L{shard}) only know their own networks, so theirs
+    always have the host added - each network's file is shared by all the
+    workers logging its channels, so that what is kept for a channel
+    follows it when it moves to another worker.
+
+    @param network: the network the file is for
+    @type network: C{dict}
+
+    @param networks: all the networks, as returned by L{get_networks}
+    @type networks: C{list}
+    """
+    if len(networks) == 1 and not network.get('shard'):
+        return path
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, network['host'], ext)
+
+
+def valid_channel(channel):
+    """
+    Checks that a channel name is one the bot can join
+
+    @raise ValueError: if it isn't
+    """
+    if (not channel or channel[0] not in irc.CHANNEL_PREFIXES or
+            len(channel) > 50 or
+            any(char in channel for char in ' ,\x07\r\n')):
+        raise ValueError('%s is not a channel name' % (channel or 'that',))
+
+
+class ChannelManager(object):
+    """
+    Joins and parts channels at runtime, on any of the networks being logged
+    """
+
+    def __init__(self, factories):
+        """
+        @param factories: the factories of the bots of each network
+        @type factories: C{list} of L{LogBotFactory}
+        """
+        self._factories = dict((factory.irc_host, factory)
+                               for factory in factories)
+
+    def _factory(self, host):
+        if host is None and len(self._factories) == 1:
+            return self._factories.values()[0]
+        factory = self._factories.get(host)
+        if factory is None:
+            raise ValueError('%s is not a logged network' % (host,))
+        return factory
+
+    def channels(self):
+        """
+        @return: C{dict} mapping each network's host to its channels
+        """
+        return dict((host, list(factory.channels))
+                    for host, factory in self._factories.iteritems())
+
+    def join(self, channel, host=None):
+        """
+        @param host: the network to join the channel on - can be left out if
+            there is only one
+
+        @return: whether the channel wasn't already being logged
+
+        @raise ValueError: if the channel or network is not valid, or the
+            channel is logged on another network
+        """
+        valid_channel(channel)
+        factory = self._factory(host)
+        for other in self._factories.itervalues():
+            if other is not factory and channel.lower() in [
+                    name.lower() for name in other.channels]:
+                raise ValueError('%s is already logged on %s' % (
+                    channel, other.irc_host))
+        return factory.join_channel(channel)
+
+    def part(self, channel, host=None):
+        """
+        @return: whether the channel was being logged
 
+        @raise ValueError: if the network is not valid
+        """
+        return self._factory(host).part_channel(channel)
+
+
+def build_pipeline(log_path, networks):
+    """
+    Build the logger pipeline shared by the bots of all the networks
+
+    @return: L{loggers.LoggerPipeline}
+    """
+    pipeline = loggers.LoggerPipeline(
+        log_path, [(network['host'], network['channels'])
+                   for network in networks])
+    for shared in (pubsub.hub, directory.directory, history.history):
+        pipeline.add(shared)
+    return pipeline
+
+
+class LogBotFactory(protocol.ReconnectingClientFactory):
+    """
+    Builds the bot for one IRC network.  All the bots log to the same
+    pipeline, their events told apart by their network's host.  The pipeline
+    belongs to the factory, so it carries on buffering while the bot is
+    disconnected.
+
+    When the connection is lost or fails the bot reconnects after a delay
+    that grows exponentially (with some random jitter, so that bots don't
+    all reconnect at once) up to C{maxDelay} seconds, and goes back to
+    C{initialDelay} once the bot has signed on again.
+
+    @ivar disconnected_at: when the connection was lost, if the bot hasn't
+        reconnected since
+    @type disconnected_at: C{float}
+
+    @ivar disconnected_channels: the channels being logged when the
+        connection was lost
+    @type disconnected_channels: C{list}
+    """
+    initialDelay = 1.0
+    jitter = 0.25
+    disconnected_at = None
+    disconnected_channels = ()
+
+    def __init__(self, network=None, pipeline=None, networks=None):
+        """
+        @param network: the network to log - defaults to the first one from
+            L{get_networks}
+        @type network: C{dict}
 
-class LogBotFactory(protocol.ClientFactory):
+        @param pipeline: the loggers to log to - defaults to a new pipeline
+            just for this network
+        @type pipeline: L{loggers.LoggerPipeline}
 
-    def __init__(self):
-        self.channels = settings.IRC_CHANNELS
+        @param networks: all the networks being logged, as returned by
+            L{get_networks}
+        @type networks: C{list}
+        """
+        if network is None:
+            network = get_networks()[0]
+        networks = networks or [network]
+        self.network = network
+        # the channels to join, which can change at runtime
+        self.channels = list(network['channels'])
+        # the bot, while it's connected
+        self.client = None
         self.log_path = settings.LOG_FILE_PATH
-        self.irc_host = settings.IRC_HOST
+        self.irc_host = network['host']
+        self.nickname = network['nick']
+        self.alt_nick = network['alt_nick']
+        if pipeline is None:
+            pipeline = build_pipeline(self.log_path, networks)
+        self.pipeline = pipeline
+        self.presence = presence.Presence()
+        self.roster = roster.Roster()
+        self.mentions = mentions.MentionIndex(
+            getattr(settings, 'MENTIONS_PER_USER', 100),
+            getattr(settings, 'MENTIONS_RETENTION_DAYS', 7))
+        self.watches = watches.WatchRegistry(
+            network_path(getattr(settings, 'WATCHES_PATH', './watches.json'),
+                         network, networks),
+            getattr(settings, 'WATCH_MAX_NOTIFICATIONS', 5),
+            getattr(settings, 'WATCH_NOTIFICATION_PERIOD', 60))
+        self.watches.in_channel = self.in_channel
+        # where the web interface links sent to users point
+        self.web_url = getattr(settings, 'HTTP_URL', 'http://%s:%d' % (
+            settings.HTTP_HOST, settings.HTTP_PORT))
+        self.maxDelay = getattr(settings, 'IRC_RECONNECT_MAX_DELAY', 300)
+        # what the join and part commands change the channels with
+        self.channel_manager = ChannelManager([self])
+
+    def in_channel(self, user, channel):
+        """
+        @return: whether a user is in a channel, according to the roster or,
+            for users who joined while it was being seeded, their presence
+        """
+        return (self.roster.is_in(user, channel) or channel.lower() in
+                [name.lower() for name in self.presence.channels(user)])
+
+    def join_channel(self, channel):
+        """
+        Start logging a channel, joining it now if the bot is connected and
+        whenever it reconnects
+
+        @return: whether the channel wasn't already being logged
+
+        @raise ValueError: if the channel name is not valid
+        """
+        valid_channel(channel)
+        if self.logs_channel(channel):
+            return False
+        self.channels.append(channel)
+        if self.client is not None:
+            self.client.join(channel)
+        return True
+
+    def part_channel(self, channel):
+        """
+        Stop logging a channel
+
+        @return: whether the channel was being logged
+        """
+        for name in self.channels:
+            if name.lower() == (channel or '').lower():
+                self.channels.remove(name)
+                if self.client is not None:
+                    # forgotten once the bot has left - see L{LogBot.left}
+                    self.client.leave(name)
+                else:
+                    self.pipeline.forget(name)
+                return True
+        return False
+
+    def logs_channel(self, channel):
+        """
+        @return: whether the channel is one of the channels being logged
+        """
+        return (channel or '').lower() in [
+            name.lower() for name in self.channels]
 
     def buildProtocol(self, addr):
         p = LogBot()
         p.factory = self
+        p.nickname = self.nickname[:16]
         return p
 
     def clientConnectionLost(self, connector, reason):
-        print "connection failed:", reason
-        connector.connect()
+        log.msg('Connection to %s lost: %s' % (
+            self.irc_host, reason.getErrorMessage()))
+        protocol.ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason)
 
     def clientConnectionFailed(self, connector, reason):
-        print "connection failed:", reason
-        reactor.stop()
+        log.msg('Connecting to %s failed: %s' % (
+            self.irc_host, reason.getErrorMessage()))
+        protocol.ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
@@ -0,0 +1,226 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_directory -*-
+
+"""
+An in-memory directory of the channels that have been logged and the users
+that have been talking in them, kept up to date by the bot, so that web pages
+don't have to facet over the whole index to list them.
+"""
+import json
+import time
+
+from twisted.internet import threads
+from twisted.words.protocols import irc
+
+from elasticsearch import ESLogLine
+from events import MSG_EVENT, CTCPQUERY_EVENT
+
+import settings
+
+
+# the events that make a user active in a channel
+_ACTIVE_EVENTS = (MSG_EVENT, CTCPQUERY_EVENT)
+
+
+def _term(channel):
+    """
+    The channel's name as elasticsearch indexes it - without its '#', in lower
+    case
+    """
+    return channel.lstrip('#').lower()
+
+
+class Directory(object):
+    """
+    The known channels, and the users active in each of them, with the last
+    time each was seen.  It has the same C{log} method as the loggers in
+    L{loggers}, so it can be one of the bot's loggers.
+
+    @ivar active_days: how many days users stay in a channel's list of active
+        users after they were last seen
+    @type active_days: C{int}
+    """
+
+    def __init__(self, channels=(), active_days=30):
+        """
+        @param channels: channels that are known even before any messages
+            have been logged in them
+        @type channels: C{iterable}
+        """
+        self.active_days = active_days
+        # lower case channel name -> [channel name, last seen, users], where
+        # users maps lower case user name -> [user name, last seen]
+        self._channels = {}
+        for channel in channels:
+            self._channel(channel)
+
+    def _channel(self, channel):
+        key = channel.lower()
+        entry = self._channels.get(key)
+        if entry is None:
+            entry = self._channels[key] = [channel, None, {}]
+        return entry
+
+    def _seen(self, channel, user, seen):
+        entry = self._channel(channel)
+        if entry[1] is None or seen > entry[1]:
+            entry[1] = seen
+        if user is not None:
+            users = entry[2]
+            user_entry = users.get(user.lower())
+            if user_entry is None:
+                users[user.lower()] = [user, seen]
+            elif seen >= user_entry[1]:
+                # keep the latest spelling of the name
+                user_entry[:] = [user, seen]
+
+    def log(self, event):
+        if not event.channel or not event.channel.startswith('#'):
+            return
+        user = event.user if event.event in _ACTIVE_EVENTS else None
+        self._seen(event.channel, user, event.time)
+
+    def channels(self):
+        """
+        @return: C{list} of the names of all the known channels, sorted
+        """
+        return sorted((entry[0] for entry in self._channels.itervalues()),
+                      key=lambda name: name.lower())
+
+    def channel_last_seen(self, channel):
+        """
+        @return: when a message was last logged in a channel, or C{None}
+        """
+        return self._channels.get(channel.lower(), [None, None])[1]
+
+    def users(self, channel, now=None):
+        """
+        The users recently active in a channel
+
+        @return: C{list} of C{(user name, last seen)}, most recently seen first
+        """
+        entry = self._channels.get(channel.lower())
+        if entry is None:
+            return []
+        since = (now or time.time()) - self.active_days * 86400
+        users = [(name, seen) for name, seen in entry[2].itervalues()
+                 if seen >= since]
+        users.sort(key=lambda user: -user[1])
+        return users
+
+    def seed_query(self, channels=None, now=None):
+        """
+        The single aggregation that seeds the directory from the index: the
+        last time each channel was logged in, and for each channel the last
+        time each recently active user was seen
+
+        @param channels: the channels to find the users of - defaults to the
+            known channels
+        @type channels: C{list}
+
+        @return: C{dict}, the query
+        """
+        since = (now or time.time()) - self.active_days * 86400
+        facets = {'channels': {'terms_stats': {
+            'key_field': 'channel', 'value_field': 'time', 'size': 0}}}
+        active = {'or': [{'term': {'event': event.lower()}}
+                         for event in _ACTIVE_EVENTS]}
+        for i, channel in enumerate(channels or self.channels()):
+            facets['users%d' % (i,)] = {
+                'terms_stats': {'key_field': 'user', 'value_field': 'time',
+                                'size': 0},
+                'facet_filter': {'and': [
+                    {'term': {'channel': _term(channel)}},
+                    {'range': {'time': {'from': since}}},
+                    active]}}
+        return {'query': {'match_all': {}}, 'facets': facets}
+
+    def seed(self, response, channels=None):
+        """
+        Add what the seed query found to the directory
+
+        @param response: the raw search response to L{seed_query}
+        @type response: C{dict}
+
+        @param channels: the channels the query was made for
+        @type channels: C{list}
+        """
+        channels = channels or self.channels()
+        facets = response.get('facets', {})
+        # elasticsearch analyses channel names, so its terms are only matched
+        # to the channels already known - stores that keep the names as they
+        # are can add channels of their own
+        known = dict((_term(channel), channel) for channel in self.channels())
+        for term in facets.get('channels', {}).get('terms', []):
+            channel = known.get(_term(term['term']))
+            if channel is None and term['term'][:1] in irc.CHANNEL_PREFIXES:
+                channel = term['term']
+            if channel is None:
+                # a piece of a channel name, a private message or the system
+                # log
+                continue
+            self._seen(channel, None, term['max'])
+        for i, channel in enumerate(channels):
+            terms = facets.get('users%d' % (i,), {}).get('terms', [])
+            for term in terms:
+                self._seen(channel, term['term'], term['max'])
+
+    def _fetch(self, channels):
+        return ESLogLine._client.search(
+            ESLogLine._get_index(), ESLogLine._get_doctype(),
+            json.dumps(self.seed_query(channels)), size=1)
+
+    def load(self):
+        """
+        Seed the directory from the index.  The query is run in a thread, but
+        the directory is only updated in the reactor thread, like it is by the
+        bot.
+
+        @return: a Deferred that fires when the directory has been seeded
+        """
+        channels = self.channels()
+        d = threads.deferToThread(self._fetch, channels)
+        d.addCallback(self.seed, channels)
+        return d
+
+
+def configured_channels():
+    """
+    @return: C{list} of the channels the settings say to log, on every network
+        - like L{bot.get_networks}, a network without channels of its own
+        logs C{IRC_CHANNELS}
+    """
+    channels = []
+    for network in getattr(settings, 'IRC_NETWORKS', None) or [{}]:
+        for channel in network.get('channels',
+                                   getattr(settings, 'IRC_CHANNELS', [])):
+            if channel not in channels:
+                channels.append(channel)
+    return channels
+
+
+def default_channel():
+    """
+    @return: the channel web pages show when they aren't asked for one - the
+        first of C{IRC_CHANNELS}, or of the configured or known channels if
+        there aren't any, or C{None} if no channels are known at all
+    """
+    channels = (getattr(settings, 'IRC_CHANNELS', None) or
+                configured_channels() or directory.channels())
+    return channels[0] if channels else None
+
+
+# the directory the bot keeps up to date and the web pages read
+directory = Directory(configured_channels())
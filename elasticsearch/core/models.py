@@ -11,12 +11,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from utils import DoesNotExist, MultipleObjectsReturned
 from utils import parse_query
 
 from utils import QueryStringQuery
 
-from store import ElasticsearchClient
+from store import get_client
 from queryset import ElasticsearchQueryset
 
 
@@ -58,6 +60,46 @@ class ElasticsearchManager(object):
     """
     _model = None
 
+    # how long the result of a health check is trusted for, in seconds
+    _health_check_interval = 10
+    _available = None
+    _available_checked = 0
+
+    def _check_available(self):
+        """
+        the index is available if it is not red, and if it is not being
+        reindexed (the reindexer turns off refreshing while it runs)
+        """
+        client = self._model._client
+        index = self._model._get_index()
+        try:
+            if client.health(index).get('status') == 'red':
+                return False
+            for index_settings in client.get_settings(index).values():
+                index_settings = index_settings.get('settings', {})
+                refresh = index_settings.get(
+                    'index.refresh_interval',
+                    index_settings.get('index', {}).get('refresh_interval'))
+                if str(refresh) == '-1':
+                    return False
+        except Exception:
+            return False
+        return True
+
+    def is_available(self):
+        """
+        whether searches can be expected to succeed and return complete
+        results.  The answer is cached for C{_health_check_interval} seconds.
+
+        @returns: bool
+        """
+        now = time.time()
+        if (self._available is None or
+                now - self._available_checked > self._health_check_interval):
+            self._available = self._check_available()
+            self._available_checked = now
+        return self._available
+
     def _get_queryset(self, query):
         return ElasticsearchQueryset(self._model, query)
 
@@ -76,6 +118,15 @@ class ElasticsearchManager(object):
     def create(self, **kwargs):
         return self._model(**kwargs).save()
 
+    def bulk_create(self, documents):
+        """
+        saves many documents in a single request
+
+        @param: documents - list of dicts or JSON strings, one for each document
+        """
+        return self._model._client.bulk(
+            documents, self._model._get_index(), self._model._get_doctype())
+
     def all(self):
         return self._get_queryset(parse_query('*:*'))
 
@@ -114,7 +165,7 @@ class ElasticsearchModel(object):
 
     _document = None
 
-    _client = ElasticsearchClient()
+    _client = get_client()
 
     objects = ElasticsearchManager()
 
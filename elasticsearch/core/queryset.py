@@ -11,9 +11,69 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import threading
+
 from utils import Facet, build_query, parse_query
 
 
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight,
+    other threads making a call with the same key wait for it and get its
+    result (or exception) instead of making their own.  Nothing is cached once
+    the call returns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [Event, result, exc_info]
+        self._calls = {}
+
+    def in_flight(self):
+        """
+        @returns: int - how many distinct calls are in flight
+        """
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, f, *args, **kwargs):
+        """
+        calls f(*args, **kwargs), unless a call with the same key is already
+        in flight, in which case waits for that call and returns its result
+
+        @param: key - hashable - identifies calls whose results are the same
+        @returns: whatever f returns
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2][0], call[2][1], call[2][2]
+            return call[1]
+
+        try:
+            call[1] = f(*args, **kwargs)
+        except:
+            call[2] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]
+
+
+# identical searches running at the same time, in different threads, share
+# one request to elasticsearch
+_searches = SingleFlight()
+
+
 class ElasticsearchQueryset(object):
     """
     works a lot like django querysets in that they are lazily evaluated,
@@ -132,11 +192,13 @@ class ElasticsearchQueryset(object):
                 results.append(self._model(**hit['_source']))
         return results
 
-    def _parse_raw_response(self, response):
+    def _parse_raw_response(self, response, results=None, facets=None):
         """
         parse out results from raw responses and set up class private vars
 
         @param: response - raw elasticsearch search response
+        @param: results - the results, if they have been parsed already
+        @param: facets - the facets, if they have been parsed already
         @returns: None
         """
         self._raw_response = response
@@ -144,22 +206,37 @@ class ElasticsearchQueryset(object):
         # some stats
         self._time_took = response.get('took')
         self._timed_out = response.get('timed_out')
+        self._total_results = response.get('hits', {}).get('total', 0)
 
         # parse out the list of results
-        self._results = self._parse_results(response)
+        if results is None:
+            results = self._parse_results(response)
+        self._results = list(results)
 
         # parse out any facets
-        self._facets = self._parse_facets(response)
+        if facets is None:
+            facets = self._parse_facets(response)
+        self._facets = facets
 
         self._need_refresh = False
 
+    def _search(self, query):
+        """
+        runs a search and parses it - the parsed results are shared by all
+        the querysets waiting on the same search, so must not be modified
+        """
+        response = self._client.search(self._index, self._doctype, query, order_by=self._order_by, size=self._size, offset=self._offset)
+        return response, self._parse_results(response), self._parse_facets(response)
+
     def _refresh(self):
         """
         evaluates the current query and updates class vars
         """
         query = build_query(self._query, facets=self._faceted_on)
-        response = self._client.search(self._index, self._doctype, query, order_by=self._order_by, size=self._size, offset=self._offset)
-        self._parse_raw_response(response)
+        key = (id(self._client), self._model, self._index, self._doctype,
+               query, self._order_by, self._size, self._offset)
+        response, results, facets = _searches.do(key, self._search, query)
+        self._parse_raw_response(response, results, facets)
 
     def filter(self, query_string=None, **kwargs):
         queries = parse_query(query_string, **kwargs)
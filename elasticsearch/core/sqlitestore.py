@@ -0,0 +1,535 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Embedded SQLite storage engine that can stand in for elasticsearch.
+
+L{SQLiteClient} has the same API as L{store.ElasticsearchClient}, takes the
+same JSON queries (the subset of the query DSL that
+L{utils.build_query} and slogger produce) and returns responses shaped like
+elasticsearch's, so L{queryset.ElasticsearchQueryset} and everything built on
+it works unchanged on top of it.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils import ElasticsearchException
+
+
+# fields that get their own column - anything else a document has is kept as
+# JSON in the 'extra' column
+_COLUMNS = ('time', 'channel', 'user', 'event', 'host', 'message')
+
+# these are matched the way elasticsearch's standard analyzer would (case
+# insensitively, and ignoring the leading '#' of channel names).  Each is also
+# stored normalized that way, in a <field>_term column, so that matching them
+# is a plain comparison that can use an index.
+_TERM_COLUMNS = ('channel', 'user', 'event', 'host')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    docid TEXT NOT NULL UNIQUE,
+    idx TEXT NOT NULL,
+    doctype TEXT NOT NULL,
+    time REAL,
+    channel TEXT,
+    user TEXT,
+    event TEXT,
+    host TEXT,
+    message TEXT,
+    extra TEXT,
+    channel_term TEXT,
+    user_term TEXT,
+    event_term TEXT,
+    host_term TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    message, content='documents', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents
+BEGIN
+    INSERT INTO documents_fts (rowid, message) VALUES (new.rowid, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents
+BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, message)
+        VALUES ('delete', old.rowid, old.message);
+END;
+CREATE INDEX IF NOT EXISTS documents_channel_term_time
+    ON documents (channel_term, time);
+CREATE INDEX IF NOT EXISTS documents_user_term_time
+    ON documents (user_term, time);
+CREATE TABLE IF NOT EXISTS index_settings (
+    idx TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (idx, name)
+);
+"""
+
+# field:value, field:"some value", "a phrase" or a bare term
+_QUERY_STRING_TOKEN_RE = re.compile(
+    r'(?:(?P<field>\w+):)?(?P<value>"[^"]*"|\S+)')
+
+
+def _text(value):
+    """
+    sqlite wants unicode, but messages are whatever bytes a client sent
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _term(value):
+    """
+    a term column's value, normalized the way it is matched
+    """
+    if value is None:
+        return None
+    value = _text(value)
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return value.lstrip(u'#').lower()
+
+
+def _term_condition(field, value):
+    """
+    SQL matching a field against a term
+    """
+    if field in _TERM_COLUMNS:
+        return '%s_term = ?' % (field,), [_term(value)]
+    if field == 'time':
+        return 'time = ?', [float(value)]
+    if field == 'message':
+        return _fts_condition(_fts_term(value))
+    raise ElasticsearchException('Cannot query on field %s' % (field,))
+
+
+def _group_column(field):
+    """
+    the column a terms facet on a field groups by - term fields are grouped
+    by their normalized value, as elasticsearch counts its analyzed terms, so
+    that spellings that only differ in case are counted together
+    """
+    if field in _TERM_COLUMNS:
+        return '%s_term' % (field,)
+    return field
+
+
+def _fts_term(term):
+    """
+    quote a term for an FTS5 MATCH expression - lucene wildcards are only
+    supported at the end of a term
+    """
+    prefix = term.endswith('*')
+    term = term.strip('*?')
+    if not term:
+        return None
+    return '"%s"%s' % (term.replace('"', '""'), prefix and '*' or '')
+
+
+def _fts_condition(expression):
+    if not expression:
+        return '1', []
+    return ('documents.rowid IN (SELECT rowid FROM documents_fts '
+            'WHERE documents_fts MATCH ?)', [expression])
+
+
+def _query_string_condition(query_string):
+    """
+    Translate a lucene query string into SQL.  Free text is matched against
+    the full text index of the message.  field:value terms are matched
+    against their columns, and ANDed with the text.
+    """
+    conditions = []
+    params = []
+    text = []
+    for match in _QUERY_STRING_TOKEN_RE.finditer(_text(query_string)):
+        field, value = match.group('field'), match.group('value')
+        if value.startswith('"'):
+            value = value[1:-1]
+
+        if value in ('*', '*:*'):
+            # matches everything
+            continue
+        elif field and field != 'message':
+            condition, condition_params = _term_condition(field, value)
+            conditions.append(condition)
+            params.extend(condition_params)
+        elif value in ('AND', 'OR', 'NOT'):
+            # operators can only go between two terms
+            if text and text[-1] not in ('AND', 'OR', 'NOT'):
+                text.append(value)
+        elif value.startswith('-') and len(value) > 1:
+            term = _fts_term(value[1:])
+            if text and term:
+                if text[-1] in ('AND', 'OR', 'NOT'):
+                    text.pop()
+                text.extend(['NOT', term])
+        else:
+            term = _fts_term(value.lstrip('+'))
+            if term:
+                text.append(term)
+
+    while text and text[-1] in ('AND', 'OR', 'NOT'):
+        text.pop()
+    if text:
+        condition, condition_params = _fts_condition(' '.join(text))
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    if not conditions:
+        return '1', []
+    return ' AND '.join('(%s)' % c for c in conditions), params
+
+
+def _range_condition(field, bounds):
+    if field not in _COLUMNS:
+        raise ElasticsearchException('Cannot query on field %s' % (field,))
+    conditions = []
+    params = []
+    include_lower = bounds.get('include_lower', True)
+    include_upper = bounds.get('include_upper', True)
+    for key, operator in (('from', include_lower and '>=' or '>'),
+                          ('gte', '>='), ('gt', '>'),
+                          ('to', include_upper and '<=' or '<'),
+                          ('lte', '<='), ('lt', '<')):
+        value = bounds.get(key)
+        if value is not None:
+            if field == 'time':
+                value = float(value)
+            conditions.append('%s %s ?' % (field, operator))
+            params.append(value)
+    if not conditions:
+        return '1', []
+    return ' AND '.join(conditions), params
+
+
+def compile_query(query):
+    """
+    Translate an elasticsearch query or filter into an SQL condition
+
+    @param: query - dict - the query, as produced by L{utils.build_query}
+    @returns: tuple - (SQL condition, list of parameters)
+    """
+    conditions = []
+    params = []
+
+    def add(condition, condition_params):
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    for kind, body in query.iteritems():
+        if kind == 'match_all':
+            add('1', [])
+        elif kind == 'query_string':
+            add(*_query_string_condition(body['query']))
+        elif kind == 'term':
+            for field, value in body.iteritems():
+                add(*_term_condition(field, value))
+        elif kind == 'range':
+            for field, bounds in body.iteritems():
+                add(*_range_condition(field, bounds))
+        elif kind in ('query', 'filter', 'constant_score'):
+            add(*compile_query(body))
+        elif kind == 'filtered':
+            for part in ('query', 'filter'):
+                if part in body:
+                    add(*compile_query(body[part]))
+        elif kind in ('and', 'or'):
+            parts = [compile_query(part) for part in body]
+            if parts:
+                add((' %s ' % kind.upper()).join(
+                    '(%s)' % part[0] for part in parts),
+                    [p for part in parts for p in part[1]])
+        elif kind == 'not':
+            condition, condition_params = compile_query(body)
+            add('NOT (%s)' % (condition,), condition_params)
+        else:
+            raise ElasticsearchException('Unsupported query: %s' % (kind,))
+
+    if not conditions:
+        return '1', []
+    return ' AND '.join('(%s)' % c for c in conditions), params
+
+
+class SQLiteClient(object):
+    """
+    Minimum-Viable elasticsearch python client, backed by SQLite.
+
+    Every thread (and process) gets its own connection to the database, which
+    is in WAL mode so searches are not blocked by the buffered loggers'
+    writes.
+    """
+    _debug = False
+
+    def __init__(self, path, timeout=None, debug=False):
+        self._path = path
+        self._timeout = timeout or 10
+        self._debug = debug
+        self._local = threading.local()
+
+    def _connection(self):
+        """
+        returns this thread's connection, creating the database if needed
+        """
+        conn = getattr(self._local, 'connection', None)
+        # connections can't be shared with processes forked from this one
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=self._timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, params=()):
+        if self._debug:
+            print 'sql: %s %r' % (sql, params)
+        return self._connection().execute(sql, params)
+
+    def _insert(self, conn, doc, index, doctype, docid=None):
+        if isinstance(doc, basestring):
+            doc = json.loads(doc)
+        docid = docid and str(docid) or uuid.uuid4().hex
+        extra = dict((k, v) for k, v in doc.iteritems() if k not in _COLUMNS)
+        conn.execute('DELETE FROM documents WHERE docid = ?', (docid,))
+        conn.execute(
+            'INSERT INTO documents (docid, idx, doctype, %s, extra, %s) '
+            'VALUES (?, ?, ?, %s, ?, %s)' % (
+                ', '.join(_COLUMNS),
+                ', '.join('%s_term' % (c,) for c in _TERM_COLUMNS),
+                ', '.join('?' for c in _COLUMNS),
+                ', '.join('?' for c in _TERM_COLUMNS)),
+            [docid, index, doctype] + [_text(doc.get(c)) for c in _COLUMNS] +
+            [extra and json.dumps(extra) or None] +
+            [_term(doc.get(c)) for c in _TERM_COLUMNS])
+        return docid
+
+    def _source(self, row):
+        """
+        turn a row (of the columns in _COLUMNS, followed by extra) back into a
+        document
+        """
+        source = dict(zip(_COLUMNS, row[:len(_COLUMNS)]))
+        if row[len(_COLUMNS)]:
+            source.update(json.loads(row[len(_COLUMNS)]))
+        return source
+
+    def _where(self, index, doctype, query):
+        condition, params = compile_query(query or {'match_all': {}})
+        where = 'idx = ?'
+        where_params = [index]
+        if doctype:
+            where += ' AND doctype = ?'
+            where_params.append(doctype)
+        return ('%s AND (%s)' % (where, condition), where_params + params)
+
+    def _facet(self, name, facet, where, params):
+        """
+        computes a terms or terms_stats facet over the rows matching a query
+        """
+        if 'facet_filter' in facet:
+            condition, condition_params = compile_query(facet['facet_filter'])
+            where = '%s AND (%s)' % (where, condition)
+            params = params + condition_params
+
+        if 'terms' in facet:
+            field = facet['terms']['field']
+            size = facet['terms'].get('size', 10)
+            if field not in _COLUMNS:
+                raise ElasticsearchException('Cannot facet on %s' % (field,))
+            rows = self._execute(
+                'SELECT min(%s), count(*) FROM documents WHERE %s AND %s IS '
+                'NOT NULL GROUP BY %s ORDER BY count(*) DESC LIMIT ?' % (
+                    field, where, field, _group_column(field)),
+                params + [size]).fetchall()
+            return {'_type': 'terms',
+                    'terms': [{'term': term, 'count': count}
+                              for term, count in rows]}
+
+        if 'terms_stats' in facet:
+            key = facet['terms_stats']['key_field']
+            value = facet['terms_stats']['value_field']
+            size = facet['terms_stats'].get('size', 10)
+            if key not in _COLUMNS or value not in _COLUMNS:
+                raise ElasticsearchException('Cannot facet on %s' % (name,))
+            rows = self._execute(
+                'SELECT min(%s), count(*), min(%s), max(%s), total(%s) '
+                'FROM documents WHERE %s AND %s IS NOT NULL GROUP BY %s '
+                'ORDER BY count(*) DESC LIMIT ?' % (
+                    key, value, value, value, where, key,
+                    _group_column(key)),
+                params + [size or -1]).fetchall()
+            return {'_type': 'terms_stats',
+                    'terms': [{'term': term, 'count': count, 'min': low,
+                               'max': high, 'total': total,
+                               'mean': total / count}
+                              for term, count, low, high, total in rows]}
+
+        raise ElasticsearchException('Unsupported facet: %s' % (name,))
+
+    def search(self, index, doctype, query, order_by=None, size=None,
+               offset=None):
+        """
+        returns a search response shaped like elasticsearch's, don't use this
+        directly
+
+        @param: index - index name
+        @param: doctype - type of the document
+        @param: query - JSON
+        @param: order_by - string - 'field:asc' or 'field:desc'
+        @param: size - max amount of documents returned
+        @param: offset - which document to start returning results from
+
+        @returns: dict, search response
+        """
+        try:
+            return self._search(index, doctype, query, order_by, size, offset)
+        except sqlite3.OperationalError as e:
+            # most likely a query the full text index can't parse - report it
+            # the same way elasticsearch reports bad queries
+            raise ElasticsearchException(
+                'SearchPhaseExecutionException[%s]' % (e,))
+
+    def _search(self, index, doctype, query, order_by, size, offset):
+        start = time.time()
+        if isinstance(query, basestring):
+            query = json.loads(query)
+        query = query or {}
+        where, params = self._where(index, doctype, query.get('query'))
+
+        total = self._execute(
+            'SELECT count(*) FROM documents WHERE %s' % (where,),
+            params).fetchone()[0]
+
+        order = ''
+        if order_by:
+            field, _, direction = order_by.partition(':')
+            if field not in _COLUMNS:
+                raise ElasticsearchException('Cannot sort on %s' % (field,))
+            order = ' ORDER BY %s %s' % (
+                field, direction.lower() == 'desc' and 'DESC' or 'ASC')
+
+        rows = self._execute(
+            'SELECT docid, %s, extra FROM documents WHERE %s%s '
+            'LIMIT ? OFFSET ?' % (', '.join(_COLUMNS), where, order),
+            params + [size or 10, offset or 0]).fetchall()
+
+        facets = {}
+        for name, facet in query.get('facets', {}).iteritems():
+            facets[name] = self._facet(name, facet, where, params)
+
+        response = {
+            'took': int((time.time() - start) * 1000),
+            'timed_out': False,
+            'hits': {
+                'total': total,
+                'hits': [{'_index': index, '_type': doctype, '_id': row[0],
+                          '_source': self._source(row[1:])}
+                         for row in rows]}}
+        if facets:
+            response['facets'] = facets
+        return response
+
+    def get(self, index, doctype, docid):
+        row = self._execute(
+            'SELECT docid, %s, extra FROM documents WHERE idx = ? AND '
+            'doctype = ? AND docid = ?' % (', '.join(_COLUMNS),),
+            (index, doctype, str(docid))).fetchone()
+        if row is None:
+            return {'_index': index, '_type': doctype, '_id': docid,
+                    'exists': False}
+        return {'_index': index, '_type': doctype, '_id': row[0],
+                'exists': True, '_source': self._source(row[1:])}
+
+    def optimize(self, index=None):
+        with self._connection() as conn:
+            conn.execute("INSERT INTO documents_fts (documents_fts) "
+                         "VALUES ('optimize')")
+            conn.execute('ANALYZE')
+        return {'ok': True}
+
+    def refresh(self, index=None):
+        # documents are searchable as soon as they are committed
+        return {'ok': True}
+
+    def delete_by_id(self, index, doctype, docid):
+        with self._connection() as conn:
+            deleted = conn.execute(
+                'DELETE FROM documents WHERE idx = ? AND doctype = ? AND '
+                'docid = ?', (index, doctype, str(docid))).rowcount
+        return {'ok': True, 'found': bool(deleted), '_id': docid}
+
+    def delete_by_query(self, index, doctype, query):
+        if isinstance(query, basestring):
+            query = json.loads(query)
+        where, params = self._where(index, doctype, query)
+        with self._connection() as conn:
+            conn.execute('DELETE FROM documents WHERE %s' % (where,), params)
+        return {'ok': True}
+
+    def create_index(self, index, mapping=None):
+        # the schema is fixed, and is created with the connection
+        self._connection()
+        return {'ok': True, 'acknowledged': True}
+
+    def delete_index(self, index):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM documents WHERE idx = ?', (index,))
+            conn.execute('DELETE FROM index_settings WHERE idx = ?', (index,))
+        return {'ok': True, 'acknowledged': True}
+
+    def index(self, doc, index, doctype, docid=None, parent=None):
+        with self._connection() as conn:
+            docid = self._insert(conn, doc, index, doctype, docid)
+        return {'ok': True, '_index': index, '_type': doctype, '_id': docid}
+
+    def bulk(self, docs, index, doctype, docids=None):
+        """
+        indexes many documents in a single transaction
+        """
+        start = time.time()
+        items = []
+        with self._connection() as conn:
+            for i, doc in enumerate(docs):
+                docid = self._insert(conn, doc, index, doctype,
+                                     docids and docids[i])
+                items.append({'index': {'_index': index, '_type': doctype,
+                                        '_id': docid, 'ok': True}})
+        return {'took': int((time.time() - start) * 1000), 'items': items}
+
+    def health(self, index=None):
+        self._execute('SELECT 1').fetchone()
+        return {'status': 'green', 'timed_out': False}
+
+    def get_settings(self, index):
+        rows = self._execute(
+            'SELECT name, value FROM index_settings WHERE idx = ?',
+            (index,)).fetchall()
+        return {index: {'settings': dict(
+            ('index.%s' % (name,), value) for name, value in rows)}}
+
+    def update_settings(self, index, index_settings):
+        with self._connection() as conn:
+            for name, value in index_settings.get('index', {}).iteritems():
+                conn.execute(
+                    'INSERT OR REPLACE INTO index_settings (idx, name, value) '
+                    'VALUES (?, ?, ?)', (index, name, str(value)))
+        return {'ok': True}
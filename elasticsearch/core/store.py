@@ -316,3 +316,85 @@ class ElasticsearchClient(object):
 
         response = self._request(request_type, url, body=doc)
         return response
+
+    def bulk(self, docs, index, doctype, docids=None):
+        """
+        indexes many documents in a single request using the bulk API
+
+        @param: docs - list of JSON strings or JSON serializable dictionaries - the documents to be indexed
+        @param: index - index name
+        @param: doctype - type of the document
+        @param: docids - optional list of ids, one for each document
+
+        @returns: dict - JSON loaded response
+        """
+        lines = []
+        for i, doc in enumerate(docs):
+            action = {'_index': index, '_type': doctype}
+            if docids:
+                action['_id'] = docids[i]
+            if type(doc) == dict:
+                doc = json.dumps(doc)
+            lines.append(json.dumps({'index': action}))
+            lines.append(doc)
+
+        url = '/_bulk'
+        response = self._request('POST', url, body='\n'.join(lines) + '\n')
+        return response
+
+    def health(self, index=None):
+        """
+        gets the health of the cluster, or of an index
+
+        @param: index - string - the name of the index
+
+        @returns: dict - JSON loaded response
+        """
+        if index:
+            url = '/_cluster/health/%s' % (index)
+        else:
+            url = '/_cluster/health'
+
+        response = self._request('GET', url)
+        return response
+
+    def get_settings(self, index):
+        """
+        gets the settings of an index
+
+        @param: index - index name
+
+        @returns: dict - JSON loaded response
+        """
+        url = '/%s/_settings' % (index)
+        response = self._request('GET', url)
+        return response
+
+    def update_settings(self, index, index_settings):
+        """
+        updates the settings of an index, for instance the refresh interval
+
+        @param: index - index name
+        @param: index_settings - JSON serializable dict - the settings to change
+
+        @returns: dict - JSON loaded response
+        """
+        url = '/%s/_settings' % (index)
+        response = self._request('PUT', url, body=json.dumps(index_settings))
+        return response
+
+
+def get_client():
+    """
+    Returns a client for the search backend selected by settings.SEARCH_BACKEND
+    - either 'elasticsearch' (the default) or 'sqlite'
+    """
+    backend = getattr(settings, 'SEARCH_BACKEND', 'elasticsearch')
+    if backend == 'sqlite':
+        from sqlitestore import SQLiteClient
+        return SQLiteClient(settings.SQLITE_PATH,
+                            timeout=settings.ELASTICSEARCH_TIMEOUT,
+                            debug=settings.DEBUG)
+    if backend != 'elasticsearch':
+        raise ValueError('unknown SEARCH_BACKEND %r' % (backend,))
+    return ElasticsearchClient()
@@ -0,0 +1,287 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_history -*-
+
+"""
+The most recent events of each channel, kept in memory by the bot so that
+recent history can be read by the bot and the web pages without querying the
+search index.
+"""
+import time
+from array import array
+
+import settings
+
+
+class RingBuffer(object):
+    """
+    A fixed number of the most recent events of a channel, in time order.
+    Their times are kept in an array of their own, which is bisected to find
+    the events in a time range.
+
+    @ivar since: the time from which every event is in the buffer - when it
+        was created, or the time of the last event to be pushed out of it
+    @type since: C{float}
+    """
+
+    def __init__(self, capacity, since=None):
+        """
+        @param capacity: how many events to keep
+        @type capacity: C{int}
+
+        @param since: when events started being added - defaults to now
+        @type since: C{float}
+        """
+        self.capacity = capacity
+        self.since = time.time() if since is None else since
+        self._times = array('d', [0.0] * capacity)
+        self._events = [None] * capacity
+        # where the oldest event is, and how many there are
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _time(self, i):
+        return self._times[(self._start + i) % self.capacity]
+
+    def append(self, event):
+        """
+        Add an event, pushing out the oldest if the buffer is full
+        """
+        when = event.time
+        if self._count and when < self._time(self._count - 1):
+            # the clock went backwards - keep the times sorted
+            when = self._time(self._count - 1)
+        if self._count == self.capacity:
+            self.since = self._times[self._start]
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+        i = (self._start + self._count) % self.capacity
+        self._times[i] = when
+        self._events[i] = event
+        self._count += 1
+
+    def _bisect(self, when, right):
+        """
+        The position of the first event after C{when}, or at or after it if
+        not C{right}
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            t = self._time(middle)
+            if t < when or (right and t == when):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _events_between(self, first, last):
+        return [self._events[(self._start + i) % self.capacity]
+                for i in xrange(first, last)]
+
+    def covers(self, start):
+        """
+        @return: whether every event from C{start} onwards is in the buffer
+        """
+        return start is not None and start > self.since
+
+    def between(self, start=None, end=None):
+        """
+        @return: C{list} of the events with times from C{start} to C{end},
+            inclusive, oldest first
+        """
+        first = 0 if start is None else self._bisect(start, False)
+        last = self._count if end is None else self._bisect(end, True)
+        return self._events_between(first, max(first, last))
+
+    def last(self, count, kinds=None):
+        """
+        @param kinds: the kinds of event to return - all of them, if C{None}
+        @type kinds: C{tuple} of L{events.EVENTS}
+
+        @return: C{list} of the last C{count} events, oldest first
+        """
+        if kinds is None:
+            return self._events_between(max(0, self._count - count),
+                                        self._count)
+        found = []
+        for i in xrange(self._count - 1, -1, -1):
+            if len(found) == count:
+                break
+            event = self._events[(self._start + i) % self.capacity]
+            if event.event in kinds:
+                found.append(event)
+        found.reverse()
+        return found
+
+
+class HistoryQueryset(object):
+    """
+    A queryset over events from a L{RingBuffer}, with the same iteration,
+    slicing and facet interface as
+    L{elasticsearch.core.queryset.ElasticsearchQueryset}, so it can stand in
+    for it when the history has all the events asked for.
+    """
+
+    def __init__(self, events):
+        """
+        @param events: the events, oldest first
+        @type events: C{list} of L{loggers.LogEvent}
+        """
+        self._events = events
+        self._faceted_on = []
+        self._size = 100
+        self._offset = 0
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __list__(self):
+        return self.results
+
+    def __repr__(self):
+        return str(self.__list__())
+
+    def __getitem__(self, index):
+        if not isinstance(index, (slice, int, long)):
+            raise TypeError
+        if type(index) == slice:
+            if index.start:
+                self._offset = index.start
+            if index.stop:
+                self._size = index.stop - self._offset
+            return self
+        return self.results[index]
+
+    def filter(self, query_string=None, **kwargs):
+        if query_string:
+            raise ValueError('history can only be filtered by term')
+        self._events = [event for event in self._events
+                        if all(getattr(event, key) == value
+                               for key, value in kwargs.iteritems())]
+        return self
+
+    def order_by(self, order_by):
+        """
+        history is always in time order, so only sorting by time ascending is
+        supported
+        """
+        if order_by != 'time':
+            raise ValueError('history can only be ordered by time')
+        return self
+
+    def facet(self, facet):
+        if facet and type(facet) != list:
+            facet = [facet]
+        self._faceted_on.extend(str(f) for f in facet)
+        return self
+
+    def limit(self, limit):
+        self._size = limit
+        return self
+
+    def count(self):
+        return len(self.results)
+
+    @property
+    def results(self):
+        return self._events[self._offset:self._offset + self._size]
+
+    @property
+    def facets(self):
+        facets = {}
+        for field in self._faceted_on:
+            counts = {}
+            for event in self._events:
+                value = getattr(event, field)
+                counts[value] = counts.get(value, 0) + 1
+            # same as the default size of an elasticsearch terms facet
+            facets[field] = sorted(counts.items(),
+                                   key=lambda item: -item[1])[:10]
+        return facets
+
+
+class History(object):
+    """
+    A L{RingBuffer} for each channel.  It has the same C{log} method as the
+    loggers in L{loggers}, so it can be one of the bot's loggers.
+
+    The buffers are only modified by the bot, in the reactor thread, so they
+    should only be read from the reactor thread too.
+    """
+
+    def __init__(self, capacity=5000):
+        """
+        @param capacity: how many events to keep for each channel
+        @type capacity: C{int}
+        """
+        self.capacity = capacity
+        self._started = time.time()
+        self._buffers = {}
+
+    def log(self, event):
+        if not event.channel:
+            return
+        key = event.channel.lower()
+        buf = self._buffers.get(key)
+        if buf is None:
+            # every event since the history started has been seen, even if
+            # none were for this channel
+            buf = self._buffers[key] = RingBuffer(self.capacity,
+                                                  self._started)
+        buf.append(event)
+
+    def _buffer(self, channel):
+        return self._buffers.get(channel.lower())
+
+    def covers(self, channel, start):
+        """
+        @return: whether the history has every event of the channel from
+            C{start} onwards - never for a channel nothing has been logged in
+            since the history started, which may not be logged at all
+        """
+        buf = self._buffer(channel)
+        return buf is not None and buf.covers(start)
+
+    def between(self, channel, start=None, end=None):
+        """
+        @return: C{list} of the events of the channel from C{start} to C{end},
+            oldest first
+        """
+        buf = self._buffer(channel)
+        return buf.between(start, end) if buf is not None else []
+
+    def last(self, channel, count, kinds=None):
+        """
+        @return: C{list} of the last C{count} events of the channel (of the
+            given kinds), oldest first
+        """
+        buf = self._buffer(channel)
+        return buf.last(count, kinds) if buf is not None else []
+
+    def queryset(self, channel, start, end=None):
+        """
+        @return: a L{HistoryQueryset} of the channel's events from C{start} to
+            C{end}, or C{None} if the history doesn't have all of them
+        """
+        if not self.covers(channel, start):
+            return None
+        return HistoryQueryset(self.between(channel, start, end))
+
+
+# the history the bot keeps and the bot commands and web pages read
+history = History(getattr(settings, 'HISTORY_SIZE', 5000))
@@ -16,11 +16,17 @@
 """
 Loggers that log IRC messages
 """
+import json
+import os
 import time
+from collections import OrderedDict
 
 from twisted.internet import defer, threads
 from twisted.python import log, logfile
+from twisted.words.protocols import irc
 
+import logreader
+import settings
 from elasticsearch import ESLogLine
 from twisted.internet.task import LoopingCall
 
@@ -29,6 +35,122 @@ class LoggingException(Exception):
     pass
 
 
+# the last time string formatted, as (second, string) - every event logged in
+# the same second shares it
+_last_time_string = (None, None)
+
+
+def _format_time(event_time):
+    """
+    Format a time as per C{time.asctime}, reusing the previous result if it
+    was for the same second
+    """
+    global _last_time_string
+    second = int(event_time)
+    cached_second, time_string = _last_time_string
+    if cached_second != second:
+        time_string = time.asctime(time.localtime(event_time))
+        _last_time_string = (second, time_string)
+    return time_string
+
+
+class LogEvent(object):
+    """
+    An immutable record of something that happened on IRC, built once by
+    L{bot.LogBot.writeLog} and shared by all the loggers.  Its text and JSON
+    forms are only formatted once, the first time a logger asks for them.
+
+    @ivar time: the time of the event in seconds since the Epoch.
+    @type time: C{float}
+
+    @ivar user: the user who caused the event
+    @type user: C{str}
+
+    @ivar channel: the name of the channel the event happened on
+    @type channel: C{str}
+
+    @ivar event: the kind of event, one of L{events.EVENTS}
+    @type event: C{str}
+
+    @ivar host: the IRC server the event happened on
+    @type host: C{str}
+
+    @ivar message: the message data
+    @type message: C{str}
+    """
+    __slots__ = ('time', 'user', 'channel', 'event', 'host', 'message',
+                 '_text', '_json')
+
+    def __init__(self, event_time, user, channel, event, host, message=None):
+        set_slot = super(LogEvent, self).__setattr__
+        set_slot('time', event_time)
+        set_slot('user', user)
+        set_slot('channel', channel)
+        set_slot('event', event)
+        set_slot('host', host)
+        set_slot('message', message)
+        set_slot('_text', None)
+        set_slot('_json', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('LogEvent is immutable')
+
+    def __iter__(self):
+        """
+        Iterates over the fields, in the order the constructor takes them
+        """
+        return iter((self.time, self.user, self.channel, self.event,
+                     self.host, self.message))
+
+    def __repr__(self):
+        return '<LogEvent %s>' % (self.text,)
+
+    @property
+    def time_string(self):
+        """
+        The time of the event, formatted by C{time.asctime}
+        """
+        return _format_time(self.time)
+
+    @property
+    def text(self):
+        """
+        The event as a line of text for log files
+        """
+        if self._text is None:
+            super(LogEvent, self).__setattr__(
+                '_text', '[%s] %s :  <%s> %s (%s) @ %s' % (
+                    self.channel, self.time_string, self.user, self.event,
+                    self.message, self.host))
+        return self._text
+
+    @property
+    def document(self):
+        """
+        The event as a (new) dictionary, for indexing
+        """
+        return {'message': self.message,
+                'user': self.user,
+                'channel': self.channel,
+                'time': self.time,
+                'host': self.host,
+                'event': self.event}
+
+    @property
+    def json(self):
+        """
+        The event's document serialized as JSON
+        """
+        if self._json is None:
+            document = self.document
+            for key, value in document.iteritems():
+                # anything a client sent could end up in here
+                if isinstance(value, str):
+                    document[key] = value.decode('utf-8', 'replace')
+            super(LogEvent, self).__setattr__('_json', json.dumps(document))
+        return self._json
+
+
 class BaseLogger_Mixin(object):
 
     def stringify(self, event_time, user, channel, event, host, message):
@@ -47,8 +169,7 @@ class BaseLogger_Mixin(object):
         @param channel: the name of the channel the message was sent on
         @type channel: c{str}
         """
-        time_string = time.asctime(time.localtime(event_time))
-        return '[%s] %s :  <%s> %s (%s) @ %s' % (channel, time_string, user, event, message, host)
+        return LogEvent(event_time, user, channel, event, host, message).text
 
     def dictify(self, event_time, user, channel, event, host, message):
         """
@@ -66,38 +187,38 @@ class BaseLogger_Mixin(object):
         @param channel: the name of the channel the message was sent on
         @type channel: c{str}
         """
-
-        return {'message': message,
-                'user': user,
-                'channel': channel,
-                'time': event_time,
-                'host': host,
-                'event': event}
+        return LogEvent(
+            event_time, user, channel, event, host, message).document
 
 
 class PyLogger(BaseLogger_Mixin):
     """
     Logger that logs messages to stdout
     """
-    def log(self, *args):
+    def log(self, event):
         """
-        Logs message, formatted as per L{message_to_string}
+        Logs a L{LogEvent}, formatted as per L{LogEvent.text}
         """
-        log.msg(self.stringify(*args))
+        log.msg(event.text)
 
 
 class SearchLogger(BaseLogger_Mixin):
     """
     Logger that logs messages to elasticsearch
     """
-    def log(self, *args):
-        ESLogLine.objects.create(**self.dictify(*args))
+    def log(self, event):
+        ESLogLine.objects.create(**event.document)
 
 
 class DailyFileLogger(logfile.DailyLogFile, BaseLogger_Mixin):
     """
     Logger logs everything to one file - it rotates daily
 
+    Alongside the log file it maintains a sidecar index (see
+    L{logreader.index_range}) mapping each minute of the day to the byte
+    offset of the first message logged in that minute, so that readers can
+    jump straight to a time range.  The index is rotated with the log file.
+
     Initialization is inherited from DailyLogFile:
 
     @param name: name of the file
@@ -110,11 +231,64 @@ class DailyFileLogger(logfile.DailyLogFile, BaseLogger_Mixin):
         current permissions of the file if the file exists.
     @type defaultMode: C{int}
     """
-    def log(self, *args):
+    _index_file = None
+
+    def _openFile(self):
+        """
+        Open the log file - the index file is only opened when it is first
+        written to
+        """
+        logfile.DailyLogFile._openFile(self)
+        self._close_index()
+        self._index_path = self.path + logreader.INDEX_SUFFIX
+        self._last_minute = None
+
+    def _close_index(self):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def close(self):
+        logfile.DailyLogFile.close(self)
+        self._close_index()
+
+    def rotate(self):
         """
-        Logs message, formatted as per L{message_to_string}
+        Rotate the log file, and its index along with it
         """
-        self.write('%s\n' % self.stringify(*args))
+        newpath = "%s.%s" % (self.path, self.suffix(self.lastDate))
+        already_rotated = os.path.exists(newpath)
+        logfile.DailyLogFile.rotate(self)
+        if (not already_rotated and os.path.exists(newpath) and
+                os.path.exists(self._index_path)):
+            os.rename(self._index_path, newpath + logreader.INDEX_SUFFIX)
+
+    def _index(self, event_time):
+        """
+        Record the current offset in the index if this is the first message
+        logged in its minute
+        """
+        minute = logreader.minute_of_day(event_time, self.lastDate)
+        if self._last_minute is None:
+            self._last_minute = logreader.last_indexed_minute(
+                self._index_path)
+        if minute > self._last_minute:
+            if self._index_file is None:
+                self._index_file = open(self._index_path, 'ab', 0)
+            self._index_file.write(
+                logreader.pack_index_record(minute, self._file.tell()))
+            self._last_minute = minute
+
+    def log(self, event):
+        """
+        Logs a L{LogEvent}, formatted as per L{LogEvent.text}
+        """
+        # rotate before indexing, so the offset is recorded in the new file
+        if self.shouldRotate():
+            self.flush()
+            self.rotate()
+        self._index(event.time)
+        self.write('%s\n' % (event.text,))
 
 
 class MultiChannelFileLogger(BaseLogger_Mixin):
@@ -122,19 +296,27 @@ class MultiChannelFileLogger(BaseLogger_Mixin):
     Logger that logs every channel's messages to a different file, which is
     rotated daily.  The exception is system messages, which will be logged to
     its own file, but rotated based on length.
+
+    A channel's file is opened the first time something is logged to it, so
+    channels joined at runtime are logged like the others.  Only the
+    C{max_open} most recently used files are kept open - the others are
+    closed, and opened again when they are next logged to.
     """
 
     def __init__(self, directory, channels=None, defaultMode=None,
-                 systemRotateLength=1000000):
+                 systemRotateLength=1000000, max_open=None,
+                 system_name='system.logs'):
         """
-        Creates one L{DailyFileLogger} logger for each channel in the list,
-        and one L{twisted.python.logfile.LogFile} (which rotates based on
-        the length of the file) for system messages.
+        Creates one L{twisted.python.logfile.LogFile} (which rotates based on
+        the length of the file) for system messages.  A L{DailyFileLogger} is
+        created for each channel when it is first logged to.
 
         @param directory: path where all the log files should go
         @type directory: C{str}
 
-        @param channels: a list of channel names
+        @param channels: a list of channel names - events for these are
+            logged to their own files even if their names don't start like
+            channel names
         @type channels: C{list}
 
         @param defaultMode: mode used to create the files.
@@ -143,34 +325,79 @@ class MultiChannelFileLogger(BaseLogger_Mixin):
         @param systemRotateLength: size of the system log file where it
             rotates. Default to 1M.
         @type rotateLength: C{int}
+
+        @param max_open: how many channel files to keep open at once -
+            defaults to C{settings.LOG_MAX_OPEN_FILES}
+        @type max_open: C{int}
+
+        @param system_name: the name of the system log file - processes
+            logging to the same directory each need their own
+        @type system_name: C{str}
         """
         self._directory = directory
+        self._defaultMode = defaultMode
         self._system_logger = logfile.LogFile(
-            'system.logs', directory, systemRotateLength, defaultMode)
+            system_name, directory, systemRotateLength, defaultMode)
+        self.max_open = max_open or getattr(settings, 'LOG_MAX_OPEN_FILES',
+                                            100)
 
-        self._channel_loggers = {}
-        for channel_name in channels:
-            self._channel_loggers[channel_name] = DailyFileLogger(
-                channel_name, directory, defaultMode)
+        # lower case channel name -> the name its file is named after
+        self._names = dict((channel_name.lower(), channel_name)
+                           for channel_name in channels or ())
+        # channel name -> its logger, least recently used first
+        self._channel_loggers = OrderedDict()
 
     def __str__(self):
-        return ("Message Logger for channels %s in directory %d" %
-            (', '.join(self._channel_loggers.keys()), self._directory))
+        return ("Message Logger for channels %s in directory %s" %
+            (', '.join(self._names.values()), self._directory))
 
-    def log(self, event_time, user, channel, event, host, message):
+    def _channel_name(self, channel):
         """
-        If the channel is in the list of channels this logger was initialized
-        with, log to the channel's corresponding L{DailyFileLogger}.
-        Otherwise, log message as formatted as per L{message_to_string} to the
-        system log file.
+        @return: the name of the channel's file, or C{None} if the channel
+            isn't one
         """
-        if channel in self._channel_loggers:
-            self._channel_loggers[channel].log(event_time, user, channel, event, host, message)
+        if not channel:
+            return None
+        name = self._names.get(channel.lower())
+        if name is None and channel[0] in irc.CHANNEL_PREFIXES:
+            # the first spelling seen names the file
+            name = self._names[channel.lower()] = channel
+        return name
+
+    def _channel_logger(self, name):
+        channel_logger = self._channel_loggers.pop(name, None)
+        if channel_logger is None:
+            while len(self._channel_loggers) >= self.max_open:
+                self._channel_loggers.popitem(last=False)[1].close()
+            channel_logger = DailyFileLogger(
+                name, self._directory, self._defaultMode)
+        self._channel_loggers[name] = channel_logger
+        return channel_logger
+
+    def forget(self, channel):
+        """
+        Stop keeping track of a channel that is no longer logged, closing its
+        file - it is named afresh if it is ever logged again
+        """
+        name = self._names.pop((channel or '').lower(), None)
+        channel_logger = self._channel_loggers.pop(name, None)
+        if channel_logger is not None:
+            channel_logger.close()
+
+    def log(self, event):
+        """
+        If the event's channel is one of the channels this logger was
+        initialized with, or any other channel, log to the channel's
+        corresponding L{DailyFileLogger}.  Otherwise, log the event as
+        formatted as per L{LogEvent.text} to the system log file.
+        """
+        name = self._channel_name(event.channel)
+        if name is not None:
+            self._channel_logger(name).log(event)
         else:
-            formatted_message = ('%s\n' %
-                (self.stringify(event_time, user, channel, event, host, message),))
+            formatted_message = '%s\n' % (event.text,)
 
-            if channel != 'SYSTEM_LOG':
+            if event.channel != 'SYSTEM_LOG':
                 formatted_message = (
                     '-- Received message from unknown channel:\n\t%s' %
                     (formatted_message,))
@@ -196,14 +423,29 @@ class BufferedLogger_Mixin(object):
 
         self._buffer = []
 
+        failed = []
         for msg in newbuffer:
             try:
                 yield threads.deferToThread(
-                    super(self.__class__, self).log, *msg)
+                    super(self.__class__, self).log, msg)
 
             except Exception as e:
-                log('FILE LOGGING FAILED - log: %s excepton: %s' % (log, e))
-                self._buffer.append(msg)
+                log.msg('FILE LOGGING FAILED - log: %s excepton: %s' %
+                        (self, e))
+                failed.append(msg)
+        # they are tried again before anything logged since, to keep the
+        # order
+        self._buffer[:0] = failed
+
+    def stop(self):
+        """
+        Stop flushing every interval, and flush whatever is left
+
+        @return: a Deferred that fires once it has been flushed
+        """
+        if self.loop.running:
+            self.loop.stop()
+        return self.flush()
 
 
 class BufferedMultiChannelFileLogger(MultiChannelFileLogger,
@@ -214,7 +456,8 @@ class BufferedMultiChannelFileLogger(MultiChannelFileLogger,
     """
 
     def __init__(self, directory, channels=None, interval=5, defaultMode=None,
-                 systemRotateLength=1000000):
+                 systemRotateLength=1000000, max_open=None,
+                 system_name='system.logs'):
         """
         Same as the initialization for MultiChannelFileLogger, except it takes
         an extra parameter that specifies the interval at which the logs will
@@ -225,24 +468,50 @@ class BufferedMultiChannelFileLogger(MultiChannelFileLogger,
         @type interval: C{int}
         """
         super(BufferedMultiChannelFileLogger, self).__init__(
-            directory, channels, defaultMode, systemRotateLength)
+            directory, channels, defaultMode, systemRotateLength, max_open,
+            system_name)
         self._writeInterval = interval
         self._buffer = []
+        # flushes and forgets change the open files and the table of names
+        # in threads, so only one can run at a time
+        self._lock = defer.DeferredLock()
         self.loop = LoopingCall(self.flush)
         self.loop.start(interval)
 
-    def log(self, *args):
+    def log(self, event):
         """
-        Saves message to buffer, which will be written to file in intervals
+        Saves event to buffer, which will be written to file in intervals
+        """
+        self._buffer.append(event)
+
+    def flush(self):
+        """
+        Write what is buffered, once no other flush or forget is running
+
+        @return: a Deferred that fires once it has been written
         """
-        self._buffer.append(args)
+        return self._lock.run(BufferedLogger_Mixin.flush, self)
+
+    def _flush_and_forget(self, channel):
+        d = BufferedLogger_Mixin.flush(self)
+        d.addCallback(lambda _: threads.deferToThread(
+            MultiChannelFileLogger.forget, self, channel))
+        return d
+
+    def forget(self, channel):
+        """
+        Forget the channel once what is buffered for it has been written
+
+        @return: a Deferred that fires once it has been forgotten
+        """
+        return self._lock.run(self._flush_and_forget, channel)
 
 
 class BufferedSearchLogger(SearchLogger, BufferedLogger_Mixin):
     """
     Logger that buffers messages, and eventually logs them to elasticsearch
     """
-    def __init__(self, interval=5):
+    def __init__(self, interval=5, max_buffered=None, bulk_size=None):
         """
         Same as the initialization for SearchLogger, just with an extra
         interval parameter
@@ -250,15 +519,127 @@ class BufferedSearchLogger(SearchLogger, BufferedLogger_Mixin):
         @param interval: number of seconds between writing logs to
             elasticsearch.  Defaults to 5.
         @type interval: C{int}
+
+        @param max_buffered: how many messages to hold while they can't be
+            written, before dropping the oldest - defaults to
+            C{settings.SEARCH_MAX_BUFFERED}
+        @type max_buffered: C{int}
+
+        @param bulk_size: how many messages to write in each bulk request -
+            defaults to C{settings.SEARCH_BULK_SIZE}
+        @type bulk_size: C{int}
         """
         super(BufferedSearchLogger, self).__init__()
         self._writeInterval = interval
         self._buffer = []
+        self.max_buffered = max_buffered or getattr(
+            settings, 'SEARCH_MAX_BUFFERED', 100000)
+        self.bulk_size = bulk_size or getattr(settings, 'SEARCH_BULK_SIZE',
+                                              1000)
         self.loop = LoopingCall(self.flush)
         self.loop.start(interval)
 
-    def log(self, *args):
+    def log(self, event):
+        """
+        Saves event to buffer, which will be written to file in intervals
+        """
+        self._buffer.append(event)
+
+    def _drop_oldest(self):
         """
-        Saves message to buffer, which will be written to file in intervals
+        Drop the oldest messages over C{max_buffered} - they are still in the
+        log files, from which L{reindex} can index them
         """
-        self._buffer.append(args)
+        dropped = len(self._buffer) - self.max_buffered
+        if dropped > 0:
+            del self._buffer[:dropped]
+            log.msg('SEARCH LOGGING DROPPED %d messages - run reindex.py '
+                    '--fresh to index them from the log files' % (dropped,))
+
+    @defer.inlineCallbacks
+    def flush(self):
+        """
+        Write all the logs in the buffer, in bulk requests of up to
+        C{bulk_size} messages
+        """
+        self._drop_oldest()
+        newbuffer = self._buffer
+        self._buffer = []
+
+        for start in xrange(0, len(newbuffer), self.bulk_size):
+            try:
+                yield threads.deferToThread(
+                    ESLogLine.objects.bulk_create,
+                    [event.json for event in
+                     newbuffer[start:start + self.bulk_size]])
+            except Exception as e:
+                log.msg('SEARCH LOGGING FAILED - %d messages, exception: %s' %
+                        (len(newbuffer) - start, e))
+                # they are tried again before anything logged since, to keep
+                # the order
+                self._buffer[:0] = newbuffer[start:]
+                self._drop_oldest()
+                return
+
+
+class LoggerPipeline(object):
+    """
+    The loggers shared by all the bots, however many networks they are on:
+    one logger to the search index, and one set of daily channel log files.
+    Channel names are unique across the networks (see L{bot.check_channels}),
+    so every network's channels are logged to the same directory, where the
+    web interface and L{reindex} look for them.  Other loggers can be added
+    with L{add}.
+    """
+
+    def __init__(self, directory, networks, interval=5,
+                 system_name='system.logs'):
+        """
+        @param directory: path where all the log files should go
+        @type directory: C{str}
+
+        @param networks: the C{(host, channels)} of each network
+        @type networks: C{list}
+
+        @param interval: number of seconds between writing buffered logs
+        @type interval: C{int}
+
+        @param system_name: the name of the system log file
+        @type system_name: C{str}
+        """
+        self._loggers = [PyLogger()]
+        self._file_logger = BufferedMultiChannelFileLogger(
+            directory, [channel for host, channels in networks
+                        for channel in channels],
+            interval, system_name=system_name)
+        self._loggers.append(BufferedSearchLogger(interval))
+
+    def add(self, logger):
+        """
+        Log to another logger as well
+        """
+        self._loggers.append(logger)
+
+    def stop(self):
+        """
+        Flush the buffered loggers one last time - so nothing they buffered
+        is lost when slogger stops
+
+        @return: a Deferred that fires once they have been flushed
+        """
+        return defer.DeferredList([
+            logger.stop() for logger in [self._file_logger] + self._loggers
+            if isinstance(logger, BufferedLogger_Mixin)])
+
+    def forget(self, channel):
+        """
+        Stop keeping track of a channel that is no longer logged
+
+        @return: a Deferred that fires once it has been forgotten
+        """
+        return self._file_logger.forget(channel)
+
+    def log(self, event):
+        self._file_logger.log(event)
+        for logger in self._loggers:
+            logger.log(event)
@@ -0,0 +1,442 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_logreader -*-
+
+"""
+Readers for the flat file logs written by L{loggers.MultiChannelFileLogger}
+"""
+import bisect
+import itertools
+import mmap
+import os
+import re
+import struct
+import time
+from datetime import date
+
+from elasticsearch import ESLogLine
+
+
+# the inverse of L{loggers.BaseLogger_Mixin.stringify} - the time is always
+# formatted by time.asctime, which is 24 characters long
+_LINE_RE = re.compile(
+    r'^\[(?P<channel>.*?)\] (?P<time>.{24}) :  <(?P<user>.*?)> '
+    r'(?P<event>.*?) \((?P<message>.*)\) @ (?P<host>.*)$')
+
+# L{loggers.DailyFileLogger} keeps a sidecar index next to each channel log
+# file, of fixed size (minute of the day, byte offset) records
+INDEX_SUFFIX = '.idx'
+_INDEX_RECORD = struct.Struct('!HQ')
+
+# rotated channel log files are suffixed with the date, see
+# L{twisted.python.logfile.DailyLogFile.suffix}
+_DATE_SUFFIX_RE = re.compile(r'^(\d+)_(\d+)_(\d+)$')
+
+# system log lines for messages not belonging to a known channel are preceded
+# by this marker line, and indented with a tab
+_UNKNOWN_CHANNEL_MARKER = '-- Received message from unknown channel:'
+
+
+def _none_or_value(value):
+    """
+    C{stringify} formats C{None} as 'None' - turn it back into C{None}
+    """
+    if value == 'None':
+        return None
+    return value
+
+
+def parse_time(time_string):
+    """
+    Convert a time string formatted by C{time.asctime} back into seconds since
+    the epoch (local time)
+
+    @param time_string: time formatted by C{time.asctime}
+    @type time_string: C{str}
+
+    @return: C{float}
+    """
+    return time.mktime(time.strptime(time_string, '%a %b %d %H:%M:%S %Y'))
+
+
+def parse_line(line):
+    """
+    Parse a line written by L{loggers.BaseLogger_Mixin.stringify} into the
+    same dictionary L{loggers.BaseLogger_Mixin.dictify} would have produced
+    for that message.
+
+    @param line: a single line from a log file
+    @type line: C{str}
+
+    @return: C{dict}, or C{None} if the line is not a log line
+    """
+    line = line.rstrip('\r\n')
+    if line.startswith('\t'):
+        line = line[1:]
+    match = _LINE_RE.match(line)
+    if match is None:
+        return None
+
+    try:
+        event_time = parse_time(match.group('time'))
+    except ValueError:
+        return None
+
+    return {'message': _none_or_value(match.group('message')),
+            'user': _none_or_value(match.group('user')),
+            'channel': _none_or_value(match.group('channel')),
+            'time': event_time,
+            'host': match.group('host'),
+            'event': match.group('event')}
+
+
+def read_log_file(path):
+    """
+    Iterate over all the messages in a channel or system log file
+
+    @param path: path to the log file
+    @type path: C{str}
+
+    @return: generator of C{(offset, dict)} tuples, where offset is the byte
+        offset of the line in the file and dict is as per L{parse_line}
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if not line.startswith(_UNKNOWN_CHANNEL_MARKER):
+                record = parse_line(line)
+                if record is not None:
+                    yield offset, record
+            offset += len(line)
+
+
+def minute_of_day(event_time, date):
+    """
+    The minute of a given day at which an event happened, clamped to the day
+
+    @param event_time: the time of the event in seconds since the epoch
+    @type event_time: C{float}
+
+    @param date: the day, as a C{(year, month, day)} localtime tuple
+    @type date: C{tuple}
+
+    @return: C{int} between 0 and 1439
+    """
+    day_start = time.mktime(tuple(date) + (0, 0, 0, 0, 0, -1))
+    return min(max(int((event_time - day_start) // 60), 0), 1439)
+
+
+def pack_index_record(minute, offset):
+    """
+    Pack a sidecar index record, recording that the first message logged in
+    C{minute} starts at byte C{offset} of the log file
+    """
+    return _INDEX_RECORD.pack(minute, offset)
+
+
+def read_index(path):
+    """
+    Read a sidecar index file
+
+    @param path: path to the index file
+    @type path: C{str}
+
+    @return: C{list} of C{(minute, offset)} tuples, in the order they were
+        written (which is increasing), or an empty list if there is no index
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return []
+    size = _INDEX_RECORD.size
+    # ignore a partially written record at the end
+    return [_INDEX_RECORD.unpack_from(data, i)
+            for i in xrange(0, len(data) - size + 1, size)]
+
+
+def last_indexed_minute(path):
+    """
+    The last minute recorded in a sidecar index file, or -1 if there is none
+    """
+    size = _INDEX_RECORD.size
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            end = f.tell() - f.tell() % size
+            if not end:
+                return -1
+            f.seek(end - size)
+            return _INDEX_RECORD.unpack(f.read(size))[0]
+    except IOError:
+        return -1
+
+
+def index_range(path, date, start_time=None, end_time=None):
+    """
+    Use the sidecar index of a channel log file to find the byte range of the
+    file that holds the messages between two times.  The index only has minute
+    resolution, so the range may contain some messages just outside of the
+    times asked for.
+
+    @param path: path to the channel log file
+    @type path: C{str}
+
+    @param date: the day the log file is for, as a C{(year, month, day)} tuple
+    @type date: C{tuple}
+
+    @param start_time: earliest time wanted, in seconds since the epoch, or
+        C{None} for the start of the file
+    @type start_time: C{float}
+
+    @param end_time: latest time wanted, in seconds since the epoch, or C{None}
+        for the end of the file
+    @type end_time: C{float}
+
+    @return: C{(start offset, end offset)}
+    """
+    size = os.path.getsize(path)
+    index = read_index(path + INDEX_SUFFIX)
+    if not index:
+        return 0, size
+    minutes = [minute for minute, offset in index]
+
+    start = 0
+    if start_time is not None:
+        i = bisect.bisect_left(minutes, minute_of_day(start_time, date))
+        if i == len(index):
+            return size, size
+        # anything before the first record was logged without an index
+        if i > 0:
+            start = index[i][1]
+
+    end = size
+    if end_time is not None:
+        j = bisect.bisect_right(minutes, minute_of_day(end_time, date))
+        if j < len(index):
+            end = index[j][1]
+
+    return start, max(start, end)
+
+
+def channel_log_files(directory, channel):
+    """
+    Find the current and rotated log files of a channel
+
+    @param directory: the directory the channel logs are in
+    @type directory: C{str}
+
+    @param channel: the channel name
+    @type channel: C{str}
+
+    @return: C{list} of C{((year, month, day), path)} tuples, sorted by date
+    """
+    files = {}
+    prefix = channel + '.'
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name == channel:
+            # the current file is for the day it was last written to
+            files.setdefault(
+                time.localtime(os.stat(path).st_mtime)[:3], path)
+        elif name.startswith(prefix):
+            match = _DATE_SUFFIX_RE.match(name[len(prefix):])
+            if match:
+                files[tuple(int(part) for part in match.groups())] = path
+    return sorted(files.items())
+
+
+class FlatFileQueryset(object):
+    """
+    A queryset over the flat file logs of a single channel, with the same
+    iteration, slicing and facet interface as
+    L{elasticsearch.core.queryset.ElasticsearchQueryset}, so it can stand in
+    when elasticsearch is unavailable.
+
+    Log files are read through C{mmap}, starting at the offsets found in their
+    sidecar indexes, and results are streamed rather than loaded into memory.
+    Only term filters are supported - there is no full text search.
+    """
+
+    def __init__(self, directory, channel, start_time=None, end_time=None):
+        """
+        @param directory: the directory the channel logs are in
+        @type directory: C{str}
+
+        @param channel: the channel name
+        @type channel: C{str}
+
+        @param start_time: earliest message time, in seconds since the epoch
+        @type start_time: C{float}
+
+        @param end_time: latest message time, in seconds since the epoch
+        @type end_time: C{float}
+        """
+        self._directory = directory
+        self._channel = channel
+        self._start_time = start_time
+        self._end_time = end_time
+
+        self._terms = {}
+        self._faceted_on = []
+        self._facets = None
+        self._total_results = None
+
+        self._size = 100
+        self._offset = 0
+
+    def __iter__(self):
+        """
+        streams the results
+        """
+        for record in itertools.islice(self._records(), self._offset,
+                                       self._offset + self._size):
+            yield ESLogLine(**record)
+
+    def __list__(self):
+        return self.results
+
+    def __repr__(self):
+        return str(self.__list__())
+
+    def __getitem__(self, index):
+        if not isinstance(index, (slice, int, long)):
+            raise TypeError
+        if type(index) == slice:
+            if index.start:
+                self._offset = index.start
+            if index.stop:
+                self._size = index.stop - self._offset
+            return self
+        return self.results[index]
+
+    def _files(self):
+        """
+        The log files that may contain messages in the time range
+        """
+        first = date.fromtimestamp(self._start_time or 0).timetuple()[:3]
+        last = date.fromtimestamp(self._end_time or time.time()).timetuple()
+        last = last[:3]
+        try:
+            files = channel_log_files(self._directory, self._channel)
+        except OSError:
+            return []
+        return [(day, path) for day, path in files if first <= day <= last]
+
+    def _lines(self, path, day):
+        """
+        Read the lines of a log file that may be in the time range
+        """
+        start, end = index_range(path, day, self._start_time, self._end_time)
+        if start >= end:
+            return
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = start
+            while position < end:
+                newline = mapped.find('\n', position, end)
+                if newline == -1:
+                    # a line that is still being written
+                    break
+                yield mapped[position:newline]
+                position = newline + 1
+        finally:
+            mapped.close()
+
+    def _records(self):
+        """
+        All the records matching the time range and filters, oldest first
+        """
+        for day, path in self._files():
+            for line in self._lines(path, day):
+                record = parse_line(line)
+                if record is None:
+                    continue
+                if (self._start_time is not None and
+                        record['time'] < self._start_time):
+                    continue
+                if (self._end_time is not None and
+                        record['time'] > self._end_time):
+                    continue
+                for key, value in self._terms.iteritems():
+                    if record.get(key) != value:
+                        break
+                else:
+                    yield record
+
+    def _scan(self):
+        """
+        counts the results and any facets in one pass over the logs
+        """
+        counts = dict((field, {}) for field in self._faceted_on)
+        total = 0
+        for record in self._records():
+            total += 1
+            for field, field_counts in counts.iteritems():
+                value = record.get(field)
+                field_counts[value] = field_counts.get(value, 0) + 1
+
+        self._total_results = total
+        self._facets = {}
+        for field, field_counts in counts.iteritems():
+            # same as the default size of an elasticsearch terms facet
+            self._facets[field] = sorted(field_counts.items(),
+                                         key=lambda item: -item[1])[:10]
+
+    def filter(self, query_string=None, **kwargs):
+        if query_string:
+            raise ValueError('flat file logs can only be filtered by term')
+        self._terms.update(kwargs)
+        self._total_results = None
+        return self
+
+    def order_by(self, order_by):
+        """
+        log files are always in time order, so only sorting by time ascending
+        is supported
+        """
+        if order_by != 'time':
+            raise ValueError('flat file logs can only be ordered by time')
+        return self
+
+    def facet(self, facet):
+        if facet and type(facet) != list:
+            facet = [facet]
+        self._faceted_on.extend(str(f) for f in facet)
+        self._total_results = None
+        return self
+
+    def limit(self, limit):
+        self._size = limit
+        return self
+
+    def count(self):
+        """
+        returns the number of results, bounded by the size of the queryset
+        like L{ElasticsearchQueryset.count}
+        """
+        if self._total_results is None:
+            self._scan()
+        return max(0, min(self._total_results - self._offset, self._size))
+
+    @property
+    def results(self):
+        return list(self)
+
+    @property
+    def facets(self):
+        if self._total_results is None:
+            self._scan()
+        return self._facets
@@ -0,0 +1,112 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_mentions -*-
+
+"""
+An index of when each user was mentioned in each channel, built by the bot as
+messages are logged, so that users can be told on joining how many times they
+were mentioned while they were away without searching the logs.
+"""
+import re
+from array import array
+from bisect import bisect_right
+
+from events import CTCPQUERY_EVENT, JOIN_EVENT, MSG_EVENT
+
+
+# the characters nicks are made of
+_NICK = re.compile(r'[A-Za-z0-9_\-\[\]\\`^{}|]+')
+
+
+class MentionIndex(object):
+    """
+    The times each user was mentioned in each channel - by name, in a
+    message from someone else.  The names that count as mentions are the
+    nicks that have been seen in the channel.  Only the last C{max_mentions}
+    mentions of a user in a channel, from the last C{retention_days} days, are
+    kept.
+
+    It has the same C{log} method as the loggers in L{loggers}, so it can be
+    one of the bot's loggers.
+    """
+
+    # how many mentions to index between sweeps for users whose mentions
+    # have all expired
+    sweep_interval = 10000
+
+    def __init__(self, max_mentions=100, retention_days=7):
+        self.max_mentions = max_mentions
+        self.retention = retention_days * 86400
+        self._until_sweep = self.sweep_interval
+        # lower case channel name -> set of lower case nicks
+        self._nicks = {}
+        # (lower case nick, lower case channel name) -> array of times
+        self._mentions = {}
+
+    def log(self, event):
+        if not event.channel or not event.channel.startswith('#'):
+            return
+        channel = event.channel.lower()
+        nicks = self._nicks.setdefault(channel, set())
+        if event.event not in (JOIN_EVENT, MSG_EVENT, CTCPQUERY_EVENT):
+            return
+        user = event.user.lower()
+        nicks.add(user)
+        if event.event == JOIN_EVENT or not event.message:
+            return
+        mentioned = set(word.lower() for word in _NICK.findall(event.message))
+        mentioned.intersection_update(nicks)
+        mentioned.discard(user)
+        for nick in mentioned:
+            self._mentioned(nick, channel, event.time)
+
+    def _mentioned(self, nick, channel, when):
+        times = self._mentions.get((nick, channel))
+        if times is None:
+            times = self._mentions[nick, channel] = array('d')
+        times.append(when)
+        self._trim(times, when)
+        self._until_sweep -= 1
+        if not self._until_sweep:
+            self.sweep(when)
+            self._until_sweep = self.sweep_interval
+
+    def sweep(self, now):
+        """
+        Forget the users whose mentions have all expired
+        """
+        for key, times in self._mentions.items():
+            self._trim(times, now)
+            if not times:
+                del self._mentions[key]
+
+    def _trim(self, times, now):
+        # trimming is deferred until there are twice as many mentions as are
+        # kept, so that it only copies the array every so often
+        expired = bisect_right(times, now - self.retention)
+        excess = len(times) - self.max_mentions
+        if expired or excess >= self.max_mentions:
+            del times[:max(expired, excess)]
+
+    def count(self, nick, channel, since, now=None):
+        """
+        @return: how many times the user was mentioned in the channel after
+            C{since}, as far as is known
+        """
+        times = self._mentions.get((nick.lower(), channel.lower()))
+        if not times:
+            return 0
+        if now is not None:
+            since = max(since, now - self.retention)
+        return min(len(times) - bisect_right(times, since), self.max_mentions)
@@ -0,0 +1,329 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_plugins -*-
+
+"""
+The commands users can give the bot, looked up by name in a L{Registry}.
+A command is a function called with the bot, the user, the channel and the
+command's arguments, which returns the reply (or C{None}), or a Deferred
+that fires with it.  Each command has its own limit on how many calls can run
+at once, and a timeout, so a slow command can't hold up the bot, and the
+registry keeps how long each command takes and how often it fails.
+"""
+import time
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, log
+
+
+UNKNOWN_COMMAND = 'logger and searchbot - try "help"'
+
+# the most nicks the who command lists
+MAX_WHO = 30
+
+
+class CommandStats(object):
+    """
+    How many times a command has been called, how many of those calls failed
+    or timed out, how many were turned away because too many were waiting,
+    and how long the calls took
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.slowest = 0.0
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.slowest = max(self.slowest, elapsed)
+
+    @property
+    def mean(self):
+        """
+        The mean time a call took, in seconds
+        """
+        if not self.calls:
+            return 0.0
+        return self.total_time / self.calls
+
+
+class Command(object):
+    """
+    A command, with its own concurrency limit, timeout and stats
+
+    @ivar usage: how to use the command, for the help command
+    @type usage: C{str}
+    """
+
+    def __init__(self, name, f, usage, concurrency=5, max_waiting=10,
+                 timeout=10):
+        """
+        @param f: called with the bot, the user, the channel and the
+            arguments to run the command
+        @type f: C{callable}
+
+        @param concurrency: how many calls can run at once
+        @type concurrency: C{int}
+
+        @param max_waiting: how many more calls can wait for their turn
+        @type max_waiting: C{int}
+
+        @param timeout: how many seconds a call can take before it is given up
+            on - it keeps its slot until it finishes all the same
+        @type timeout: C{int}
+        """
+        self.name = name
+        self.f = f
+        self.usage = usage
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+        self.stats = CommandStats()
+
+
+class Registry(object):
+    """
+    The commands, by (lower case) name
+    """
+
+    def __init__(self, clock=reactor):
+        self._commands = {}
+        self._clock = clock
+
+    def add(self, name, f, usage, **kwargs):
+        """
+        Add a command, replacing any with the same name - the keyword
+        arguments are those of L{Command}
+        """
+        self._commands[name.lower()] = Command(name, f, usage, **kwargs)
+
+    def command(self, name, usage, **kwargs):
+        """
+        A decorator that adds the function it decorates as a command
+        """
+        def _add(f):
+            self.add(name, f, usage, **kwargs)
+            return f
+        return _add
+
+    def get(self, name):
+        """
+        @return: the L{Command} with that name, or C{None}
+        """
+        return self._commands.get((name or '').lower())
+
+    def names(self):
+        return sorted(command.name for command in self._commands.itervalues())
+
+    def stats(self):
+        """
+        @return: C{dict} mapping command names to their L{CommandStats}
+        """
+        return dict((command.name, command.stats)
+                    for command in self._commands.itervalues())
+
+    def run(self, name, bot, user, channel, args):
+        """
+        Run a command, once there is room for it to run
+
+        @return: a Deferred that fires with the reply to send, or C{None} -
+            it never fails, failures are logged and replied to
+        """
+        command = self.get(name)
+        if command is None:
+            return defer.succeed(UNKNOWN_COMMAND)
+        semaphore = command.semaphore
+        if (not semaphore.tokens and
+                len(semaphore.waiting) >= command.max_waiting):
+            command.stats.rejected += 1
+            return defer.succeed('Too many people are using %s right now, '
+                                 'please try again later' % (command.name,))
+        d = semaphore.acquire()
+        d.addCallback(lambda _: self._call(command, bot, user, channel, args))
+        return d
+
+    def _call(self, command, bot, user, channel, args):
+        """
+        Run a command that has been given a slot, and reply - or give up
+        waiting for it after its timeout.  The slot is only released once the
+        command has actually finished, as timing out can't stop work it is
+        doing in a thread, which would otherwise carry on alongside the calls
+        let into its slot.  What a command replies after timing out is
+        dropped.
+        """
+        started = self._clock.seconds()
+        reply = defer.Deferred()
+
+        def _done(result):
+            command.semaphore.release()
+            if not reply.called:
+                if isinstance(result, failure.Failure):
+                    reply.errback(result)
+                else:
+                    reply.callback(result)
+            elif isinstance(result, failure.Failure):
+                log.err(result, 'The %s command failed after timing out' % (
+                    command.name,))
+
+        defer.maybeDeferred(command.f, bot, user, channel, args).addBoth(
+            _done)
+        reply.addTimeout(command.timeout, self._clock)
+        reply.addBoth(self._finished, command, started)
+        return reply
+
+    def _finished(self, result, command, started):
+        command.stats.record(self._clock.seconds() - started)
+        if not isinstance(result, failure.Failure):
+            return result
+        if result.check(defer.TimeoutError):
+            command.stats.timeouts += 1
+            log.msg('The %s command timed out' % (command.name,))
+            return '%s took too long, sorry' % (command.name,)
+        command.stats.errors += 1
+        log.err(result, 'The %s command failed' % (command.name,))
+        return 'Something went wrong, please try again later'
+
+
+# the bot's commands
+registry = Registry()
+
+
+@registry.command('help', 'help <optional: command> - describes a command')
+def help_command(bot, user, channel, args):
+    command = registry.get((args or '').strip())
+    if command is not None:
+        return command.usage
+    return 'commands: %s' % (', '.join(
+        name for name in registry.names() if name != 'help'),)
+
+
+@registry.command('search', 'search <lucene query> - searches for messages',
+                  concurrency=2, timeout=30)
+def search_command(bot, user, channel, args):
+    return bot.do_search(args, channel, user)
+
+
+@registry.command('ignore',
+                  'ignore <optional: nick> - ignores you, or a given nick')
+def ignore_command(bot, user, channel, args):
+    return bot.do_ignore(args or user)
+
+
+@registry.command('unignore',
+                  'unignore <optional: nick> - unignores you, or a given nick')
+def unignore_command(bot, user, channel, args):
+    return bot.do_unignore(args or user)
+
+
+@registry.command('last', 'last <optional: channel> <optional: count> - '
+                  'sends you the last messages in a channel')
+def last_command(bot, user, channel, args):
+    return bot.do_last(args, channel, user)
+
+
+def _change_channel(bot, user, channel, action):
+    if not bot.is_admin(user):
+        return 'Only admins can %s channels' % (action,)
+    if not channel:
+        return registry.get(action).usage
+    try:
+        changed = getattr(bot.factory.channel_manager, action)(
+            channel, bot.factory.irc_host)
+    except ValueError as e:
+        return str(e)
+    if changed is False:
+        if action == 'join':
+            return "I'm already logging %s" % (channel,)
+        return "I'm not logging %s" % (channel,)
+    return '%s %s' % (action == 'join' and 'Joining' or 'Leaving', channel)
+
+
+@registry.command('join', 'join <channel> - starts logging a channel '
+                  '(admins only)')
+def join_command(bot, user, channel, args):
+    return _change_channel(bot, user, (args or '').strip(), 'join')
+
+
+@registry.command('part', 'part <optional: channel> - stops logging a '
+                  'channel, or the one you asked in (admins only)')
+def part_command(bot, user, channel, args):
+    if channel == bot.nickname:
+        channel = None
+    return _change_channel(bot, user, (args or '').strip() or channel, 'part')
+
+
+@registry.command('seen', 'seen <nick> - when a user was last in a channel')
+def seen_command(bot, user, channel, args):
+    nick = (args or '').strip()
+    if not nick:
+        return registry.get('seen').usage
+    presence = bot.factory.presence
+    channels = bot.factory.roster.channels(nick) or presence.channels(nick)
+    if channels:
+        return '%s is in %s' % (nick, ', '.join(channels))
+    left = presence.last_left(nick)
+    if not left:
+        return "I haven't seen %s" % (nick,)
+    last_channel, when = max(left.iteritems(), key=lambda item: item[1])
+    return '%s was last seen leaving %s at %s' % (
+        nick, last_channel, time.asctime(time.localtime(when)))
+
+
+@registry.command('who', 'who <optional: channel> - who is in a channel')
+def who_command(bot, user, channel, args):
+    channel = (args or '').strip() or channel
+    if not channel.startswith('#'):
+        return registry.get('who').usage
+    members = bot.factory.roster.members(channel)
+    if not members:
+        return "I don't know who is in %s" % (channel,)
+    reply = '%d in %s: %s' % (len(members), channel,
+                              ', '.join(members[:MAX_WHO]))
+    if len(members) > MAX_WHO:
+        reply += ' and %d more' % (len(members) - MAX_WHO,)
+    return reply
+
+
+@registry.command('stats', 'stats - how much each command has been used, '
+                  'and how long it takes')
+def stats_command(bot, user, channel, args):
+    stats = registry.stats()
+    used = ['%s: %d calls, %d failed, %d timed out, %dms on average' % (
+        name, stats[name].calls, stats[name].errors, stats[name].timeouts,
+        stats[name].mean * 1000) for name in sorted(stats)
+        if stats[name].calls]
+    return '; '.join(used) or 'No commands have been used yet'
+
+
+@registry.command('watch', 'watch <word or /regex/> - messages you when it '
+                  'is said in a channel you are in (only admins can watch '
+                  'for /regex/)')
+def watch_command(bot, user, channel, args):
+    return bot.do_watch(args, user)
+
+
+@registry.command('unwatch', 'unwatch <word or /regex/> - stops watching '
+                  'for it')
+def unwatch_command(bot, user, channel, args):
+    return bot.do_unwatch(args, user)
+
+
+@registry.command('watches', 'watches - lists what you are watching for')
+def watches_command(bot, user, channel, args):
+    return bot.do_watches(user)
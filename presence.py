@@ -0,0 +1,260 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_presence -*-
+
+"""
+When each user last joined and left each channel, kept in memory by the bot
+so that it can greet users without querying the search index on every join.
+"""
+import fcntl
+import json
+import os
+
+from twisted.application import service
+from twisted.internet import reactor, task, threads
+from twisted.python import log
+
+from elasticsearch import ESLogLine
+from events import JOIN_EVENT, LEAVE_EVENT
+
+
+class Presence(object):
+    """
+    The last join and leave times of each user in each channel.  User and
+    channel names are case insensitive.
+    """
+
+    def __init__(self):
+        # lower case user name -> lower case channel name ->
+        # [channel name, last joined, last left]
+        self._users = {}
+
+    def _entry(self, user, channel):
+        channels = self._users.setdefault(user.lower(), {})
+        entry = channels.get(channel.lower())
+        if entry is None:
+            entry = channels[channel.lower()] = [channel, None, None]
+        return entry
+
+    def _update(self, user, channel, index, when):
+        entry = self._entry(user, channel)
+        if entry[index] is None or when > entry[index]:
+            entry[index] = when
+
+    def joined(self, user, channel, when):
+        self._update(user, channel, 1, when)
+
+    def left(self, user, channel, when):
+        self._update(user, channel, 2, when)
+
+    def channels(self, user):
+        """
+        @return: C{list} of the names of the channels the user is in, as far
+            as is known - that is, the ones they joined after they last left
+        """
+        return sorted(
+            name for name, joined, left in
+            self._users.get(user.lower(), {}).itervalues()
+            if joined is not None and (left is None or joined > left))
+
+    def quit(self, user, when):
+        """
+        The user left the server, and so every channel they were in
+
+        @return: C{list} of the channels they left
+        """
+        channels = self.channels(user)
+        for channel in channels:
+            self.left(user, channel, when)
+        return channels
+
+    def renamed(self, old, new, when):
+        """
+        A user changed their nick - the old nick leaves all its channels and
+        the new one joins them
+
+        @return: C{list} of the channels the user is in
+        """
+        channels = self.quit(old, when)
+        for channel in channels:
+            self.joined(new, channel, when)
+        return channels
+
+    def _times(self, user, channel, index):
+        entries = self._users.get(user.lower(), {})
+        if channel is not None:
+            entry = entries.get(channel.lower())
+            entries = {channel.lower(): entry} if entry else {}
+        return dict((entry[0], entry[index]) for entry in entries.itervalues()
+                    if entry[index] is not None)
+
+    def last_joined(self, user, channel=None):
+        """
+        @return: C{dict} mapping channel names to the last time the user
+            joined them - only C{channel}, if given
+        """
+        return self._times(user, channel, 1)
+
+    def last_left(self, user, channel=None):
+        """
+        @return: C{dict} mapping channel names to the last time the user left
+            them - only C{channel}, if given
+        """
+        return self._times(user, channel, 2)
+
+    def seed_query(self, channels):
+        """
+        The single aggregation that seeds the presence from the index: for
+        each channel, the last time each user joined and left it
+
+        @return: C{dict}, the query
+        """
+        facets = {}
+        for i, channel in enumerate(channels):
+            for event in (JOIN_EVENT, LEAVE_EVENT):
+                facets['%s%d' % (event.lower(), i)] = {
+                    'terms_stats': {'key_field': 'user', 'value_field': 'time',
+                                    'size': 0},
+                    'facet_filter': {'and': [
+                        {'term': {'channel': channel.lstrip('#').lower()}},
+                        {'term': {'event': event.lower()}}]}}
+        return {'query': {'match_all': {}}, 'facets': facets}
+
+    def seed(self, response, channels):
+        """
+        Add what the seed query found, keeping whichever times are later
+
+        @param response: the raw search response to L{seed_query}
+        @type response: C{dict}
+        """
+        facets = response.get('facets', {})
+        for i, channel in enumerate(channels):
+            for event, update in ((JOIN_EVENT, self.joined),
+                                  (LEAVE_EVENT, self.left)):
+                terms = facets.get('%s%d' % (event.lower(), i), {})
+                for term in terms.get('terms', []):
+                    update(term['term'], channel, term['max'])
+
+    def dump(self):
+        """
+        @return: C{list} of C{[user, channel, last joined, last left]}, which
+            can be given to L{restore}
+        """
+        return [[user, entry[0], entry[1], entry[2]]
+                for user, channels in self._users.iteritems()
+                for entry in channels.itervalues()]
+
+    def restore(self, dumped):
+        """
+        Add what L{dump} returned, keeping whichever times are later
+        """
+        for user, channel, joined, left in dumped:
+            if joined is not None:
+                self.joined(user, channel, joined)
+            if left is not None:
+                self.left(user, channel, left)
+
+
+class PresenceService(service.Service):
+    """
+    Restores the presence from its checkpoint and the index when started,
+    and checkpoints it to disk every C{interval} seconds and when stopped.
+
+    Several services can share a checkpoint - the worker processes logging
+    a network's channels do (see L{shard}), so that a channel's presence
+    follows it when it moves to another worker.  Each adds what it knows to
+    what is already in the checkpoint, keeping the latest times.
+    """
+
+    def __init__(self, presence, path, channels, interval=60, clock=reactor):
+        """
+        @param presence: the presence to keep
+        @type presence: L{Presence}
+
+        @param path: the checkpoint file
+        @type path: C{str}
+
+        @param channels: the channels to seed the presence for
+        @type channels: C{list}
+        """
+        self.presence = presence
+        self.path = path
+        self._channels = channels
+        self._checkpoints = task.LoopingCall(self.checkpoint)
+        self._checkpoints.clock = clock
+        self._interval = interval
+        self._loading = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self.restore()
+        self._loading = self.load()
+        self._loading.addErrback(log.err, 'Seeding the presence failed')
+        self._checkpoints.start(self._interval, now=False)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._checkpoints.running:
+            self._checkpoints.stop()
+        self.checkpoint()
+
+    def restore(self):
+        """
+        Restore the presence from the checkpoint, if there is one
+        """
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.presence.restore(json.load(f))
+        except (IOError, ValueError):
+            log.err(None, 'Reading the presence checkpoint failed')
+
+    def checkpoint(self):
+        """
+        Write the presence, along with what is already in the checkpoint, to
+        the checkpoint - to a temporary file first, so the checkpoint is
+        never left half written, and while holding a lock on it, so that the
+        other services sharing it don't write it at the same time
+        """
+        tmp = self.path + '.tmp'
+        try:
+            with open(self.path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self.restore()
+                with open(tmp, 'w') as f:
+                    json.dump(self.presence.dump(), f)
+                os.rename(tmp, self.path)
+        except (IOError, OSError):
+            log.err(None, 'Writing the presence checkpoint failed')
+
+    def _fetch(self):
+        if not ESLogLine.objects.is_available():
+            # the checkpoint will have to do
+            return {}
+        return ESLogLine._client.search(
+            ESLogLine._get_index(), ESLogLine._get_doctype(),
+            json.dumps(self.presence.seed_query(self._channels)), size=1)
+
+    def load(self):
+        """
+        Seed the presence from the index.  The query is run in a thread, but
+        the presence is only updated in the reactor thread, like it is by the
+        bot.
+
+        @return: a Deferred that fires when the presence has been seeded
+        """
+        d = threads.deferToThread(self._fetch)
+        d.addCallback(self.presence.seed, self._channels)
+        return d
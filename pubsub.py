@@ -0,0 +1,142 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_pubsub -*-
+
+"""
+In-memory publish/subscribe of logged events, so that the web interface can
+show new messages as they happen without querying the search index.
+"""
+from collections import deque
+
+from zope.interface import implementer
+
+from twisted.internet.interfaces import IPushProducer
+
+
+@implementer(IPushProducer)
+class Subscription(object):
+    """
+    A subscriber's view of a channel.  Events are handed to the subscriber as
+    they are published, except while it is paused (for instance because its
+    client is not reading fast enough), when they are queued instead.  The
+    queue is bounded, so a subscriber that never catches up loses the oldest
+    events rather than using up memory.
+
+    A subscription is a push producer, so it can be registered with the
+    request it is writing to.
+
+    @ivar dropped: how many events have been dropped since the last call to
+        L{take_dropped}
+    @type dropped: C{int}
+    """
+
+    def __init__(self, hub, channel, deliver, max_queued=100):
+        """
+        @param hub: the hub the subscription is to
+        @type hub: L{Hub}
+
+        @param channel: the channel subscribed to
+        @type channel: C{str}
+
+        @param deliver: called with each L{loggers.LogEvent} for the channel
+        @type deliver: C{callable}
+
+        @param max_queued: how many events to queue while paused
+        @type max_queued: C{int}
+        """
+        self._hub = hub
+        self.channel = channel
+        self._deliver = deliver
+        self._queue = deque(maxlen=max_queued)
+        self._paused = False
+        self.dropped = 0
+
+    def publish(self, event):
+        if self._paused or self._queue:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+        else:
+            self._deliver(event)
+
+    def take_dropped(self):
+        """
+        @return: how many events have been dropped since this was last called
+        """
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        # delivering may pause us again
+        while self._queue and not self._paused:
+            self._deliver(self._queue.popleft())
+
+    def stopProducing(self):
+        self._hub.unsubscribe(self)
+        self._queue.clear()
+
+
+class Hub(object):
+    """
+    Fans logged events out to the subscribers of their channel.  It has the
+    same C{log} method as the loggers in L{loggers}, so it can be one of the
+    bot's loggers.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+
+    def _key(self, channel):
+        # channel names are case insensitive
+        return channel.lower()
+
+    def subscribe(self, channel, deliver, max_queued=100):
+        """
+        Subscribe to the events of a channel
+
+        @return: L{Subscription}
+        """
+        subscription = Subscription(self, channel, deliver, max_queued)
+        self._subscriptions.setdefault(
+            self._key(channel), set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        key = self._key(subscription.channel)
+        subscriptions = self._subscriptions.get(key, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self._subscriptions.pop(key, None)
+
+    def subscribers(self, channel):
+        """
+        @return: how many subscribers a channel has
+        """
+        return len(self._subscriptions.get(self._key(channel), ()))
+
+    def log(self, event):
+        if not event.channel:
+            return
+        # copied, as subscribers may unsubscribe while being delivered to
+        for subscription in list(
+                self._subscriptions.get(self._key(event.channel), ())):
+            subscription.publish(event)
+
+
+# the hub the bot publishes to and the web interface subscribes to
+hub = Hub()
@@ -0,0 +1,312 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_reindex -*-
+
+"""
+Rebuild the elasticsearch index from the flat file logs.
+
+Every channel file (current and rotated) and every system log file in the log
+directory is parsed in a pool of worker processes, one file per worker, and
+streamed to elasticsearch with the bulk API.  Completed files are recorded in
+a checkpoint file, so an interrupted run can be resumed.
+
+Documents indexed from the files are given ids derived from their content,
+which the documents the bot indexes as it logs don't have - so a run has to
+start from an empty index, with C{--fresh}, and only a run that has been
+interrupted can be carried on without it.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date
+
+from twisted.python import usage
+
+import settings
+import logreader
+from elasticsearch import ESLogLine
+from elasticsearch.core.models import ElasticsearchUtils
+from web import pagecache
+
+
+class Options(usage.Options):
+    synopsis = 'Usage: python reindex.py [options] [log directory]'
+
+    optParameters = [
+        ['workers', 'w', multiprocessing.cpu_count(),
+         'Number of worker processes', int],
+        ['batch-size', 'b', 1000,
+         'Number of documents per bulk request', int],
+        ['checkpoint', 'c', None,
+         'File recording completed log files (default: '
+         '<log directory>/reindex.checkpoint)'],
+    ]
+
+    optFlags = [
+        ['fresh', 'f',
+         'Delete and recreate the index, and ignore the checkpoint - '
+         'required unless resuming an interrupted run'],
+    ]
+
+    def parseArgs(self, directory=None):
+        self['directory'] = directory or settings.LOG_FILE_PATH
+
+    def postOptions(self):
+        if not self['checkpoint']:
+            self['checkpoint'] = os.path.join(
+                self['directory'], 'reindex.checkpoint')
+        if not self['fresh'] and not os.path.exists(self['checkpoint']):
+            raise usage.UsageError(
+                'no checkpoint to resume from - use --fresh to rebuild the '
+                'index, as indexing into it as it is would duplicate the '
+                'messages the bot has indexed')
+
+
+def _doc_id(line, occurrence):
+    """
+    Documents are given ids derived from their content, so that indexing the
+    same file twice (or a file that has been rotated since) overwrites the
+    documents rather than duplicating them.  Identical lines in the same file
+    are told apart by how many times they have been seen before.
+    """
+    return hashlib.md5('%s\0%d' % (line, occurrence)).hexdigest()
+
+
+def _decode(record):
+    """
+    Log files are written as utf-8, but may contain anything a client sent
+    """
+    for key, value in record.iteritems():
+        if isinstance(value, str):
+            record[key] = value.decode('utf-8', 'replace')
+    return record
+
+
+def _check_bulk(response):
+    """
+    Elasticsearch answers a bulk request with 200 even if some of its
+    documents were rejected, and reports them per item instead
+
+    @param response: the JSON loaded response to a bulk request
+    @type response: C{dict}
+
+    @raise ValueError: if any of the documents were not indexed
+    """
+    errors = [result.get('error') or 'status %s' % (result.get('status'),)
+              for item in response.get('items', [])
+              for result in item.values()
+              if result.get('error') or result.get('status', 200) >= 300]
+    if errors:
+        raise ValueError('%d documents were not indexed, the first because: '
+                         '%s' % (len(errors), errors[0]))
+    if response.get('errors'):
+        raise ValueError('documents were not indexed')
+
+
+def index_file(args):
+    """
+    Parse one log file and send its messages to elasticsearch in batches.
+    This is run in a worker process.
+
+    @param args: C{(path, batch_size)}
+    @type args: C{tuple}
+
+    @return: C{(path, number of messages indexed, seconds taken, error,
+        days)}, where days is the set of C{(channel, (year, month, day))}
+        tuples that messages were indexed for
+    """
+    path, batch_size = args
+    client = ESLogLine._client
+    index = ESLogLine._get_index()
+    doctype = ESLogLine._get_doctype()
+
+    start = time.time()
+    count = 0
+    seen = {}
+    docs = []
+    docids = []
+    days = set()
+
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                record = logreader.parse_line(line)
+                if record is None:
+                    continue
+                occurrence = seen.get(line, 0)
+                seen[line] = occurrence + 1
+                docs.append(_decode(record))
+                days.add((record['channel'],
+                          time.localtime(record['time'])[:3]))
+                docids.append(_doc_id(line, occurrence))
+                if len(docs) >= batch_size:
+                    _check_bulk(client.bulk(docs, index, doctype, docids))
+                    count += len(docs)
+                    docs, docids = [], []
+        if docs:
+            _check_bulk(client.bulk(docs, index, doctype, docids))
+            count += len(docs)
+    except Exception as e:
+        return path, count, time.time() - start, str(e), days
+
+    return path, count, time.time() - start, None, days
+
+
+def _invalidate_pages(page_cache, days):
+    """
+    Pre-rendered pages of days that have been (re)indexed may be out of date
+    """
+    if page_cache is None:
+        return
+    for channel, day in days:
+        if channel and channel.startswith('#'):
+            page_cache.invalidate(channel, date(*day))
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return {'file': os.path.basename(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def load_checkpoint(checkpoint):
+    """
+    Load the files that have already been completely indexed
+
+    @return: C{list} of C{dict}s as per L{_file_key}
+    """
+    if not os.path.exists(checkpoint):
+        return []
+    with open(checkpoint) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_log_files(directory, exclude=()):
+    """
+    Find all log files (but not their indexes) in a directory, biggest first
+    so that the long running workers are started as early as possible.
+
+    @param exclude: file names to skip
+    @type exclude: C{iterable}
+    """
+    paths = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if (os.path.isfile(path) and name not in exclude and
+                not name.endswith(logreader.INDEX_SUFFIX)):
+            paths.append(path)
+    paths.sort(key=os.path.getsize, reverse=True)
+    return paths
+
+
+def _refresh_interval(client, index):
+    """
+    @return: the refresh interval the index is configured with, or
+        elasticsearch's default of C{'1s'} if it hasn't been set
+    """
+    index_settings = client.get_settings(index).get(index, {}).get(
+        'settings', {})
+    return (index_settings.get('index.refresh_interval') or
+            index_settings.get('index', {}).get('refresh_interval') or '1s')
+
+
+def reindex(directory, checkpoint, workers, batch_size, fresh=False):
+    """
+    Index every log file in C{directory} that has not been checkpointed yet,
+    with index refresh switched off for the duration of the load.  The
+    checkpoint is removed once every file has been indexed.
+    """
+    utils = ElasticsearchUtils(ESLogLine)
+    client = ESLogLine._client
+    page_cache = pagecache.get_page_cache()
+    index = ESLogLine._get_index()
+
+    if fresh:
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        try:
+            utils.delete_index()
+        except Exception:
+            pass
+        utils.create_index()
+
+    done = load_checkpoint(checkpoint)
+    paths = [path for path in find_log_files(
+                directory, exclude=[os.path.basename(checkpoint)])
+             if _file_key(path) not in done]
+    print 'Indexing %d files (%d already done) with %d workers' % (
+        len(paths), len(done), workers)
+
+    refresh_interval = _refresh_interval(client, index)
+    client.update_settings(index, {'index': {'refresh_interval': '-1'}})
+    pool = multiprocessing.Pool(workers)
+    start = time.time()
+    total = 0
+    failed = 0
+    try:
+        with open(checkpoint, 'a') as checkpoint_file:
+            jobs = [(path, batch_size) for path in paths]
+            for path, count, took, error, days in pool.imap_unordered(
+                    index_file, jobs):
+                total += count
+                _invalidate_pages(page_cache, days)
+                if error:
+                    failed += 1
+                    print 'FAILED %s after %d messages: %s' % (
+                        path, count, error)
+                    continue
+                checkpoint_file.write('%s\n' % json.dumps(_file_key(path)))
+                checkpoint_file.flush()
+                elapsed = time.time() - start
+                print '%s: %d messages in %.1fs - total %d (%.0f/s)' % (
+                    path, count, took, total, total / max(elapsed, 0.001))
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+        client.update_settings(
+            index, {'index': {'refresh_interval': refresh_interval}})
+        client.refresh(index)
+
+    elapsed = time.time() - start
+    print 'Indexed %d messages in %.1fs (%.0f/s), %d files failed' % (
+        total, elapsed, total / max(elapsed, 0.001), failed)
+    if not failed:
+        # nothing left to resume - the next run has to start afresh
+        os.remove(checkpoint)
+    return failed
+
+
+def main(argv=None):
+    config = Options()
+    try:
+        config.parseOptions(argv)
+    except usage.UsageError as e:
+        print '%s: %s' % (sys.argv[0], e)
+        print config
+        return 2
+
+    failed = reindex(config['directory'], config['checkpoint'],
+                     config['workers'], config['batch-size'], config['fresh'])
+    return int(bool(failed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
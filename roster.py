@@ -0,0 +1,141 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_roster -*-
+
+"""
+Who is in each of the channels the bot is in, kept in memory by the bot: seeded
+from the names the server sends when the bot joins a channel, and kept up to
+date as users join, leave, quit, are kicked and change their nicks.
+"""
+
+# the prefixes the server puts on the names of channel operators, voiced
+# users and so on
+_MODES = '@+%&~!'
+
+
+class Roster(object):
+    """
+    The users in each channel.  User and channel names are case insensitive.
+    """
+
+    def __init__(self):
+        # lower case channel name -> lower case nick -> nick
+        self._channels = {}
+        # lower case nick -> set of lower case channel names
+        self._users = {}
+        # lower case channel name -> the names being sent by the server
+        self._pending = {}
+        # lower case channel name -> channel name
+        self._names = {}
+
+    def _add(self, nick, channel):
+        self._channels.setdefault(channel.lower(), {})[nick.lower()] = nick
+        self._users.setdefault(nick.lower(), set()).add(channel.lower())
+
+    def _remove(self, nick, channel):
+        members = self._channels.get(channel.lower(), {})
+        members.pop(nick.lower(), None)
+        channels = self._users.get(nick.lower())
+        if channels is not None:
+            channels.discard(channel.lower())
+            if not channels:
+                del self._users[nick.lower()]
+
+    def names(self, channel, names):
+        """
+        Some of the names the server sent for a channel - they replace the
+        channel's members once they have all been sent, see L{end_of_names}
+
+        @param names: the names, with their mode prefixes
+        @type names: C{list} of C{str}
+        """
+        pending = self._pending.setdefault(channel.lower(), [])
+        pending.extend(name.lstrip(_MODES) for name in names)
+
+    def end_of_names(self, channel):
+        """
+        The server has sent all the names of a channel
+        """
+        pending = self._pending.pop(channel.lower(), [])
+        self.forget(channel)
+        self._names[channel.lower()] = channel
+        self._channels[channel.lower()] = {}
+        for nick in pending:
+            if nick:
+                self._add(nick, channel)
+
+    def clear(self):
+        """
+        Forget who is in every channel - the bot was disconnected
+        """
+        self._channels.clear()
+        self._users.clear()
+        self._pending.clear()
+        self._names.clear()
+
+    def forget(self, channel):
+        """
+        Forget who is in a channel - the bot left it
+        """
+        for nick in self._channels.pop(channel.lower(), {}).values():
+            self._remove(nick, channel)
+        self._names.pop(channel.lower(), None)
+
+    def joined(self, nick, channel):
+        self._names.setdefault(channel.lower(), channel)
+        self._add(nick, channel)
+
+    def left(self, nick, channel):
+        self._remove(nick, channel)
+
+    def quit(self, nick):
+        """
+        A user left the server
+
+        @return: C{list} of the names of the channels they were in
+        """
+        channels = self.channels(nick)
+        for channel in channels:
+            self._remove(nick, channel)
+        return channels
+
+    def renamed(self, old, new):
+        """
+        A user changed their nick
+
+        @return: C{list} of the names of the channels they are in
+        """
+        channels = self.quit(old)
+        for channel in channels:
+            self._add(new, channel)
+        return channels
+
+    def members(self, channel):
+        """
+        @return: C{list} of the nicks of the users in a channel
+        """
+        return sorted(self._channels.get(channel.lower(), {}).itervalues())
+
+    def count(self, channel):
+        return len(self._channels.get(channel.lower(), ()))
+
+    def channels(self, nick):
+        """
+        @return: C{list} of the names of the channels a user is in
+        """
+        return sorted(self._names.get(channel, channel)
+                      for channel in self._users.get(nick.lower(), ()))
+
+    def is_in(self, nick, channel):
+        return nick.lower() in self._channels.get(channel.lower(), ())
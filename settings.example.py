@@ -8,13 +8,54 @@ ALT_NICK = '_test_slogger_nick'
 IRC_HOST = 'irc.freenode.net'
 IRC_PORT = 6667
 IRC_CHANNELS = ['##test_slogger_room', '##test_slogger_room2']
+# to log more than one network, list them here - anything a network leaves
+# out is taken from the settings above, and IRC_CHANNELS are still the
+# channels the web interface shows by default.  Channels are told apart by
+# their names alone, so no channel can be logged on more than one network.
+# IRC_NETWORKS = [
+#     {'host': 'irc.freenode.net', 'port': 6667,
+#      'channels': ['##test_slogger_room']},
+#     {'host': 'irc.example.net', 'port': 6667, 'nick': 'slogger',
+#      'alt_nick': '_slogger', 'channels': ['#slogger']},
+# ]
+
+# the bot reconnects after a delay that grows after every failed attempt, up
+# to this many seconds
+IRC_RECONNECT_MAX_DELAY = 300
+
+# how many worker processes to spread the channels over, each with its own
+# IRC connections, or 0 to run the bots in this process.  Workers send a
+# heartbeat every SHARD_HEARTBEAT_INTERVAL seconds, and are restarted if they
+# haven't for SHARD_HEARTBEAT_TIMEOUT seconds.  Their health is shown at
+# /shards.  Each worker has its own system log file, but the workers share
+# each network's watches and presence files, so those follow the channels
+# that move between workers.
+SHARD_WORKERS = 0
+SHARD_HEARTBEAT_INTERVAL = 5
+SHARD_HEARTBEAT_TIMEOUT = 30
+
+# the nicks that can join and part channels with the bot's join and part
+# commands, and watch for /regex/ patterns.  Nicks are only as trustworthy as the network's nick registration,
+# so only add nicks that are registered and enforced by services.
+IRC_ADMINS = []
 
 ####################
 # LOGGING SETTINGS #
 ####################
 LOG_FILE_PATH = './logs/'
+# 'elasticsearch', or 'sqlite' to store and search logs without a JVM
+SEARCH_BACKEND = 'elasticsearch'
+SQLITE_PATH = './slogger.sqlite'
 ELASTICSEARCH_HOSTS = ['localhost:9200']
 ELASTICSEARCH_TIMEOUT = 10
+# messages are indexed in bulk requests of up to this many; while they
+# can't be, up to this many are held, and the oldest dropped after that
+# (they are still in the log files, which reindex.py --fresh can index)
+SEARCH_BULK_SIZE = 1000
+SEARCH_MAX_BUFFERED = 100000
+# channels each get their own log file, opened the first time something is
+# logged to them - at most this many are kept open at once
+LOG_MAX_OPEN_FILES = 100
 
 ###########################
 # HTTP INTERFACE SETTINGS #
@@ -22,3 +63,58 @@ ELASTICSEARCH_TIMEOUT = 10
 ENABLE_HTTP = True
 HTTP_HOST = '127.0.0.1'
 HTTP_PORT = 8087
+# the url of the web interface, for the links the bot sends users
+HTTP_URL = 'http://%s:%d' % (HTTP_HOST, HTTP_PORT)
+# how many searches web pages can run at the same time
+HTTP_QUERY_THREADS = 20
+# with a token set, channels can be listed, joined and parted at
+# /admin/channels by requests with an 'Authorization: Bearer <token>' header
+HTTP_ADMIN_TOKEN = None
+# how long, in seconds, browsers and proxies may cache log pages for days
+# that are over, and for ranges that messages may still be logged in (pages
+# for days that are over still list the channels and their active users, so
+# after this long they are revalidated, which is cheap unless those changed)
+HTTP_CLOSED_RANGE_MAX_AGE = 3600
+HTTP_OPEN_RANGE_MAX_AGE = 30
+# where to keep pre-rendered pages of days that are over, or None to render
+# every page on demand
+PAGE_CACHE_PATH = './page_cache'
+# how many new messages to hold for a live viewer that is not keeping up,
+# before dropping the oldest
+LIVE_MAX_QUEUED = 100
+# how many web page and API queries can run at once, how many more can wait
+# (and for how many seconds) for their turn before being turned away with a
+# 503, how many queries a second each client can make (in bursts of how
+# many), and how expensive a query can be (roughly one per search term, plus
+# 100 for a term starting with a wildcard)
+HTTP_QUERY_CONCURRENCY = 10
+HTTP_QUERY_MAX_WAITING = 20
+HTTP_QUERY_WAIT_TIMEOUT = 5
+HTTP_QUERY_RATE = 2
+HTTP_QUERY_BURST = 10
+HTTP_QUERY_MAX_COST = 50
+# the addresses of reverse proxies in front of the web interface, whose
+# X-Forwarded-For headers are believed when rate limiting each client -
+# otherwise every visitor behind a proxy counts as the same client
+HTTP_TRUSTED_PROXIES = []
+
+#####################
+# PRESENCE SETTINGS #
+#####################
+# where to checkpoint when users last joined and left channels, and how
+# often, in seconds
+PRESENCE_PATH = './presence.json'
+PRESENCE_CHECKPOINT_INTERVAL = 60
+# how many of the most recent events of each channel to keep in memory, for
+# the last command and for web pages showing recent messages
+HISTORY_SIZE = 5000
+# how many mentions of each user in each channel to keep, and for how many
+# days, to tell users how many times they were mentioned while they were away
+MENTIONS_PER_USER = 100
+MENTIONS_RETENTION_DAYS = 7
+# where to save what users are watching for, and how many notifications each
+# user can be sent every so many seconds.  Users are only told about messages
+# in channels they are in.
+WATCHES_PATH = './watches.json'
+WATCH_MAX_NOTIFICATIONS = 5
+WATCH_NOTIFICATION_PERIOD = 60
@@ -0,0 +1,624 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_shard -*-
+
+"""
+Sharding the logged channels across worker processes, each running its own
+bots with their own IRC connections.  The coordinator, which serves the web
+interface, spreads the channels over the workers by consistent hashing,
+restarts workers that stop reporting that they are healthy, and feeds the
+events the workers log to the web interface's live view, directory and
+history.
+
+Workers are run as C{python shard.py worker <name> <networks>}, and talk to
+the coordinator with lines of JSON on L{CONTROL_FD}.
+"""
+import bisect
+import hashlib
+import json
+import os
+import sys
+
+from twisted.application import service
+from twisted.internet import error, protocol, reactor, task
+from twisted.protocols import basic
+from twisted.python import log
+from twisted.web import resource
+
+import bot
+import settings
+from loggers import LogEvent
+
+
+# the file descriptor workers write their heartbeats and events to
+CONTROL_FD = 3
+
+HEARTBEAT = 'heartbeat'
+EVENT = 'event'
+# join or part a channel - sent by the coordinator to the worker that logs
+# the channel, or by a worker to the coordinator when a bot command asks for it
+JOIN = 'join'
+PART = 'part'
+# a worker's bot changed the watches of a network, which the other workers
+# read again - sent by the worker to the coordinator, and by it to the others
+WATCHES = 'watches'
+
+
+def _hash(key):
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+def channel_key(host, channel):
+    """
+    @return: the key a channel is placed on the ring by
+    """
+    return '%s/%s' % (host, channel.lower())
+
+
+class HashRing(object):
+    """
+    A consistent hash ring: each node is placed on the ring at C{replicas}
+    points, and each key belongs to the node at the next point after it.
+    Adding or removing a node only moves the keys between it and its
+    neighbours - about one in every (number of nodes) keys.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._points = []
+        # point -> node
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._nodes.itervalues()))
+
+    def add(self, node):
+        for i in xrange(self.replicas):
+            point = _hash('%s:%d' % (node, i))
+            if point not in self._nodes:
+                bisect.insort(self._points, point)
+            self._nodes[point] = node
+
+    def remove(self, node):
+        for point, owner in self._nodes.items():
+            if owner == node:
+                del self._nodes[point]
+        self._points = sorted(self._nodes)
+
+    def node_for(self, key):
+        """
+        @return: the node the key belongs to, or C{None} if there are no nodes
+        """
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[self._points[i]]
+
+
+def assign(ring, networks):
+    """
+    Split the networks' channels between the nodes of a ring
+
+    @param networks: the networks, as returned by L{bot.get_networks}
+    @type networks: C{list}
+
+    @return: C{dict} mapping each node with channels to a C{list} of the
+        networks it logs, each with only the node's channels
+    """
+    assignments = {}
+    for index, network in enumerate(networks):
+        for channel in network['channels']:
+            node = ring.node_for(channel_key(network['host'], channel))
+            node_networks = assignments.setdefault(node, {})
+            if index not in node_networks:
+                node_networks[index] = dict(network, channels=[])
+            node_networks[index]['channels'].append(channel)
+    return dict((node, [node_networks[i] for i in sorted(node_networks)])
+                for node, node_networks in assignments.iteritems())
+
+
+def worker_nick(nick, name):
+    """
+    @return: the nick a worker uses, so that workers on the same network
+        don't collide - the nick with the worker's number added, within the
+        16 characters the bot allows
+    """
+    suffix = name.rsplit('-', 1)[-1]
+    return nick[:16 - len(suffix)] + suffix
+
+
+def system_log_name(name):
+    """
+    @return: the name of a worker's system log file
+    """
+    return 'system.%s.logs' % (name,)
+
+
+def _encode(value):
+    """
+    @return: the value decoded from JSON with its strings encoded as UTF-8,
+        like the strings the bot gets from IRC
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_encode(key), _encode(item))
+                    for key, item in value.iteritems())
+    return value
+
+
+def _event_from_json(document):
+    document = _encode(document)
+    return LogEvent(*[document.get(key) for key in (
+        'time', 'user', 'channel', 'event', 'host', 'message')])
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """
+    The coordinator's end of a worker process: lines the worker writes to
+    L{CONTROL_FD} are passed to the coordinator, and its output is logged
+    """
+
+    def __init__(self, coordinator, name):
+        self.coordinator = coordinator
+        self.name = name
+        self._buffers = {}
+
+    def childDataReceived(self, fd, data):
+        lines = (self._buffers.get(fd, '') + data).split('\n')
+        self._buffers[fd] = lines.pop()
+        for line in lines:
+            if fd != CONTROL_FD:
+                log.msg('[%s] %s' % (self.name, line))
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                log.msg('Bad control message from %s: %r' % (self.name, line))
+                continue
+            self.coordinator.received(self.name, message)
+
+    def processEnded(self, reason):
+        self.coordinator.ended(self.name, reason)
+
+
+class Coordinator(service.Service):
+    """
+    Runs C{count} worker processes, each logging the channels the hash ring
+    gives it.  A worker that has not sent a heartbeat for
+    C{heartbeat_timeout} seconds is killed, and workers that exit are
+    started again after C{restart_delay} seconds.
+
+    The events the workers log are given to C{loggers}, so that the web
+    interface served with the coordinator sees every channel.
+    """
+    restart_delay = 5
+
+    def __init__(self, networks, count, loggers=(), heartbeat_timeout=30,
+                 spawn=None, clock=reactor):
+        """
+        @param networks: the networks to log, as returned by
+            L{bot.get_networks}
+        @type networks: C{list}
+
+        @param count: how many workers to run
+        @type count: C{int}
+
+        @param loggers: the loggers to give the workers' events to
+        @type loggers: C{list}
+
+        @param spawn: starts a process, like C{reactor.spawnProcess}
+        @type spawn: C{callable}
+        """
+        self.networks = networks
+        self.loggers = list(loggers)
+        self.heartbeat_timeout = heartbeat_timeout
+        self._spawn = spawn or reactor.spawnProcess
+        self._clock = clock
+        self.ring = HashRing()
+        self.workers = []
+        self.assignments = {}
+        # worker name -> process transport, and the latest heartbeat
+        self._processes = {}
+        self._heartbeats = {}
+        self._restarts = {}
+        self._checks = task.LoopingCall(self.check)
+        self._checks.clock = clock
+        self.resize(count)
+
+    def _names(self, count):
+        return ['worker-%d' % (i,) for i in xrange(count)]
+
+    def resize(self, count):
+        """
+        Change how many workers there are.  Only the workers whose channels
+        change are restarted.
+        """
+        names = self._names(count)
+        for name in self.workers:
+            if name not in names:
+                self.ring.remove(name)
+        for name in names:
+            if name not in self.workers:
+                self.ring.add(name)
+        self.workers = names
+        old = self.assignments
+        self.assignments = self._assign()
+        if not self.running:
+            return
+        for name in set(old).union(self.assignments):
+            if old.get(name) == self.assignments.get(name):
+                continue
+            if name in self._processes:
+                # it is started again with its new channels when it exits
+                self._kill(name)
+            elif name in self.assignments:
+                self.start(name)
+
+    def _assign(self):
+        return dict(
+            (name, [dict(network, shard=name,
+                         nick=worker_nick(network['nick'], name))
+                    for network in networks])
+            for name, networks in assign(self.ring, self.networks).iteritems())
+
+    def startService(self):
+        service.Service.startService(self)
+        for name in sorted(self.assignments):
+            self.start(name)
+        self._checks.start(self.heartbeat_timeout / 2.0, now=False)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._checks.running:
+            self._checks.stop()
+        for call in self._restarts.values():
+            call.cancel()
+        self._restarts.clear()
+        for name in list(self._processes):
+            self._kill(name, 'TERM')
+
+    def start(self, name):
+        """
+        Start a worker with the channels it is assigned
+        """
+        self._restarts.pop(name, None)
+        args = [sys.executable, os.path.abspath(__file__), 'worker', name,
+                json.dumps(self.assignments[name])]
+        self._processes[name] = self._spawn(
+            WorkerProcess(self, name), sys.executable, args, env=os.environ,
+            path=os.path.dirname(os.path.abspath(__file__)),
+            childFDs={0: 'w', 1: 'r', 2: 'r', CONTROL_FD: 'r'})
+        # a worker gets as long to send its first heartbeat as it has between
+        # heartbeats after that
+        self._heartbeats[name] = {'time': self._clock.seconds(),
+                                  'started': self._clock.seconds()}
+
+    def _network(self, host):
+        if host is None and len(self.networks) == 1:
+            return self.networks[0]
+        for network in self.networks:
+            if network['host'] == host:
+                return network
+        raise ValueError('%s is not a logged network' % (host,))
+
+    def channels(self):
+        """
+        @return: C{dict} mapping each network's host to its channels
+        """
+        return dict((network['host'], list(network['channels']))
+                    for network in self.networks)
+
+    def _change(self, action, channel, host):
+        """
+        Tell the worker that logs a channel to join or part it.  Only the
+        channel's worker is told - the other workers keep running, and aren't
+        restarted as they would be by L{resize}.
+        """
+        network = self._network(host)
+        name = self.ring.node_for(channel_key(network['host'], channel))
+        self.assignments = self._assign()
+        process = self._processes.get(name)
+        if process is not None:
+            process.writeToChild(0, json.dumps(
+                {'type': action, 'host': network['host'],
+                 'channel': channel}) + '\n')
+        elif (self.running and name in self.assignments and
+              name not in self._restarts):
+            # the worker had no channels before this one
+            self.start(name)
+        # otherwise the worker is given its channels when it is started again
+
+    def join(self, channel, host=None):
+        """
+        Start logging a channel, on the worker the hash ring gives it to
+
+        @param host: the network to join the channel on - can be left out if
+            there is only one
+
+        @return: whether the channel wasn't already being logged
+
+        @raise ValueError: if the channel or network is not valid, or the
+            channel is logged on another network
+        """
+        bot.valid_channel(channel)
+        network = self._network(host)
+        if channel.lower() in [name.lower() for name in network['channels']]:
+            return False
+        bot.check_channels(self.networks + [
+            dict(network, channels=[channel])])
+        network['channels'] = network['channels'] + [channel]
+        self._change(JOIN, channel, host)
+        return True
+
+    def part(self, channel, host=None):
+        """
+        Stop logging a channel
+
+        @return: whether the channel was being logged
+
+        @raise ValueError: if the network is not valid
+        """
+        network = self._network(host)
+        for name in network['channels']:
+            if name.lower() == (channel or '').lower():
+                network['channels'] = [other for other in network['channels']
+                                       if other != name]
+                self._change(PART, name, host)
+                return True
+        return False
+
+    def _kill(self, name, signal='KILL'):
+        try:
+            self._processes[name].signalProcess(signal)
+        except error.ProcessExitedAlready:
+            pass
+
+    def received(self, name, message):
+        """
+        A worker sent a control message
+        """
+        if message.get('type') == HEARTBEAT:
+            heartbeat = dict(message, time=self._clock.seconds())
+            heartbeat['started'] = self._heartbeats.get(name, {}).get(
+                'started', heartbeat['time'])
+            self._heartbeats[name] = heartbeat
+        elif message.get('type') == EVENT:
+            event = _event_from_json(message['event'])
+            for logger in self.loggers:
+                try:
+                    logger.log(event)
+                except Exception:
+                    log.err(None, 'Logging an event from %s failed' % (name,))
+        elif message.get('type') == WATCHES:
+            line = json.dumps({'type': WATCHES,
+                               'host': message.get('host')}) + '\n'
+            for other, process in self._processes.iteritems():
+                hosts = [network['host'] for network
+                         in self.assignments.get(other, ())]
+                if other != name and message.get('host') in hosts:
+                    process.writeToChild(0, line)
+        elif message.get('type') in (JOIN, PART):
+            try:
+                getattr(self, message['type'])(
+                    _encode(message.get('channel')),
+                    _encode(message.get('host')))
+            except ValueError as e:
+                log.msg('%s asked to %s %s: %s' % (
+                    name, message['type'], message.get('channel'), e))
+
+    def ended(self, name, reason):
+        """
+        A worker exited - start it again, unless it isn't needed any more
+        """
+        self._processes.pop(name, None)
+        self._heartbeats.pop(name, None)
+        if not self.running or name not in self.assignments:
+            return
+        log.msg('%s exited (%s), restarting it in %d seconds' % (
+            name, reason.getErrorMessage(), self.restart_delay))
+        self._restarts[name] = self._clock.callLater(
+            self.restart_delay, self.start, name)
+
+    def healthy(self, name):
+        """
+        @return: whether a worker is running and has sent a heartbeat lately
+        """
+        heartbeat = self._heartbeats.get(name)
+        return (name in self._processes and heartbeat is not None and
+                heartbeat['time'] > self._clock.seconds() -
+                self.heartbeat_timeout)
+
+    def check(self):
+        """
+        Kill the workers that have stopped sending heartbeats
+        """
+        for name in list(self._processes):
+            if not self.healthy(name):
+                log.msg('%s has not sent a heartbeat for %d seconds, killing '
+                        'it' % (name, self.heartbeat_timeout))
+                self._kill(name)
+
+    def status(self):
+        """
+        @return: C{dict} mapping each worker's name to its health, channels,
+            and latest heartbeat
+        """
+        status = {}
+        for name, networks in self.assignments.iteritems():
+            heartbeat = self._heartbeats.get(name, {})
+            process = self._processes.get(name)
+            status[name] = {
+                'healthy': self.healthy(name),
+                'pid': getattr(process, 'pid', None),
+                'channels': dict((network['host'], network['channels'])
+                                 for network in networks),
+                'last_heartbeat': heartbeat.get('time'),
+                'started': heartbeat.get('started'),
+                'events': heartbeat.get('events'),
+                'restarting': name in self._restarts}
+        return status
+
+
+class StatusResource(resource.Resource):
+    """
+    The workers' status, as JSON
+    """
+    isLeaf = True
+
+    def __init__(self, coordinator):
+        resource.Resource.__init__(self)
+        self.coordinator = coordinator
+
+    def render_GET(self, request):
+        status = self.coordinator.status()
+        healthy = all(worker['healthy'] for worker in status.itervalues())
+        if not healthy:
+            request.setResponseCode(503)
+        request.setHeader('content-type', 'application/json')
+        return json.dumps({'healthy': healthy, 'workers': status})
+
+
+class WorkerControl(basic.LineOnlyReceiver):
+    """
+    The worker's end of the control channel.  It has the same C{log} method
+    as the loggers in L{loggers}, so it can be one of the bot's loggers, and
+    sends a heartbeat every C{interval} seconds while it is connected.
+
+    It is also the channel manager of the worker's bots (see
+    L{bot.ChannelManager}): channels joined and parted with bot commands are
+    passed on to the coordinator, which tells the worker the hash ring gives
+    the channel to.
+    """
+    delimiter = '\n'
+
+    def __init__(self, name, interval=5, clock=reactor):
+        self.name = name
+        # network host -> the factory of the worker's bot on that network
+        self.factories = {}
+        self._events = 0
+        self._heartbeats = task.LoopingCall(self.heartbeat)
+        self._heartbeats.clock = clock
+        self._interval = interval
+
+    def connectionMade(self):
+        self._heartbeats.start(self._interval)
+
+    def connectionLost(self, reason):
+        if self._heartbeats.running:
+            self._heartbeats.stop()
+        # without the coordinator there is no one to log for
+        if reactor.running:
+            reactor.stop()
+
+    def lineReceived(self, line):
+        try:
+            message = _encode(json.loads(line))
+            factory = self.factories[message['host']]
+        except (ValueError, KeyError):
+            log.msg('Bad control message from the coordinator: %r' % (line,))
+            return
+        if message.get('type') == WATCHES:
+            factory.watches.reload()
+        elif message.get('type') == JOIN:
+            factory.join_channel(message['channel'])
+        elif message.get('type') == PART:
+            factory.part_channel(message['channel'])
+
+    def _send(self, message):
+        if self.transport is not None:
+            self.sendLine(json.dumps(message))
+
+    def heartbeat(self):
+        self._send({'type': HEARTBEAT, 'name': self.name,
+                    'events': self._events})
+
+    def log(self, event):
+        self._events += 1
+        self._send({'type': EVENT, 'event': event.document})
+
+    def channels(self):
+        return dict((host, list(factory.channels))
+                    for host, factory in self.factories.iteritems())
+
+    def join(self, channel, host=None):
+        """
+        Ask the coordinator to join a channel
+
+        @return: C{None}, as only the coordinator knows whether the channel
+            was already being logged
+        """
+        bot.valid_channel(channel)
+        self._send({'type': JOIN, 'host': host, 'channel': channel})
+
+    def part(self, channel, host=None):
+        self._send({'type': PART, 'host': host, 'channel': channel})
+
+    def watches_changed(self, host):
+        """
+        Tell the other workers that the watches of a network changed
+        """
+        self._send({'type': WATCHES, 'host': host})
+
+
+def run_worker(name, networks):
+    """
+    Log the given networks' channels, reporting to the coordinator
+    """
+    from twisted.internet import stdio
+
+    import loggers
+    import presence
+
+    log.startLogging(sys.stdout)
+    control = WorkerControl(
+        name, getattr(settings, 'SHARD_HEARTBEAT_INTERVAL', 5))
+    stdio.StandardIO(control, stdin=0, stdout=CONTROL_FD)
+
+    # the workers' channels don't overlap, so they can share the channel
+    # files, but each needs its own system log to append to and rotate
+    pipeline = loggers.LoggerPipeline(
+        settings.LOG_FILE_PATH, [(network['host'], network['channels'])
+                                 for network in networks],
+        system_name=system_log_name(name))
+    pipeline.add(control)
+    reactor.addSystemEventTrigger('before', 'shutdown', pipeline.stop)
+    services = service.MultiService()
+    for network in networks:
+        factory = bot.LogBotFactory(network, pipeline, networks)
+        control.factories[network['host']] = factory
+        factory.channel_manager = control
+        factory.watches.changed = (
+            lambda host=network['host']: control.watches_changed(host))
+        presence.PresenceService(
+            factory.presence,
+            bot.network_path(getattr(settings, 'PRESENCE_PATH',
+                                     './presence.json'), network, networks),
+            network['channels'],
+            getattr(settings, 'PRESENCE_CHECKPOINT_INTERVAL', 60)
+        ).setServiceParent(services)
+        reactor.connectTCP(network['host'], network['port'], factory)
+    services.startService()
+    reactor.addSystemEventTrigger('before', 'shutdown', services.stopService)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'worker':
+        sys.exit('usage: %s worker <name> <networks>' % (sys.argv[0],))
+    run_worker(sys.argv[2], _encode(json.loads(sys.argv[3])))
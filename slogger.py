@@ -12,27 +12,94 @@
 # limitations under the License.
 
 
-from bot import LogBotFactory
+import bot
+import directory
+import history
+import presence
+import pubsub
 import settings
+import shard
 
 from twisted.internet import reactor
+from twisted.python import log
 from twisted.application import internet, service
 from twisted.application.service import Application
-from twisted.python.filepath import FilePath
-from twisted.web import static, server
+from twisted.web import resource, server
 
-from web.view import SloggerMainResource
+from web import assets, pagecache
+from web.admin import ChannelsResource
+from web.view import LogsResource, SloggerMainResource
 
 application = Application("Slogger")
 
+# web pages run their searches in the reactor's threadpool, so this is how many
+# can be in progress at once
+reactor.suggestThreadPoolSize(getattr(settings, 'HTTP_QUERY_THREADS', 20))
+
 root = SloggerMainResource()
-path = FilePath(__file__).sibling("web").child("media").path
-root.putChild('media', static.File(path))
+root.putChild('media', assets.media)
 
 sc = service.IServiceCollection(application)
 site = server.Site(root)
 i = internet.TCPServer(settings.HTTP_PORT, site)
 i.setServiceParent(sc)
 
-bot_factory = LogBotFactory()
-reactor.connectTCP(settings.IRC_HOST, settings.IRC_PORT, bot_factory)
+# render each channel's day into the page cache once it is over - every
+# channel the directory knows of, including ones joined at runtime and on
+# other networks
+page_cache = pagecache.get_page_cache()
+if page_cache is not None:
+    renderer = pagecache.DayPageRenderer(
+        page_cache, LogsResource().render_day, directory.directory.channels)
+    renderer.setServiceParent(sc)
+
+# seed the channel/user directory the web pages list, once the reactor is
+# running - the bot keeps it up to date from then on
+reactor.callWhenRunning(lambda: directory.directory.load().addErrback(
+    log.err, 'Loading the channel directory failed'))
+
+# one bot for each network, all logging through the same pipeline (and so the
+# same connections to the search index) - or if the channels are sharded,
+# worker processes running the bots, which send what they log back to be
+# shown by the web pages
+networks = bot.get_networks()
+shard_workers = getattr(settings, 'SHARD_WORKERS', 0)
+if shard_workers:
+    coordinator = shard.Coordinator(
+        networks, shard_workers,
+        [pubsub.hub, directory.directory, history.history],
+        getattr(settings, 'SHARD_HEARTBEAT_TIMEOUT', 30))
+    coordinator.setServiceParent(sc)
+    root.putChild('shards', shard.StatusResource(coordinator))
+    channel_manager = coordinator
+else:
+    pipeline = bot.build_pipeline(settings.LOG_FILE_PATH, networks)
+    # don't lose what is still buffered when slogger stops
+    reactor.addSystemEventTrigger('before', 'shutdown', pipeline.stop)
+    bot_factories = []
+    for network in networks:
+        bot_factory = bot.LogBotFactory(network, pipeline, networks)
+        bot_factories.append(bot_factory)
+
+        # restore when users last joined and left channels, and checkpoint it
+        # as the bot keeps it up to date
+        presence.PresenceService(
+            bot_factory.presence,
+            bot.network_path(getattr(settings, 'PRESENCE_PATH',
+                                     './presence.json'), network, networks),
+            network['channels'],
+            getattr(settings, 'PRESENCE_CHECKPOINT_INTERVAL', 60)
+        ).setServiceParent(sc)
+
+        reactor.connectTCP(network['host'], network['port'], bot_factory)
+    # the join and part commands can change the channels on any network
+    channel_manager = bot.ChannelManager(bot_factories)
+    for bot_factory in bot_factories:
+        bot_factory.channel_manager = channel_manager
+
+# joining and parting channels over HTTP, for those with the admin token
+admin_token = getattr(settings, 'HTTP_ADMIN_TOKEN', None)
+if admin_token:
+    admin = resource.Resource()
+    admin.putChild('channels', ChannelsResource(channel_manager, admin_token))
+    root.putChild('admin', admin)
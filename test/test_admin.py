@@ -0,0 +1,91 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.admin}
+"""
+import json
+
+import mock
+
+from twisted.trial import unittest
+from twisted.web.test.test_web import DummyRequest
+
+from web import admin
+
+
+class ChannelsResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{admin.ChannelsResource}
+    """
+
+    def setUp(self):
+        self.manager = mock.Mock(spec=['channels', 'join', 'part'])
+        self.resource = admin.ChannelsResource(self.manager, 'secret')
+
+    def _render(self, method, token='secret', **args):
+        request = DummyRequest([''])
+        request.method = method
+        request.args = dict((name, [value]) for name, value in args.items())
+        if token is not None:
+            request.requestHeaders.setRawHeaders(
+                'authorization', ['Bearer %s' % (token,)])
+        body = json.loads(self.resource.render(request))
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['application/json'])
+        return request.responseCode or 200, body
+
+    def test_unauthorized(self):
+        """
+        Requests without the token are turned away
+        """
+        self.assertEqual(self._render('GET', None)[0], 401)
+        self.assertEqual(self._render('POST', 'wrong', action='join',
+                                      channel='#new')[0], 401)
+        self.assertFalse(self.manager.join.called)
+
+    def test_list(self):
+        """
+        GET lists the channels of each network
+        """
+        self.manager.channels.return_value = {'irc.example.net': ['#a']}
+        self.assertEqual(self._render('GET'),
+                         (200, {'channels': {'irc.example.net': ['#a']}}))
+
+    def test_join_and_part(self):
+        """
+        POST joins or parts a channel, on the network given
+        """
+        self.manager.join.return_value = True
+        self.assertEqual(
+            self._render('POST', action='join', channel='#new',
+                         network='irc.example.net'),
+            (200, {'action': 'join', 'channel': '#new', 'changed': True}))
+        self.manager.join.assert_called_once_with('#new', 'irc.example.net')
+        self.manager.part.return_value = False
+        self.assertEqual(
+            self._render('POST', action='part', channel='#old'),
+            (200, {'action': 'part', 'channel': '#old', 'changed': False}))
+        self.manager.part.assert_called_once_with('#old', None)
+
+    def test_bad_requests(self):
+        """
+        Unknown actions and channels the manager rejects are bad requests
+        """
+        self.assertEqual(self._render('POST', action='kick', channel='#a')[0],
+                         400)
+        self.manager.join.side_effect = ValueError('nope is not a channel')
+        self.assertEqual(
+            self._render('POST', action='join', channel='nope'),
+            (400, {'error': 'nope is not a channel'}))
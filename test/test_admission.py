@@ -0,0 +1,241 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.admission}
+"""
+
+from twisted.internet import address, defer, task
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+
+from web import admission
+
+
+class QueryCostTestCase(unittest.TestCase):
+    """
+    Tests for L{web.admission.query_cost}
+    """
+
+    def test_terms(self):
+        """
+        Plain terms cost one each
+        """
+        self.assertEqual(1, admission.query_cost(None))
+        self.assertEqual(3, admission.query_cost('hello world'))
+        self.assertEqual(2, admission.query_cost('user:me'))
+
+    def test_leading_wildcard(self):
+        """
+        Terms starting with a wildcard are very expensive, whatever field
+        they are for
+        """
+        self.assertTrue(admission.query_cost('*orld') >
+                        admission.LEADING_WILDCARD_COST)
+        self.assertTrue(admission.query_cost('message:?orld') >
+                        admission.LEADING_WILDCARD_COST)
+
+    def test_expensive_terms(self):
+        """
+        Trailing wildcards and fuzzy terms cost a bit more
+        """
+        self.assertEqual(2 + admission.EXPENSIVE_TERM_COST,
+                         admission.query_cost('wor*'))
+        self.assertEqual(2 + admission.EXPENSIVE_TERM_COST,
+                         admission.query_cost('world~'))
+
+
+class GateTestCase(unittest.TestCase):
+    """
+    Tests for L{web.admission.Gate}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.gate = admission.Gate(concurrency=1, max_waiting=1,
+                                   wait_timeout=5, rate=1, burst=2,
+                                   max_cost=10, clock=self.clock)
+
+    @defer.inlineCallbacks
+    def test_run(self):
+        """
+        Admitted queries are run in a thread
+        """
+        result = yield self.gate.run('1.2.3.4', 1, lambda x: x * 2, 21)
+        self.assertEqual(42, result)
+
+    def test_too_expensive(self):
+        """
+        Queries that cost too much are rejected with a 400
+        """
+        failure = self.failureResultOf(
+            self.gate.run('1.2.3.4', 11, lambda: None), admission.Rejected)
+        self.assertEqual(400, failure.value.code)
+        self.assertIdentical(None, failure.value.retry_after)
+
+    def test_rate_limit(self):
+        """
+        Clients that make too many queries are told when to try again, and
+        can once their bucket has refilled
+        """
+        self.gate.check('1.2.3.4')
+        self.gate.check('1.2.3.4')
+        e = self.assertRaises(admission.Rejected, self.gate.check, '1.2.3.4')
+        self.assertEqual(429, e.code)
+        self.assertEqual(1, e.retry_after)
+        # other clients have their own buckets
+        self.gate.check('5.6.7.8')
+        self.clock.advance(1)
+        self.gate.check('1.2.3.4')
+
+    def test_unknown_clients_not_rate_limited(self):
+        """
+        Clients whose address isn't known are not rate limited
+        """
+        for i in xrange(5):
+            self.gate.check(None)
+
+    def test_forgets_idle_clients(self):
+        """
+        Once too many clients are being kept track of, the one that has gone
+        the longest without making a query is forgotten
+        """
+        self.gate.max_clients = 2
+        self.gate.check('1.1.1.1')
+        self.gate.check('2.2.2.2')
+        self.gate.check('1.1.1.1')
+        self.gate.check('3.3.3.3')
+        self.assertEqual(['1.1.1.1', '3.3.3.3'], self.gate._buckets.keys())
+        # the client that was kept is still rate limited
+        self.assertRaises(admission.Rejected, self.gate.check, '1.1.1.1')
+
+    def test_queue_full(self):
+        """
+        When every slot is taken and the wait queue is full, queries are
+        rejected straight away with a 503
+        """
+        self.gate._semaphore.acquire()
+        waiting = self.gate.run(None, 1, lambda: None)
+        self.assertNoResult(waiting)
+        self.assertEqual(1, self.gate.waiting())
+        failure = self.failureResultOf(
+            self.gate.run(None, 1, lambda: None), admission.Rejected)
+        self.assertEqual(503, failure.value.code)
+        self.assertEqual(5, failure.value.retry_after)
+
+    def test_wait_timeout(self):
+        """
+        Queries that wait too long for a slot are rejected with a 503, and
+        leave the queue
+        """
+        self.gate._semaphore.acquire()
+        waiting = self.gate.run(None, 1, lambda: None)
+        self.clock.advance(5)
+        failure = self.failureResultOf(waiting, admission.Rejected)
+        self.assertEqual(503, failure.value.code)
+        self.assertEqual(0, self.gate.waiting())
+
+    @defer.inlineCallbacks
+    def test_waiting_query_runs(self):
+        """
+        A waiting query runs when a slot is released, and releases it in turn
+        """
+        self.gate._semaphore.acquire()
+        waiting = self.gate.run(None, 1, lambda: 'done')
+        self.gate._semaphore.release()
+        result = yield waiting
+        self.assertEqual('done', result)
+        self.assertEqual(1, self.gate._semaphore.tokens)
+        # the timeout was cancelled
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @defer.inlineCallbacks
+    def test_failed_query_releases_slot(self):
+        """
+        A query that fails still gives up its slot
+        """
+        def _fail():
+            raise ValueError()
+        yield self.assertFailure(self.gate.run(None, 1, _fail), ValueError)
+        self.assertEqual(1, self.gate._semaphore.tokens)
+
+
+class ClientAddressTestCase(unittest.TestCase):
+    """
+    Tests for L{web.admission.client_address}
+    """
+
+    def _request(self, peer, *forwarded):
+        request = DummyRequest([''])
+        request.client = address.IPv4Address('TCP', peer, 12345)
+        if forwarded:
+            request.requestHeaders.setRawHeaders('x-forwarded-for',
+                                                 list(forwarded))
+        return request
+
+    def test_direct(self):
+        """
+        Requests not from a trusted proxy are from their peer, whatever their
+        X-Forwarded-For header says
+        """
+        request = self._request('10.0.0.5', '1.2.3.4')
+        self.assertEqual(
+            admission.client_address(request, ['10.0.0.1']), '10.0.0.5')
+        self.assertEqual(admission.client_address(request, []), '10.0.0.5')
+
+    def test_trusted_proxy(self):
+        """
+        Requests from a trusted proxy are from the last address it was
+        forwarded for that isn't a trusted proxy too
+        """
+        request = self._request('10.0.0.1', '6.6.6.6, 1.2.3.4', '10.0.0.2')
+        self.assertEqual(
+            admission.client_address(request, ['10.0.0.1', '10.0.0.2']),
+            '1.2.3.4')
+
+    def test_trusted_proxy_without_header(self):
+        """
+        A trusted proxy that doesn't say who it forwarded for is the client
+        """
+        request = self._request('10.0.0.1')
+        self.assertEqual(
+            admission.client_address(request, ['10.0.0.1']), '10.0.0.1')
+
+    def test_settings(self):
+        """
+        The trusted proxies are C{settings.HTTP_TRUSTED_PROXIES} by default
+        """
+        if not hasattr(admission.settings, 'HTTP_TRUSTED_PROXIES'):
+            admission.settings.HTTP_TRUSTED_PROXIES = []
+            self.addCleanup(delattr, admission.settings,
+                            'HTTP_TRUSTED_PROXIES')
+        self.patch(admission.settings, 'HTTP_TRUSTED_PROXIES', ['10.0.0.1'])
+        self.assertEqual(admission.client_address(
+            self._request('10.0.0.1', '1.2.3.4')), '1.2.3.4')
+
+
+class RejectedTestCase(unittest.TestCase):
+    """
+    Tests for L{web.admission.Rejected}
+    """
+
+    def test_respond(self):
+        """
+        The response gets the status and a Retry-After header
+        """
+        request = DummyRequest([''])
+        message = admission.Rejected(503, 'busy', 5).respond(request)
+        self.assertEqual('busy', message)
+        self.assertEqual(503, request.responseCode)
+        self.assertEqual('5', request.responseHeaders.getRawHeaders(
+            'retry-after')[0])
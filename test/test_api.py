@@ -0,0 +1,288 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.api}
+"""
+
+import json
+import threading
+import time
+from datetime import date
+
+import mock
+
+from twisted.internet import defer, reactor, task
+from twisted.internet.error import ConnectionLost
+from twisted.python import failure, filepath
+from twisted.trial import unittest
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test._util import _render
+from twisted.web.test.requesthelper import DummyRequest
+
+from elasticsearch import ESLogLine
+from elasticsearch.core.sqlitestore import SQLiteClient
+from web import admission, api
+import loggers
+import settings
+
+
+class _StreamingRequest(DummyRequest):
+    """
+    L{DummyRequest} only handles pull producers
+    """
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class CursorTestCase(unittest.TestCase):
+    """
+    Tests for the cursor helpers in L{web.api}
+    """
+
+    def _messages(self, *times):
+        return [ESLogLine(time=t) for t in times]
+
+    def test_roundtrip(self):
+        """
+        A cursor decodes to what it was encoded from
+        """
+        self.assertEqual((5.5, 2), api.decode_cursor(api.encode_cursor(5.5, 2)))
+        self.assertRaises(ValueError, api.decode_cursor, 'garbage')
+
+    def test_no_more_pages(self):
+        """
+        A page that is not full is the last one
+        """
+        self.assertIdentical(
+            None, api.next_cursor(self._messages(1.0, 2.0), 3))
+
+    def test_counts_messages_at_the_last_time(self):
+        """
+        The cursor skips the messages at the last time that were returned,
+        including those returned by previous pages
+        """
+        messages = self._messages(1.0, 2.0, 2.0)
+        self.assertEqual((2.0, 2), api.decode_cursor(
+            api.next_cursor(messages, 3)))
+        self.assertEqual((2.0, 5), api.decode_cursor(
+            api.next_cursor(self._messages(2.0, 2.0, 2.0), 3, (2.0, 2))))
+
+
+class MessagesResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.api.MessagesResource}, reading the flat file logs
+    """
+
+    def setUp(self):
+        self.patch(
+            ESLogLine, 'objects', mock.MagicMock(spec=ESLogLine.objects))
+        ESLogLine.objects.is_available.return_value = False
+
+        directory = filepath.FilePath(self.mktemp())
+        directory.createDirectory()
+        self.patch(settings, 'LOG_FILE_PATH', directory.path)
+        self.midnight = time.mktime(date.today().timetuple())
+        logger = loggers.DailyFileLogger('#channel1', directory.path)
+        for i, user in enumerate(('me', 'you', 'me', 'me', 'you')):
+            logger.log(loggers.LogEvent(self.midnight + i, user, '#channel1',
+                                        'MSG', 'host', str(i)))
+        logger.close()
+
+    @defer.inlineCallbacks
+    def _get(self, **args):
+        args.setdefault('channel', '#channel1')
+        request = _StreamingRequest([''])
+        request.args = dict((key, [value]) for key, value in args.items())
+        yield _render(api.MessagesResource(), request)
+        defer.returnValue((request, json.loads(''.join(request.written))))
+
+    @defer.inlineCallbacks
+    def test_fields_and_facets(self):
+        """
+        Only the fields asked for are returned, along with any facets
+        """
+        request, response = yield self._get(fields='user,message',
+                                            facets='user')
+        self.assertEqual({'user': 'me', 'message': '0'},
+                         response['messages'][0])
+        self.assertEqual(5, len(response['messages']))
+        self.assertEqual([['me', 3], ['you', 2]], response['facets']['user'])
+        self.assertIdentical(None, response['next'])
+
+    @defer.inlineCallbacks
+    def test_cursor_pagination(self):
+        """
+        Following the cursors returns every message once
+        """
+        seen = []
+        cursor = None
+        while True:
+            args = {'limit': '2', 'fields': 'message'}
+            if cursor:
+                args['cursor'] = cursor
+            request, response = yield self._get(**args)
+            seen.extend(message['message'] for message in response['messages'])
+            cursor = response['next']
+            if cursor is None:
+                break
+        self.assertEqual(['0', '1', '2', '3', '4'], seen)
+
+    @defer.inlineCallbacks
+    def test_bad_request(self):
+        """
+        Invalid arguments are a 400 with an error message
+        """
+        request, response = yield self._get(fields='password')
+        self.assertEqual(400, request.responseCode)
+        self.assertIn('password', response['error'])
+        request, response = yield self._get(limit='100000')
+        self.assertEqual(400, request.responseCode)
+
+    @defer.inlineCallbacks
+    def test_availability_checked_in_thread(self):
+        """
+        Whether elasticsearch is available, which can take as long as it
+        takes to time out to find out, is not checked in the reactor thread
+        """
+        threads = []
+        ESLogLine.objects.is_available.side_effect = (
+            lambda: threads.append(threading.current_thread()) or False)
+        request, response = yield self._get(fields='message')
+        self.assertEqual(5, len(response['messages']))
+        self.assertEqual(1, len(threads))
+        self.assertNotIdentical(threading.current_thread(), threads[0])
+
+    @defer.inlineCallbacks
+    def test_default_channel(self):
+        """
+        Without a channel, the default channel's messages are returned, and
+        if there isn't one the request is a 400
+        """
+        self.patch(api.directory, 'default_channel', lambda: '#channel1')
+        request = _StreamingRequest([''])
+        yield _render(api.MessagesResource(), request)
+        self.assertEqual(
+            5, len(json.loads(''.join(request.written))['messages']))
+        self.patch(api.directory, 'default_channel', lambda: None)
+        request = _StreamingRequest([''])
+        yield _render(api.MessagesResource(), request)
+        self.assertEqual(400, request.responseCode)
+
+
+class DisconnectTestCase(unittest.TestCase):
+    """
+    Tests for clients that go away before their response has been written
+    """
+
+    def _disconnect_during_query(self, result):
+        pending = defer.Deferred()
+        self.patch(api.admission.gate, 'run', lambda *args: pending)
+        request = _StreamingRequest([''])
+        request.args = {'channel': ['#channel1']}
+        self.assertEqual(NOT_DONE_YET,
+                         api.MessagesResource().render_GET(request))
+        request.processingFailed(failure.Failure(ConnectionLost()))
+        if isinstance(result, Exception):
+            pending.errback(result)
+        else:
+            pending.callback(result)
+
+        def _check():
+            self.assertEqual([], request.written)
+            self.assertEqual(0, request.finished)
+
+        # give a response that was streamed the time to be written
+        return task.deferLater(reactor, .1, _check)
+
+    def test_query_finished(self):
+        """
+        The results of a query are not written, and the request is not
+        finished, once the client has gone away
+        """
+        return self._disconnect_during_query(([], None))
+
+    def test_query_failed(self):
+        """
+        A query that fails after the client has gone away is logged, but not
+        responded to
+        """
+        d = self._disconnect_during_query(ValueError('broken'))
+        d.addCallback(lambda _: self.assertEqual(
+            1, len(self.flushLoggedErrors(ValueError))))
+        return d
+
+    def test_rejected(self):
+        """
+        A query rejected after the client has gone away is not responded to
+        """
+        d = self._disconnect_during_query(admission.Rejected(503, 'busy', 5))
+        d.addCallback(lambda _: self.assertEqual([], self.flushLoggedErrors()))
+        return d
+
+
+class SearchResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.api.SearchResource}, against the SQLite backend
+    """
+
+    def setUp(self):
+        self.patch(ESLogLine, '_client', SQLiteClient(self.mktemp()))
+        ESLogLine.objects.bulk_create([
+            {'time': float(i), 'user': user, 'channel': '#channel1',
+             'event': 'MSG', 'host': 'host', 'message': message}
+            for i, (user, message) in enumerate([
+                ('me', 'hello world'), ('you', 'goodbye world'),
+                ('me', 'hello again')])])
+
+    @defer.inlineCallbacks
+    def _get(self, **args):
+        request = _StreamingRequest(['search'])
+        request.args = dict((key, [value]) for key, value in args.items())
+        yield _render(api.SearchResource(), request)
+        defer.returnValue((request, json.loads(''.join(request.written))))
+
+    @defer.inlineCallbacks
+    def test_search(self):
+        """
+        Messages matching the query and terms are returned, oldest first
+        """
+        request, response = yield self._get(q='hello', fields='message',
+                                            facets='user')
+        self.assertEqual([{'message': 'hello world'},
+                          {'message': 'hello again'}], response['messages'])
+        self.assertEqual({'user': [['me', 2]]}, response['facets'])
+        request, response = yield self._get(q='world', user='you',
+                                            fields='message')
+        self.assertEqual([{'message': 'goodbye world'}], response['messages'])
+
+    @defer.inlineCallbacks
+    def test_nothing_to_search_for(self):
+        """
+        A search needs a query or a term
+        """
+        request, response = yield self._get()
+        self.assertEqual(400, request.responseCode)
+
+    @defer.inlineCallbacks
+    def test_expensive_query_rejected(self):
+        """
+        Queries that would scan the whole index are turned away before they
+        are run
+        """
+        request, response = yield self._get(q='*orld')
+        self.assertEqual(400, request.responseCode)
+        self.assertIn('too expensive', response['error'])
@@ -0,0 +1,91 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.assets}
+"""
+
+import gzip
+from cStringIO import StringIO
+
+from twisted.python import filepath
+from twisted.trial import unittest
+from twisted.web import http
+from twisted.web.test.requesthelper import DummyRequest
+
+from web import assets
+
+
+class MediaResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.assets.MediaResource}
+    """
+
+    def setUp(self):
+        directory = filepath.FilePath(self.mktemp())
+        directory.child('css').makedirs()
+        self.css = 'body { color: black; }\n' * 20
+        directory.child('css').child('site.css').setContent(self.css)
+        directory.child('logo.png').setContent('\x89PNG')
+        self.media = assets.MediaResource(directory.path)
+
+    def _get(self, url, headers=None):
+        request = DummyRequest(url.split('/')[2:])
+        for name, value in (headers or {}).iteritems():
+            request.requestHeaders.setRawHeaders(name, [value])
+        body = self.media.render_GET(request)
+        return request, body
+
+    def _header(self, request, name):
+        return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+    def test_hashed_url_is_immutable(self):
+        """
+        Files requested by their hashed url are cached forever, and those
+        requested by their plain url only for a while
+        """
+        url = self.media.url('/media/css/site.css')
+        self.assertNotEqual('/media/css/site.css', url)
+        request, body = self._get(url)
+        self.assertEqual(self.css, body)
+        self.assertIn('immutable', self._header(request, 'cache-control'))
+        self.assertIn('text/css', self._header(request, 'content-type'))
+
+        request, body = self._get('/media/css/site.css')
+        self.assertEqual(self.css, body)
+        self.assertEqual('public, max-age=3600',
+                         self._header(request, 'cache-control'))
+
+    def test_precompressed(self):
+        """
+        Text files are served gzipped to clients that accept it, images never
+        are
+        """
+        request, body = self._get(self.media.url('/media/css/site.css'),
+                                  {'accept-encoding': 'gzip'})
+        self.assertEqual('gzip', self._header(request, 'content-encoding'))
+        self.assertEqual(self.css, gzip.GzipFile(fileobj=StringIO(body)).read())
+
+        request, body = self._get('/media/logo.png',
+                                  {'accept-encoding': 'gzip'})
+        self.assertEqual('\x89PNG', body)
+        self.assertIdentical(None, self._header(request, 'content-encoding'))
+
+    def test_unknown_files(self):
+        """
+        Unknown files are not found, and their urls are left alone
+        """
+        self.assertEqual('/media/nothing.js',
+                         self.media.url('/media/nothing.js'))
+        request, body = self._get('/media/nothing.js')
+        self.assertEqual(http.NOT_FOUND, request.responseCode)
@@ -11,12 +11,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+
 import mock
 
 from twisted.trial import unittest
-from twisted.python import filepath
+from twisted.internet import error, task
+from twisted.python import failure, filepath
+from twisted.test import proto_helpers
 
 import bot
+import history
+import loggers
+import mentions
+import presence
+import roster
+import watches
 
 
 class LogBotTestCase(unittest.TestCase):
@@ -40,7 +51,14 @@ class LogBotTestCase(unittest.TestCase):
             fp.createDirectory()
         self.log_path = log_path
 
-        fake_factory = mock.MagicMock(channels=channels, log_path=log_path)
+        fake_factory = mock.MagicMock(channels=channels, log_path=log_path,
+                                      presence=presence.Presence(),
+                                      roster=roster.Roster(),
+                                      disconnected_at=None,
+                                      mentions=mentions.MentionIndex(),
+                                      watches=watches.WatchRegistry(),
+                                      web_url='http://slogger',
+                                      network={})
 
         fp = filepath.FilePath(self.mktemp())
         fp.createDirectory()
@@ -65,35 +83,189 @@ class LogBotTestCase(unittest.TestCase):
 
     def _run_connection_made(self):
         """
-        Fake calls connection made, for the tests to see if a logger is created
+        Fake calls connection made, for the tests to see which loggers it
+        logs to
         """
         self.channels = ['#channel1', '#channel2']
         self._make_mock_logbot(self.channels)
         # mock calling LogBot().connectionMade()
         bot.LogBot.connectionMade.im_func(self.fake_logbot)
 
-    def test_connection_made_PyLogger(self):
+    def test_connection_made_logs_to_pipeline(self):
         """
-        When a connection is made, a PyLogger should be created
+        When a connection is made, the bot should log to the factory's logger
+        pipeline, and to its own mention index and watches
         """
         self._run_connection_made()
+        factory = self.fake_logbot.factory
+        self.assertEqual(
+            [factory.pipeline, factory.mentions, factory.watches],
+            self.fake_logbot.loggers)
+
+    def test_reconnect_logs_gap(self):
+        """
+        After a reconnect, the connection and each channel the bot rejoins
+        are logged with when the bot was disconnected
+        """
+        self._make_mock_logbot(['#channel1'])
+        fake = self.fake_logbot
+        fake._gap_message = lambda: bot.LogBot._gap_message.im_func(fake)
+        bot.LogBot.connectionLost.im_func(fake, None)
+        disconnected_at = fake.factory.disconnected_at
+        self.assertNotEqual(None, disconnected_at)
+        # connecting and failing doesn't move the start of the gap
+        bot.LogBot.connectionLost.im_func(fake, None)
+        self.assertEqual(disconnected_at, fake.factory.disconnected_at)
+
+        fake.writeLog.reset_mock()
+        bot.LogBot.connectionMade.im_func(fake)
+        self.assertIdentical(None, fake.factory.disconnected_at)
+        self.assertEqual(disconnected_at, fake.gap[0])
+        bot.LogBot.joined.im_func(fake, '#channel1')
+        (_, _, event, message), _ = fake.writeLog.call_args_list[0]
+        self.assertEqual(bot.CONNECT_EVENT, event)
+        self.assertTrue(message.startswith('disconnected from '))
+        self.assertEqual(mock.call(fake.log_user, '#channel1',
+                                   bot.JOIN_EVENT, message),
+                         fake.writeLog.call_args)
+
+        # channels joined since, and later joins, have no gap to log
+        bot.LogBot.joined.im_func(fake, '#new')
+        self.assertEqual(mock.call(fake.log_user, '#new', bot.JOIN_EVENT,
+                                   None), fake.writeLog.call_args)
+        bot.LogBot.joined.im_func(fake, '#CHANNEL1')
+        self.assertEqual(mock.call(fake.log_user, '#CHANNEL1', bot.JOIN_EVENT,
+                                   None), fake.writeLog.call_args)
+
+    def test_reconnect_backoff(self):
+        """
+        The factory reconnects after a growing delay, which goes back to the
+        start once the bot signs on
+        """
+        factory = bot.LogBotFactory(
+            {'host': 'irc.example.net', 'port': 6667, 'nick': 'slogger',
+             'alt_nick': '_slogger', 'channels': ['#channel1']},
+            mock.MagicMock(['log']))
+        factory.clock = task.Clock()
+        connector = mock.MagicMock()
+        factory.clientConnectionFailed(
+            connector, failure.Failure(error.ConnectionRefusedError()))
+        self.assertFalse(connector.connect.called)
+        first = factory.delay
+        self.assertTrue(first > factory.initialDelay)
+        factory.clock.advance(first)
+        self.assertEqual(1, connector.connect.call_count)
+
+        factory.clientConnectionLost(
+            connector, failure.Failure(error.ConnectionLost()))
+        self.assertTrue(factory.delay > first)
+
+        self._make_mock_logbot(['#channel1'])
+        self.fake_logbot.factory = factory
+        bot.LogBot.signedOn.im_func(self.fake_logbot)
+        self.assertEqual(factory.initialDelay, factory.delay)
+        factory.stopTrying()
+
+    def _build_pipeline(self, networks):
+        self.log_path = self.mktemp()
+        return bot.build_pipeline(self.log_path, networks)
+
+    def test_pipeline_PyLogger(self):
+        """
+        The pipeline should have a PyLogger
+        """
+        self._build_pipeline([{'host': 'irc.example.net',
+                               'channels': ['#channel1']}])
         bot.loggers.PyLogger.assert_called_once_with()
 
-    def test_connection_made_BufferedSearchLogger(self):
+    def test_pipeline_BufferedSearchLogger(self):
         """
-        When a connection is made, a BufferedSearchLogger should be created
+        The pipeline should have a single BufferedSearchLogger, however many
+        networks there are
         """
-        self._run_connection_made()
-        bot.loggers.BufferedSearchLogger.assert_called_once_with()
+        self._build_pipeline([
+            {'host': 'irc.example.net', 'channels': ['#channel1']},
+            {'host': 'irc.example.org', 'channels': ['#channel1']}])
+        bot.loggers.BufferedSearchLogger.assert_called_once_with(5)
 
-    def test_connection_made_BufferedMultiChannelFileLogger(self):
+    def test_pipeline_BufferedMultiChannelFileLogger(self):
         """
-        When a connection is made, a BufferedMultiChannelFileLogger should be
-        created
+        The pipeline should have one BufferedMultiChannelFileLogger, logging
+        the channels of every network straight into the log directory
         """
-        self._run_connection_made()
+        self._build_pipeline([{'host': 'irc.example.net',
+                               'channels': ['#channel1']}])
+        bot.loggers.BufferedMultiChannelFileLogger.assert_called_once_with(
+            self.log_path, ['#channel1'], 5, system_name='system.logs')
+
+        bot.loggers.BufferedMultiChannelFileLogger.reset_mock()
+        self._build_pipeline([
+            {'host': 'irc.example.net', 'channels': ['#channel1']},
+            {'host': 'irc.example.org', 'channels': ['#channel2']}])
         bot.loggers.BufferedMultiChannelFileLogger.assert_called_once_with(
-            self.log_path, self.channels)
+            self.log_path, ['#channel1', '#channel2'], 5,
+            system_name='system.logs')
+
+    def test_pipeline_logs_every_network(self):
+        """
+        Events from every network are logged to the log files, and to all the
+        shared loggers
+        """
+        bot.loggers.BufferedMultiChannelFileLogger.side_effect = (
+            lambda *args, **kwargs: mock.MagicMock(['log']))
+        pipeline = self._build_pipeline([
+            {'host': 'irc.example.net', 'channels': ['#channel1']},
+            {'host': 'irc.example.org', 'channels': ['#channel2']}])
+        shared = mock.MagicMock(['log'])
+        pipeline.add(shared)
+        events = [loggers.LogEvent(1.0, 'me', channel, bot.MSG_EVENT, host,
+                                   'hi')
+                  for host, channel in (('irc.example.net', '#channel1'),
+                                        ('irc.example.org', '#channel2'))]
+        for event in events:
+            pipeline.log(event)
+        self.assertEqual([mock.call(event) for event in events],
+                         pipeline._file_logger.log.mock_calls)
+        self.assertEqual([mock.call(event) for event in events],
+                         shared.log.mock_calls)
+
+    def test_networks(self):
+        """
+        Networks default to the single network in the settings, and take
+        anything they leave out from it
+        """
+        if not hasattr(bot.settings, 'IRC_NETWORKS'):
+            bot.settings.IRC_NETWORKS = None
+            self.addCleanup(delattr, bot.settings, 'IRC_NETWORKS')
+        self.patch(bot.settings, 'IRC_NETWORKS', None)
+        self.assertEqual(1, len(bot.get_networks()))
+        self.assertEqual(bot.settings.IRC_HOST, bot.get_networks()[0]['host'])
+        self.patch(bot.settings, 'IRC_NETWORKS', [
+            {'host': 'irc.example.net'},
+            {'host': 'irc.example.org', 'nick': 'other',
+             'channels': ['#other']}])
+        networks = bot.get_networks()
+        self.assertEqual(['irc.example.net', 'irc.example.org'],
+                         [network['host'] for network in networks])
+        self.assertEqual([bot.settings.NICK, 'other'],
+                         [network['nick'] for network in networks])
+        self.assertEqual('./presence.json', bot.network_path(
+            './presence.json', networks[0], networks[:1]))
+        self.assertEqual('./presence.irc.example.org.json', bot.network_path(
+            './presence.json', networks[1], networks))
+
+    def test_channels_unique_across_networks(self):
+        """
+        The same channel can't be logged on two networks, since channels are
+        told apart by their names alone
+        """
+        if not hasattr(bot.settings, 'IRC_NETWORKS'):
+            bot.settings.IRC_NETWORKS = None
+            self.addCleanup(delattr, bot.settings, 'IRC_NETWORKS')
+        self.patch(bot.settings, 'IRC_NETWORKS', [
+            {'host': 'irc.example.net', 'channels': ['#foo', '#FOO']},
+            {'host': 'irc.example.org', 'channels': ['#Foo']}])
+        self.assertRaises(ValueError, bot.get_networks)
 
     def test_write_log(self):
         """
@@ -159,3 +331,331 @@ class LogBotTestCase(unittest.TestCase):
         keys = results.keys()
         keys.sort()
         self.assertEqual(['#channel1', '#channel2'], keys)
+
+    def test_user_joined_greeting(self):
+        """
+        Users who have left the channel before are told when they last did,
+        and users who haven't aren't greeted with a made up time
+        """
+        self._make_mock_logbot(['#channel1'])
+        self.fake_logbot._user_is_self.return_value = False
+        self.fake_logbot._get_user_last_exit_time.side_effect = (
+            lambda user, channel: bot.LogBot._get_user_last_exit_time.im_func(
+                self.fake_logbot, user, channel))
+        bot.LogBot.userJoined.im_func(self.fake_logbot, 'me', '#channel1')
+        self.assertFalse(self.fake_logbot.msg.called)
+
+        self.fake_logbot._missed_message.side_effect = (
+            lambda *args: bot.LogBot._missed_message.im_func(
+                self.fake_logbot, *args))
+        self.fake_logbot.factory.presence.left('me', '#channel1', 0)
+        bot.LogBot.userJoined.im_func(self.fake_logbot, 'me', '#channel1')
+        self.assertEqual('me', self.fake_logbot.msg.call_args[0][0])
+        message = self.fake_logbot.msg.call_args[0][1]
+        self.assertIn(time.asctime(time.localtime(0)), message)
+        self.assertIn('http://slogger/?channel=%23channel1&from=0&to=',
+                      message)
+
+    def test_user_joined_mentions(self):
+        """
+        Users rejoining a channel are told how many times they were mentioned
+        while they were away
+        """
+        self._make_mock_logbot(['#channel1'])
+        factory = self.fake_logbot.factory
+        factory.mentions.log(loggers.LogEvent(
+            1.0, 'me', '#channel1', bot.JOIN_EVENT, 'host'))
+        factory.presence.left('me', '#channel1', 2.0)
+        for i in xrange(2):
+            factory.mentions.log(loggers.LogEvent(
+                3.0, 'you', '#channel1', bot.MSG_EVENT, 'host', 'me: hi'))
+        message = bot.LogBot._missed_message.im_func(
+            self.fake_logbot, 'me', '#channel1', 2.0, 4.0)
+        self.assertEqual('You were mentioned 2 times in #channel1 since you '
+                         'left at %s: http://slogger/?channel=%%23channel1&'
+                         'from=2&to=4' % (time.asctime(time.localtime(2)),),
+                         message)
+
+    def test_user_quit(self):
+        """
+        A user quitting is logged as them leaving each of the channels they
+        were in
+        """
+        self._make_mock_logbot(['#channel1', '#channel2'])
+        presence = self.fake_logbot.factory.presence
+        presence.joined('me', '#channel1', 1)
+        presence.joined('me', '#channel2', 1)
+        bot.LogBot.userQuit.im_func(self.fake_logbot, 'me', 'bye')
+        self.assertEqual(
+            [mock.call('me', '#channel1', bot.LEAVE_EVENT, 'bye'),
+             mock.call('me', '#channel2', bot.LEAVE_EVENT, 'bye')],
+            self.fake_logbot.writeLog.mock_calls)
+        self.assertEqual([], presence.channels('me'))
+
+    def test_user_kicked(self):
+        """
+        A user being kicked is logged as them leaving
+        """
+        self._make_mock_logbot(['#channel1'])
+        bot.LogBot.userKicked.im_func(self.fake_logbot, 'me', '#channel1',
+                                      'op', 'out')
+        self.fake_logbot.writeLog.assert_called_once_with(
+            'me', '#channel1', bot.LEAVE_EVENT, 'out')
+        self.assertEqual(['#channel1'], bot.LogBot._get_user_last_exit_time(
+            self.fake_logbot, 'me').keys())
+
+    def test_nick_change(self):
+        """
+        A nick change moves the user's presence to their new nick
+        """
+        self._make_mock_logbot(['#channel1'])
+        presence = self.fake_logbot.factory.presence
+        presence.joined('me', '#channel1', 1)
+        bot.LogBot.irc_NICK.im_func(self.fake_logbot, 'me!me@host', ['you'])
+        self.assertEqual([], presence.channels('me'))
+        self.assertEqual(['#channel1'], presence.channels('you'))
+
+    def test_user_quit_roster(self):
+        """
+        A user quitting is logged as them leaving the channels the roster has
+        them in, even if they joined before the bot did
+        """
+        self._make_mock_logbot(['#channel1'])
+        bot.LogBot.irc_RPL_NAMREPLY.im_func(
+            self.fake_logbot, 'server', ['slogger', '=', '#channel1', '@me you'])
+        bot.LogBot.irc_RPL_ENDOFNAMES.im_func(
+            self.fake_logbot, 'server', ['slogger', '#channel1', 'End'])
+        self.assertEqual(['me', 'you'],
+                         self.fake_logbot.factory.roster.members('#channel1'))
+        bot.LogBot.userQuit.im_func(self.fake_logbot, 'me', 'bye')
+        self.assertEqual(
+            [mock.call('me', '#channel1', bot.LEAVE_EVENT, 'bye')],
+            self.fake_logbot.writeLog.mock_calls)
+        self.assertEqual(['you'],
+                         self.fake_logbot.factory.roster.members('#channel1'))
+        self.assertIn('#channel1',
+                      self.fake_logbot.factory.presence.last_left('me'))
+
+    def test_welcome_nick(self):
+        """
+        The bot's nick is the one the server welcomes it by, and follows its
+        nick changes
+        """
+        self._make_mock_logbot([])
+        logbot = bot.LogBot()
+        logbot.factory = self.fake_logbot.factory
+        logbot.heartbeatInterval = None
+        logbot.nickname = 'averyveryverylongnick'
+        logbot.makeConnection(proto_helpers.StringTransport())
+        logbot.lineReceived(':server 001 averyverylong :Welcome')
+        self.assertEqual('averyverylong', logbot.nickname)
+        self.assertTrue(logbot._user_is_self('AveryVeryLong'))
+        self.assertFalse(logbot._user_is_self('averyveryverylongnick'))
+
+        logbot.lineReceived(':averyverylong!bot@host NICK :shorter')
+        self.assertEqual('shorter', logbot.nickname)
+        self.assertTrue(logbot._user_is_self('shorter'))
+
+    def test_parted_channel_forgotten(self):
+        """
+        When the bot leaves or is kicked from a channel, its roster is
+        forgotten
+        """
+        self._make_mock_logbot(['#channel1'])
+        roster = self.fake_logbot.factory.roster
+        for channel in ('#channel1', '#channel2'):
+            roster.joined('you', channel)
+        bot.LogBot.left.im_func(self.fake_logbot, '#channel1')
+        bot.LogBot.kickedFrom.im_func(self.fake_logbot, '#channel2', 'op',
+                                      'bye')
+        self.assertEqual([], roster.channels('you'))
+
+    def test_left_parted_channel(self):
+        """
+        When the bot has left a channel that was parted, the pipeline forgets
+        it, but not a channel that is still logged
+        """
+        self._make_mock_logbot(['#channel1'])
+        factory = self.fake_logbot.factory
+        factory.logs_channel.side_effect = lambda channel: (
+            channel == '#channel1')
+        bot.LogBot.left.im_func(self.fake_logbot, '#channel1')
+        self.assertFalse(factory.pipeline.forget.called)
+        bot.LogBot.left.im_func(self.fake_logbot, '#parted')
+        factory.pipeline.forget.assert_called_once_with('#parted')
+
+    def test_search_results(self):
+        """
+        Search results are replied where the search was asked for, or in
+        private if there are several, and only counted if there are many
+        """
+        self._make_mock_logbot(['#channel1'])
+        results = [loggers.LogEvent(float(i), 'you', '#channel1',
+                                    bot.MSG_EVENT, 'host', 'found %d' % (i,))
+                   for i in range(10)]
+        search_results = bot.LogBot._search_results.im_func
+        self.assertEqual(
+            [('#channel1', '1 results returned'),
+             ('#channel1', '[0.0] <you> found 0')],
+            search_results(self.fake_logbot, results[:1], '#channel1', 'me'))
+        self.assertEqual(
+            [('#channel1', '2 results returned'),
+             ('me', '[0.0] <you> found 0'), ('me', '[1.0] <you> found 1')],
+            search_results(self.fake_logbot, results[:2], '#channel1', 'me'))
+        self.assertEqual(
+            [('#channel1', '10 results returned, narrow your search')],
+            search_results(self.fake_logbot, results, '#channel1', 'me'))
+        self.assertFalse(self.fake_logbot.msg.called)
+
+    def test_last(self):
+        """
+        The last command sends the user the last messages in the channel from
+        the recent history
+        """
+        self._make_mock_logbot(['#channel1'])
+        self.fake_logbot.nickname = 'slogger'
+        self.fake_logbot.max_last = 50
+        recent = history.History()
+        for i, event in enumerate([bot.MSG_EVENT, bot.JOIN_EVENT,
+                                   bot.MSG_EVENT, bot.MSG_EVENT]):
+            recent.log(loggers.LogEvent(float(i), 'you', '#channel1', event,
+                                        'host', 'message %d' % (i,)))
+        self.patch(history, 'history', recent)
+
+        reply = bot.LogBot.do_last.im_func(self.fake_logbot, '2', 'slogger',
+                                           'me')
+        self.assertIdentical(None, reply)
+        self.assertEqual(['message 2', 'message 3'],
+                         [args[1].split('> ')[1] for args, kwargs
+                          in self.fake_logbot.msg.call_args_list])
+        self.assertEqual(['me', 'me'], [args[0] for args, kwargs
+                                        in self.fake_logbot.msg.call_args_list])
+
+        reply = bot.LogBot.do_last.im_func(self.fake_logbot, '#quiet',
+                                           '#channel1', 'me')
+        self.assertEqual('Nothing has been said in #quiet lately', reply)
+
+    def test_last_without_channels(self):
+        """
+        Asked in private with every channel parted, the last command asks for
+        a channel
+        """
+        self._make_mock_logbot([])
+        self.fake_logbot.nickname = 'slogger'
+        self.fake_logbot.max_last = 50
+        reply = bot.LogBot.do_last.im_func(self.fake_logbot, '', 'slogger',
+                                           'me')
+        self.assertEqual("I'm not logging any channels - say which channel",
+                         reply)
+        self.assertFalse(self.fake_logbot.msg.called)
+
+    def test_watch_commands(self):
+        """
+        Users can manage their watches with the watch, unwatch and watches
+        commands
+        """
+        self._make_mock_logbot(['#channel1'])
+        self.assertEqual("I'll let you know when anyone says deploy",
+                         bot.LogBot.do_watch.im_func(self.fake_logbot,
+                                                     ' deploy', 'me'))
+        self.assertEqual('watch for what?',
+                         bot.LogBot.do_watch.im_func(self.fake_logbot, None,
+                                                     'me'))
+        self.assertEqual('You are watching for: deploy',
+                         bot.LogBot.do_watches.im_func(self.fake_logbot, 'me'))
+        self.assertEqual("I've stopped watching for deploy",
+                         bot.LogBot.do_unwatch.im_func(self.fake_logbot,
+                                                       'deploy', 'me'))
+        self.assertEqual("You weren't watching for deploy",
+                         bot.LogBot.do_unwatch.im_func(self.fake_logbot,
+                                                       'deploy', 'me'))
+        self.assertEqual("You aren't watching for anything",
+                         bot.LogBot.do_watches.im_func(self.fake_logbot, 'me'))
+
+    def test_watchers_must_be_in_channel(self):
+        """
+        Watchers are only notified about channels the factory knows they are
+        in
+        """
+        factory = bot.LogBotFactory(
+            {'host': 'irc.example.net', 'port': 6667, 'nick': 'slogger',
+             'alt_nick': '_slogger', 'channels': ['#channel1']},
+            mock.MagicMock(['log']))
+        factory.roster.joined('me', '#channel1')
+        factory.presence.joined('you', '#CHANNEL2', 1.0)
+        self.assertTrue(factory.watches.in_channel('ME', '#channel1'))
+        self.assertTrue(factory.watches.in_channel('you', '#channel2'))
+        self.assertFalse(factory.watches.in_channel('me', '#channel2'))
+
+
+class ChannelManagerTestCase(unittest.TestCase):
+    """
+    Tests for joining and parting channels at runtime, with
+    L{bot.ChannelManager} and L{bot.LogBotFactory}
+    """
+
+    def setUp(self):
+        self.factories = [
+            bot.LogBotFactory(
+                {'host': host, 'port': 6667, 'nick': 'slogger',
+                 'alt_nick': '_slogger', 'channels': [channel]},
+                mock.MagicMock(['log', 'forget']))
+            for host, channel in (('irc.example.net', '#channel1'),
+                                  ('irc.other.net', '#channel2'))]
+        self.client = mock.MagicMock(bot.LogBot)
+        self.factories[0].client = self.client
+        self.manager = bot.ChannelManager(self.factories)
+
+    def test_valid_channel(self):
+        """
+        Only channel names the bot could join are valid
+        """
+        bot.valid_channel('#ok')
+        bot.valid_channel('&local')
+        for name in (None, '', 'nohash', '#a b', '#a,#b', '#' + 'x' * 50):
+            self.assertRaises(ValueError, bot.valid_channel, name)
+
+    def test_join(self):
+        """
+        Joining a channel joins it now if the bot is connected, and after it
+        reconnects
+        """
+        self.assertTrue(self.manager.join('#new', 'irc.example.net'))
+        self.client.join.assert_called_once_with('#new')
+        self.assertFalse(self.manager.join('#NEW', 'irc.example.net'))
+        self.assertTrue(self.manager.join('#other', 'irc.other.net'))
+        self.assertEqual(self.manager.channels(), {
+            'irc.example.net': ['#channel1', '#new'],
+            'irc.other.net': ['#channel2', '#other']})
+        self.assertRaises(ValueError, self.manager.join, 'new',
+                          'irc.example.net')
+        # with more than one network, which one has to be given
+        self.assertRaises(ValueError, self.manager.join, '#new')
+
+    def test_join_logged_elsewhere(self):
+        """
+        A channel logged on one network can't be joined on another
+        """
+        self.assertRaises(ValueError, self.manager.join, '#CHANNEL1',
+                          'irc.other.net')
+        self.assertEqual(['#channel2'], self.factories[1].channels)
+
+    def test_part(self):
+        """
+        Parting a channel leaves it, and it isn't joined again
+        """
+        self.assertTrue(self.manager.part('#CHANNEL1', 'irc.example.net'))
+        self.client.leave.assert_called_once_with('#channel1')
+        self.assertFalse(self.manager.part('#channel1', 'irc.example.net'))
+        self.assertEqual([], self.factories[0].channels)
+        self.assertFalse(self.manager.part('#channel1', 'irc.other.net'))
+        self.assertEqual(['#channel2'], self.factories[1].channels)
+
+    def test_part_disconnected(self):
+        """
+        Parting a channel while disconnected forgets it straight away, as the
+        bot won't be told it has left
+        """
+        self.assertTrue(self.manager.part('#channel2', 'irc.other.net'))
+        self.factories[1].pipeline.forget.assert_called_once_with('#channel2')
+        self.assertFalse(self.factories[0].pipeline.forget.called)
@@ -0,0 +1,156 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{directory}
+"""
+
+import json
+
+from twisted.trial import unittest
+
+from elasticsearch import ESLogLine
+from elasticsearch.core.sqlitestore import SQLiteClient
+from events import JOIN_EVENT, MSG_EVENT
+import directory
+import loggers
+
+
+class DirectoryTestCase(unittest.TestCase):
+    """
+    Tests for L{directory.Directory}
+    """
+
+    def setUp(self):
+        self.directory = directory.Directory(['#channel1'])
+
+    def _log(self, event_time, user, channel, event=MSG_EVENT):
+        self.directory.log(loggers.LogEvent(event_time, user, channel, event,
+                                            'host', 'hi'))
+
+    def test_channels(self):
+        """
+        Configured channels and channels messages are logged in are known,
+        whatever the case of their names
+        """
+        self._log(1.0, 'me', '#Channel2')
+        self._log(2.0, 'me', '#channel2')
+        self._log(3.0, 'me', None)
+        self.assertEqual(['#channel1', '#Channel2'],
+                         self.directory.channels())
+        self.assertEqual(2.0, self.directory.channel_last_seen('#CHANNEL2'))
+        self.assertIdentical(
+            None, self.directory.channel_last_seen('#channel1'))
+
+    def test_active_users(self):
+        """
+        Users who talk are listed, most recently seen first, until they have
+        not been seen for a while
+        """
+        now = 100 * 86400.0
+        self._log(now - 31 * 86400, 'old', '#channel1')
+        self._log(now - 20, 'me', '#channel1')
+        self._log(now - 10, 'you', '#channel1')
+        self._log(now - 5, 'lurker', '#channel1', JOIN_EVENT)
+        self.assertEqual([('you', now - 10), ('me', now - 20)],
+                         self.directory.users('#channel1', now))
+        self.assertEqual([], self.directory.users('#nothing', now))
+
+    def test_seed(self):
+        """
+        The directory can be seeded with a single query to the index
+        """
+        self.patch(ESLogLine, '_client', SQLiteClient(self.mktemp()))
+        now = 100 * 86400.0
+        ESLogLine.objects.bulk_create([
+            {'time': now - 30, 'user': 'me', 'channel': '#channel1',
+             'event': 'MSG', 'host': 'host', 'message': 'one'},
+            {'time': now - 20, 'user': 'me', 'channel': '#channel1',
+             'event': 'MSG', 'host': 'host', 'message': 'two'},
+            {'time': now - 10, 'user': 'you', 'channel': '#channel2',
+             'event': 'MSG', 'host': 'host', 'message': 'three'}])
+        query = self.directory.seed_query(now=now)
+        response = ESLogLine._client.search(
+            ESLogLine._get_index(), ESLogLine._get_doctype(),
+            json.dumps(query), size=1)
+        self.directory.seed(response)
+
+        self.assertEqual(['#channel1', '#channel2'],
+                         self.directory.channels())
+        self.assertEqual([('me', now - 20)],
+                         self.directory.users('#channel1', now))
+        self.assertEqual(now - 10,
+                         self.directory.channel_last_seen('#channel2'))
+
+    def test_seed_analysed_terms(self):
+        """
+        Terms elasticsearch made by analysing channel names only count for
+        the known channels they match - they are never made into channels of
+        their own
+        """
+        directory_ = directory.Directory(['##test_slogger_room'])
+        directory_.seed({'facets': {'channels': {'terms': [
+            {'term': 'test_slogger_room', 'max': 5.0},
+            {'term': 'slogger', 'max': 6.0},
+            {'term': 'system_log', 'max': 7.0},
+            {'term': 'foo', 'max': 8.0},
+            {'term': '##exact', 'max': 9.0}]}}})
+        self.assertEqual(['##exact', '##test_slogger_room'],
+                         directory_.channels())
+        self.assertEqual(5.0,
+                         directory_.channel_last_seen('##test_slogger_room'))
+
+
+class ConfiguredChannelsTestCase(unittest.TestCase):
+    """
+    Tests for L{directory.configured_channels} and
+    L{directory.default_channel}
+    """
+
+    def setUp(self):
+        if not hasattr(directory.settings, 'IRC_NETWORKS'):
+            directory.settings.IRC_NETWORKS = None
+            self.addCleanup(delattr, directory.settings, 'IRC_NETWORKS')
+        self.patch(directory.settings, 'IRC_CHANNELS', ['#a', '#b'])
+        self.patch(directory.settings, 'IRC_NETWORKS', None)
+        self.patch(directory, 'directory', directory.Directory(['#known']))
+
+    def test_single_network(self):
+        """
+        With a single network, its channels are IRC_CHANNELS
+        """
+        self.assertEqual(['#a', '#b'], directory.configured_channels())
+        self.assertEqual('#a', directory.default_channel())
+
+    def test_networks(self):
+        """
+        Every network's channels are configured, and networks without
+        channels log IRC_CHANNELS
+        """
+        self.patch(directory.settings, 'IRC_NETWORKS', [
+            {'host': 'one', 'channels': ['#x']}, {'host': 'two'}])
+        self.assertEqual(['#x', '#a', '#b'], directory.configured_channels())
+
+    def test_default_without_irc_channels(self):
+        """
+        Without IRC_CHANNELS, the default channel is the first configured,
+        then the first known, and otherwise there isn't one
+        """
+        self.patch(directory.settings, 'IRC_CHANNELS', [])
+        self.patch(directory.settings, 'IRC_NETWORKS', [
+            {'host': 'one', 'channels': ['#x']}])
+        self.assertEqual('#x', directory.default_channel())
+        self.patch(directory.settings, 'IRC_NETWORKS', None)
+        self.assertEqual('#known', directory.default_channel())
+        self.patch(directory, 'directory', directory.Directory())
+        self.assertIdentical(None, directory.default_channel())
@@ -0,0 +1,149 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{history}
+"""
+
+from twisted.trial import unittest
+
+from events import JOIN_EVENT, MSG_EVENT
+import history
+import loggers
+
+
+def _event(event_time, channel='#channel1', event=MSG_EVENT, user='me'):
+    return loggers.LogEvent(event_time, user, channel, event, 'host',
+                            str(event_time))
+
+
+class RingBufferTestCase(unittest.TestCase):
+    """
+    Tests for L{history.RingBuffer}
+    """
+
+    def setUp(self):
+        self.buffer = history.RingBuffer(4, since=0.0)
+
+    def _times(self, events):
+        return [event.time for event in events]
+
+    def test_keeps_most_recent(self):
+        """
+        Once the buffer is full, the oldest events are pushed out, and the
+        buffer only covers time ranges from the last one pushed out
+        """
+        for i in xrange(1, 7):
+            self.buffer.append(_event(float(i)))
+        self.assertEqual(4, len(self.buffer))
+        self.assertEqual([3.0, 4.0, 5.0, 6.0],
+                         self._times(self.buffer.between()))
+        self.assertEqual(2.0, self.buffer.since)
+        self.assertFalse(self.buffer.covers(2.0))
+        self.assertTrue(self.buffer.covers(2.5))
+
+    def test_between(self):
+        """
+        Time ranges are inclusive at both ends, across the wrap around
+        """
+        for i in xrange(1, 7):
+            self.buffer.append(_event(float(i)))
+        self.assertEqual([4.0, 5.0], self._times(self.buffer.between(4, 5)))
+        self.assertEqual([4.0, 5.0, 6.0],
+                         self._times(self.buffer.between(3.5)))
+        self.assertEqual([3.0], self._times(self.buffer.between(end=3)))
+        self.assertEqual([], self._times(self.buffer.between(7, 8)))
+        self.assertEqual([], self._times(self.buffer.between(5, 4)))
+
+    def test_same_time(self):
+        """
+        Events at the same time are all in the range
+        """
+        for event_time in (1.0, 2.0, 2.0, 3.0):
+            self.buffer.append(_event(event_time))
+        self.assertEqual([2.0, 2.0], self._times(self.buffer.between(2, 2)))
+
+    def test_clock_backwards(self):
+        """
+        An event older than the last is kept after it
+        """
+        self.buffer.append(_event(2.0))
+        self.buffer.append(_event(1.0))
+        self.assertEqual([2.0, 1.0], self._times(self.buffer.between(2)))
+
+    def test_last(self):
+        """
+        The last events can be read, of all kinds or only some
+        """
+        for i in xrange(1, 7):
+            self.buffer.append(_event(
+                float(i), event=JOIN_EVENT if i % 2 else MSG_EVENT))
+        self.assertEqual([5.0, 6.0], self._times(self.buffer.last(2)))
+        self.assertEqual([4.0, 6.0],
+                         self._times(self.buffer.last(5, (MSG_EVENT,))))
+        self.assertEqual([], self.buffer.last(0))
+
+
+class HistoryTestCase(unittest.TestCase):
+    """
+    Tests for L{history.History}
+    """
+
+    def setUp(self):
+        self.history = history.History(capacity=10)
+        self.history._started = 0.0
+
+    def test_channels(self):
+        """
+        Each channel has its own buffer, whatever the case of its name, and
+        events without a channel are not kept
+        """
+        self.history.log(_event(1.0, '#channel1'))
+        self.history.log(_event(2.0, '#Channel2'))
+        self.history.log(_event(3.0, None))
+        self.assertEqual([1.0], [e.time for e in
+                                 self.history.between('#CHANNEL1')])
+        self.assertEqual([2.0], [e.time for e in
+                                 self.history.between('#channel2')])
+
+    def test_unseen_channels(self):
+        """
+        The history doesn't cover channels nothing has been logged in since it
+        started - they may not be logged by this bot at all - so they are
+        read from the index or the log files instead
+        """
+        self.assertFalse(self.history.covers('#unseen', 1.0))
+        self.assertIdentical(None, self.history.queryset('#unseen', 1.0))
+        self.assertEqual([], self.history.last('#unseen', 5))
+        self.assertEqual([], self.history.between('#unseen'))
+        self.history.log(_event(2.0, '#seen'))
+        self.assertTrue(self.history.covers('#seen', 1.0))
+
+    def test_queryset(self):
+        """
+        Querysets over the history can be sliced, filtered and faceted like
+        elasticsearch querysets
+        """
+        for i in xrange(1, 6):
+            self.history.log(_event(float(i), user='me' if i < 4 else 'you'))
+        queryset = self.history.queryset('#channel1', 2.0, 5.0)
+        self.assertEqual([2.0, 3.0, 4.0, 5.0],
+                         [e.time for e in queryset.order_by('time')])
+        queryset = self.history.queryset('#channel1', 2.0).facet('user')
+        self.assertEqual({'user': [('me', 2), ('you', 2)]}, queryset.facets)
+        self.assertEqual([3.0], [e.time for e in queryset[1:2]])
+        self.assertEqual(
+            [4.0, 5.0],
+            [e.time for e in self.history.queryset(
+                '#channel1', 1.0).filter(user='you')])
+        self.assertIdentical(None, self.history.queryset('#channel1', None))
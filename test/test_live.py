@@ -0,0 +1,124 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.live}
+"""
+
+import json
+
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from web import live
+import directory
+import loggers
+import pubsub
+
+
+class _StreamingRequest(DummyRequest):
+    """
+    L{DummyRequest} only handles pull producers
+    """
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class LiveResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.live.LiveResource}
+    """
+
+    def setUp(self):
+        self.hub = pubsub.Hub()
+        self.clock = task.Clock()
+        self.request = _StreamingRequest(['live'])
+        self.request.args = {'channel': ['#channel1']}
+        self.assertEqual(NOT_DONE_YET, live.LiveResource(
+            self.hub, self.clock).render_GET(self.request))
+
+    def _log(self, message):
+        self.hub.log(loggers.LogEvent(1.0, 'me', '#channel1', 'MSG', 'host',
+                                      message))
+
+    def test_streams_events(self):
+        """
+        Events logged to the channel are written as they happen
+        """
+        self.assertEqual(['text/event-stream'],
+                         self.request.responseHeaders.getRawHeaders(
+                             'content-type'))
+        self._log('hello')
+        data = self.request.written[-1]
+        self.assertTrue(data.startswith('data: '))
+        self.assertEqual('hello', json.loads(data[6:])['message'])
+
+    def test_slow_client(self):
+        """
+        While the client is not reading, events are queued, and the client is
+        told about any that were dropped
+        """
+        self.request.producer.pauseProducing()
+        for i in xrange(105):
+            self._log(str(i))
+        written = len(self.request.written)
+        self.request.producer.resumeProducing()
+        self.assertEqual('event: dropped\ndata: 5\n\n',
+                         self.request.written[written])
+        self.assertEqual(written + 101, len(self.request.written))
+
+    def test_keepalive_and_disconnect(self):
+        """
+        Idle streams get keepalive comments, until the client disconnects,
+        which unsubscribes it
+        """
+        self.clock.advance(live.LiveResource.keepalive)
+        self.assertEqual(':\n\n', self.request.written[-1])
+        self.request.processingFailed(Exception('gone'))
+        self.assertEqual(0, self.hub.subscribers('#channel1'))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+class DefaultChannelTestCase(unittest.TestCase):
+    """
+    Tests for the channel L{web.live.LiveResource} streams when the request
+    doesn't give one
+    """
+
+    def setUp(self):
+        self.hub = pubsub.Hub()
+        self.request = _StreamingRequest(['live'])
+        self.resource = live.LiveResource(self.hub, task.Clock())
+
+    def test_default_channel(self):
+        """
+        The default channel is streamed
+        """
+        self.patch(directory, 'default_channel', lambda: '#default')
+        self.assertEqual(NOT_DONE_YET, self.resource.render_GET(self.request))
+        self.assertEqual(1, self.hub.subscribers('#default'))
+        self.request.processingFailed(Exception('gone'))
+
+    def test_no_channel(self):
+        """
+        Without a channel to stream, the request is a bad one
+        """
+        self.patch(directory, 'default_channel', lambda: None)
+        self.assertEqual('channel is required',
+                         self.resource.render_GET(self.request))
+        self.assertEqual(400, self.request.responseCode)
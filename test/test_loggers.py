@@ -15,12 +15,132 @@
 Tests for L{loggers}
 """
 
+import json
+import os
+import time
+from datetime import date
+
 import mock
 
 from twisted.trial import unittest
-from twisted.internet import reactor, task
+from twisted.internet import defer, reactor, task
+from twisted.python import filepath
 
 import loggers
+import logreader
+
+
+class LogEventTestCase(unittest.TestCase):
+    """
+    Tests for L{loggers.LogEvent}
+    """
+
+    def test_immutable(self):
+        """
+        Events can't be changed once they are made, as they're shared between
+        loggers
+        """
+        event = loggers.LogEvent(5.5, 'user', '#channel1', 'MSG', 'host', 'hi')
+        self.assertRaises(AttributeError, setattr, event, 'message', 'bye')
+        self.assertRaises(AttributeError, setattr, event, 'other', 'bye')
+
+    def test_formats_cached(self):
+        """
+        The text and JSON forms are only formatted once
+        """
+        event = loggers.LogEvent(5.5, 'user', '#channel1', 'MSG', 'host', 'hi')
+        self.assertIdentical(event.text, event.text)
+        self.assertIdentical(event.json, event.json)
+        self.assertEqual(event.document, json.loads(event.json))
+
+    def test_time_string_shared_within_a_second(self):
+        """
+        Events in the same second share their formatted time
+        """
+        first = loggers.LogEvent(5.1, 'user', '#channel1', 'MSG', 'host', 'a')
+        second = loggers.LogEvent(5.9, 'user', '#channel1', 'MSG', 'host', 'b')
+        self.assertIdentical(first.time_string, second.time_string)
+        self.assertEqual(time.asctime(time.localtime(5.9)),
+                         second.time_string)
+
+
+class DailyFileLoggerTestCase(unittest.TestCase):
+    """
+    Tests for L{loggers.DailyFileLogger}
+    """
+
+    def setUp(self):
+        self.directory = filepath.FilePath(self.mktemp())
+        self.directory.createDirectory()
+        self.logger = loggers.DailyFileLogger('#channel1', self.directory.path)
+        self.addCleanup(self.logger.close)
+        self.midnight = time.mktime(date.today().timetuple())
+
+    def _log(self, minute, message):
+        self.logger.log(loggers.LogEvent(self.midnight + minute * 60 + 1,
+                                         'user', '#channel1', 'MSG', 'host',
+                                         message))
+
+    def _offsets(self):
+        offsets = []
+        for offset, record in logreader.read_log_file(self.logger.path):
+            offsets.append(offset)
+        return offsets
+
+    def test_index_records_first_message_of_each_minute(self):
+        """
+        The sidecar index should have one record for each minute in which
+        something was logged, pointing at the first message of that minute
+        """
+        for minute, message in ((0, 'a'), (5, 'b'), (5, 'c'), (7, 'd')):
+            self._log(minute, message)
+        offsets = self._offsets()
+        self.assertEqual(
+            [(0, offsets[0]), (5, offsets[1]), (7, offsets[3])],
+            logreader.read_index(self.logger.path + logreader.INDEX_SUFFIX))
+
+    def test_index_range(self):
+        """
+        L{logreader.index_range} should give the byte range of the messages
+        logged in a range of minutes
+        """
+        for minute, message in ((0, 'a'), (5, 'b'), (5, 'c'), (7, 'd')):
+            self._log(minute, message)
+        offsets = self._offsets()
+        self.assertEqual(
+            (offsets[1], offsets[3]),
+            logreader.index_range(self.logger.path, self.logger.lastDate,
+                                  self.midnight + 4 * 60,
+                                  self.midnight + 6 * 60))
+
+    def test_index_survives_reopening(self):
+        """
+        After reopening a log file, minutes already in the index should not
+        be recorded again
+        """
+        self._log(5, 'a')
+        self.logger.reopen()
+        self._log(5, 'b')
+        self._log(6, 'c')
+        self.assertEqual(
+            [5, 6],
+            [minute for minute, offset in logreader.read_index(
+                self.logger.path + logreader.INDEX_SUFFIX)])
+
+    def test_index_rotated_with_log(self):
+        """
+        When the log file is rotated, its index should be rotated with it
+        """
+        self._log(5, 'a')
+        today = self.logger.lastDate
+        self.logger.lastDate = (1970, 1, 1)
+        self._log(6, 'b')
+        rotated = '%s.1970_1_1' % (self.logger.path,)
+        self.assertTrue(os.path.exists(rotated + logreader.INDEX_SUFFIX))
+        self.assertEqual(
+            [(6, 0)],
+            logreader.read_index(self.logger.path + logreader.INDEX_SUFFIX))
+        self.assertEqual(today, self.logger.lastDate)
 
 
 class MultiChannelFileLoggerTestCase(unittest.TestCase):
@@ -42,14 +162,84 @@ class MultiChannelFileLoggerTestCase(unittest.TestCase):
         loggers.MultiChannelFileLogger('./', [])
         self.assertEqual(1, loggers.logfile.LogFile.call_count)
 
+    def test_system_log_name(self):
+        """
+        The system log file can be given another name, so that processes
+        sharing a directory don't share it
+        """
+        loggers.MultiChannelFileLogger('./', [],
+                                       system_name='system.worker-1.logs')
+        self.assertEqual('system.worker-1.logs',
+                         loggers.logfile.LogFile.call_args[0][0])
+
     def test_one_logger_created_per_channel(self):
         """
-        One L{loggers.DailyFileLogger}logger should be created for each channel
+        One L{loggers.DailyFileLogger} logger should be created for each
+        channel, when it is first logged to
         """
-        loggers.MultiChannelFileLogger('./', ['channel1', 'channel2'])
+        filelogger = loggers.MultiChannelFileLogger(
+            './', ['channel1', 'channel2'])
+        self.assertFalse(loggers.DailyFileLogger.called)
+        for channel in ('channel1', 'channel2', 'CHANNEL1'):
+            filelogger.log(loggers.LogEvent(
+                5.5, 'user', channel, 'MSG', 'host', 'message'))
         expected_calls = [mock.call('channel1', './', None),
                           mock.call('channel2', './', None)]
-        self.assertEqual(expected_calls, loggers.DailyFileLogger.mock_calls)
+        self.assertEqual(expected_calls,
+                         loggers.DailyFileLogger.call_args_list)
+
+    def test_log_to_new_channel(self):
+        """
+        Channels that weren't configured are logged to their own files too
+        """
+        filelogger = loggers.MultiChannelFileLogger('./', ['#channel1'])
+        filelogger.log(loggers.LogEvent(
+            5.5, 'user', '#Joined', 'MSG', 'host', 'message'))
+        filelogger.log(loggers.LogEvent(
+            5.6, 'user', '#joined', 'MSG', 'host', 'message'))
+        loggers.DailyFileLogger.assert_called_once_with('#Joined', './', None)
+        self.assertEqual(
+            2, filelogger._channel_loggers['#Joined'].log.call_count)
+        self.assertFalse(filelogger._system_logger.write.called)
+
+    def test_forget(self):
+        """
+        A forgotten channel's file is closed and its name dropped, so that
+        channels that have been parted aren't kept track of forever
+        """
+        filelogger = loggers.MultiChannelFileLogger('./', ['#channel1'])
+        filelogger.log(loggers.LogEvent(
+            5.5, 'user', '#Joined', 'MSG', 'host', 'message'))
+        channel_logger = filelogger._channel_loggers['#Joined']
+        filelogger.forget('#JOINED')
+        filelogger.forget('#never')
+        channel_logger.close.assert_called_once_with()
+        self.assertEqual({'#channel1': '#channel1'}, filelogger._names)
+        self.assertEqual([], list(filelogger._channel_loggers))
+
+    def test_open_files_capped(self):
+        """
+        Only the most recently used channel files are kept open
+        """
+        loggers.DailyFileLogger.side_effect = lambda *args: mock.MagicMock(
+            loggers.DailyFileLogger)
+        filelogger = loggers.MultiChannelFileLogger('./', [], max_open=2)
+
+        def _log(channel):
+            filelogger.log(loggers.LogEvent(
+                5.5, 'user', channel, 'MSG', 'host', 'message'))
+            return filelogger._channel_loggers[channel]
+
+        first = _log('#a')
+        second = _log('#b')
+        _log('#a')
+        _log('#c')
+        self.assertEqual(['#a', '#c'], list(filelogger._channel_loggers))
+        second.close.assert_called_once_with()
+        self.assertFalse(first.close.called)
+        _log('#b')
+        self.assertEqual(['#c', '#b'], list(filelogger._channel_loggers))
+        self.assertEqual(4, loggers.DailyFileLogger.call_count)
 
     def test_log_to_channel(self):
         """
@@ -58,7 +248,8 @@ class MultiChannelFileLoggerTestCase(unittest.TestCase):
         """
         filelogger = loggers.MultiChannelFileLogger(
             './', ['channel1', 'channel2'])
-        filelogger.log(5.5, 'message', 'user', 'channel1')
+        filelogger.log(loggers.LogEvent(
+            5.5, 'user', 'channel1', 'MSG', 'host', 'message'))
         self.assertEqual(
             1, filelogger._channel_loggers['channel1'].log.call_count)
         self.assertFalse(filelogger._system_logger.write.called)
@@ -68,9 +259,10 @@ class MultiChannelFileLoggerTestCase(unittest.TestCase):
         When logging a system message, it should be logged to the system logger
         """
         filelogger = loggers.MultiChannelFileLogger('./', ['channel1'])
-        filelogger.log(5.5, 'message', 'SYSTEM', 'SYSTEM_LOG')
+        filelogger.log(loggers.LogEvent(
+            5.5, 'SYSTEM', 'SYSTEM_LOG', 'MSG', 'host', 'message'))
         self.assertEqual(1, filelogger._system_logger.write.call_count)
-        self.assertFalse(filelogger._channel_loggers['channel1'].log.called)
+        self.assertFalse(loggers.DailyFileLogger.called)
 
     def test_log_unrecognized_channel(self):
         """
@@ -78,9 +270,10 @@ class MultiChannelFileLoggerTestCase(unittest.TestCase):
         to the system logger
         """
         filelogger = loggers.MultiChannelFileLogger('./', ['channel1'])
-        filelogger.log(5.5, 'message', 'user', 'channel2')
+        filelogger.log(loggers.LogEvent(
+            5.5, 'user', 'channel2', 'MSG', 'host', 'message'))
         self.assertEqual(1, filelogger._system_logger.write.call_count)
-        self.assertFalse(filelogger._channel_loggers['channel1'].log.called)
+        self.assertFalse(loggers.DailyFileLogger.called)
 
 
 class BufferedMultiChannelFileLoggerTestCase(unittest.TestCase):
@@ -95,20 +288,23 @@ class BufferedMultiChannelFileLoggerTestCase(unittest.TestCase):
                    mock.MagicMock(loggers.logfile.LogFile))
 
     def tearDown(self):
-        self.logger.loop.stop()
+        if self.logger.loop.running:
+            self.logger.loop.stop()
 
     def _init_file_logger(self, interval):
         self.logger = loggers.BufferedMultiChannelFileLogger(
             './', ['channel1'], interval)
-        self.logger.log(5.5, 'message', 'user', 'channel1')
-        self.logger.log(5.6, 'message', 'SYSTEM', 'SYSTEM_LOG')
+        self.logger.log(loggers.LogEvent(
+            5.5, 'user', 'channel1', 'MSG', 'host', 'message'))
+        self.logger.log(loggers.LogEvent(
+            5.6, 'SYSTEM', 'SYSTEM_LOG', 'MSG', 'host', 'message'))
 
     def test_logs_not_written_immediately(self):
         """
         Logs should not written to immediately
         """
         self._init_file_logger(50)
-        self.assertFalse(self.logger._channel_loggers['channel1'].log.called)
+        self.assertFalse(loggers.DailyFileLogger.return_value.log.called)
         self.assertFalse(self.logger._system_logger.write.called)
 
     def test_logs_written_after_interval(self):
@@ -124,6 +320,73 @@ class BufferedMultiChannelFileLoggerTestCase(unittest.TestCase):
 
         return task.deferLater(reactor, .2, _check_if_called)
 
+    def test_stop_flushes(self):
+        """
+        Stopping the logger writes what is left in the buffer, and stops it
+        writing every interval
+        """
+        self._init_file_logger(50)
+
+        def _check_if_called(ignored):
+            self.assertFalse(self.logger.loop.running)
+            self.assertEqual(
+                1, self.logger._channel_loggers['channel1'].log.call_count)
+            self.assertEqual(1, self.logger._system_logger.write.call_count)
+
+        return self.logger.stop().addCallback(_check_if_called)
+
+    def test_forget_after_flush(self):
+        """
+        A channel is only forgotten once what was buffered for it has been
+        written
+        """
+        self._init_file_logger(50)
+
+        def _check_forgotten(ignored):
+            self.assertEqual(
+                1, loggers.DailyFileLogger.return_value.log.call_count)
+            self.assertNotIn('channel1', self.logger._names)
+            self.assertEqual({}, dict(self.logger._channel_loggers))
+
+        return self.logger.forget('channel1').addCallback(_check_forgotten)
+
+    def test_one_flush_at_a_time(self):
+        """
+        Flushes and forgets wait for the one in progress to finish, as they
+        change the same files in threads
+        """
+        self._init_file_logger(50)
+        self.logger._lock.acquire()
+        flushed = self.logger.flush()
+        forgotten = self.logger.forget('channel1')
+        self.assertFalse(loggers.DailyFileLogger.called)
+        self.assertIn('channel1', self.logger._names)
+        self.logger._lock.release()
+
+        def _check(ignored):
+            self.assertEqual(
+                1, loggers.DailyFileLogger.return_value.log.call_count)
+            self.assertNotIn('channel1', self.logger._names)
+
+        return defer.gatherResults([flushed, forgotten]).addCallback(_check)
+
+    def test_failed_logs_kept_in_order(self):
+        """
+        Logs that could not be written are written before anything logged
+        since, the next time the buffer is flushed
+        """
+        self._init_file_logger(50)
+        failed = self.logger._buffer[0]
+        loggers.DailyFileLogger.return_value.log.side_effect = IOError
+
+        def _check_buffer(ignored):
+            self.logger.log(loggers.LogEvent(
+                5.7, 'user', 'channel1', 'MSG', 'host', 'later'))
+            self.assertEqual([failed.time, 5.7],
+                             [event.time for event in self.logger._buffer])
+
+        return self.logger.flush().addCallback(_check_buffer)
+
 
 class BufferedSearchLoggerTestCase(unittest.TestCase):
     """
@@ -135,20 +398,85 @@ class BufferedSearchLoggerTestCase(unittest.TestCase):
                    mock.MagicMock(loggers.ESLogLine.objects))
 
     def tearDown(self):
-        self.logger.loop.stop()
+        if self.logger.loop.running:
+            self.logger.loop.stop()
 
     def _init_search_logger(self, interval):
         self.logger = loggers.BufferedSearchLogger(interval)
-        self.logger.log(5.5, 'message', 'user', 'channel1')
+        self.logger.log(
+            loggers.LogEvent(5.5, 'user', 'channel1', 'MSG', 'host', 'msg'))
+        self.logger.log(
+            loggers.LogEvent(5.6, 'user', 'channel1', 'MSG', 'host', 'msg'))
 
     def test_logs_not_written_immediately(self):
         self._init_search_logger(50)
-        self.assertFalse(loggers.ESLogLine.objects.create.called)
+        self.assertFalse(loggers.ESLogLine.objects.bulk_create.called)
 
     def test_logs_written_after_interval(self):
+        """
+        Buffered logs should be written in a single bulk request
+        """
         self._init_search_logger(.1)
 
         def _check_if_called():
-            self.assertEqual(1, loggers.ESLogLine.objects.create.call_count)
+            self.assertEqual(
+                1, loggers.ESLogLine.objects.bulk_create.call_count)
+            self.assertEqual(
+                2, len(loggers.ESLogLine.objects.bulk_create.call_args[0][0]))
 
         return task.deferLater(reactor, .2, _check_if_called)
+
+    def _events(self, count):
+        for i in xrange(count):
+            self.logger.log(loggers.LogEvent(
+                float(i), 'user', 'channel1', 'MSG', 'host', str(i)))
+
+    def test_bulk_size(self):
+        """
+        The buffer is written in bulk requests of a bounded size
+        """
+        self.logger = loggers.BufferedSearchLogger(50, bulk_size=2)
+        self._events(5)
+
+        def _check(ignored):
+            calls = loggers.ESLogLine.objects.bulk_create.call_args_list
+            self.assertEqual([2, 2, 1],
+                             [len(args[0]) for args, kwargs in calls])
+            self.assertEqual([], self.logger._buffer)
+
+        return self.logger.flush().addCallback(_check)
+
+    def test_failed_chunks_kept(self):
+        """
+        When a bulk request fails, it and the rest of the buffer are written
+        again next time, before anything logged since
+        """
+        self.logger = loggers.BufferedSearchLogger(50, bulk_size=2)
+        self._events(5)
+        loggers.ESLogLine.objects.bulk_create.side_effect = [
+            None, IOError('down')]
+
+        def _check(ignored):
+            self.assertEqual(
+                2, loggers.ESLogLine.objects.bulk_create.call_count)
+            self.assertEqual([2.0, 3.0, 4.0],
+                             [event.time for event in self.logger._buffer])
+
+        return self.logger.flush().addCallback(_check)
+
+    def test_oldest_dropped(self):
+        """
+        While messages can't be written, only so many are held, and the
+        oldest are dropped
+        """
+        self.logger = loggers.BufferedSearchLogger(50, max_buffered=3)
+        loggers.ESLogLine.objects.bulk_create.side_effect = IOError('down')
+        self._events(5)
+
+        def _check(ignored):
+            self.assertEqual([2.0, 3.0, 4.0],
+                             [event.time for event in self.logger._buffer])
+            self.assertEqual(
+                3, len(loggers.ESLogLine.objects.bulk_create.call_args[0][0]))
+
+        return self.logger.flush().addCallback(_check)
@@ -0,0 +1,158 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{logreader}
+"""
+
+import time
+from datetime import date, timedelta
+
+from twisted.trial import unittest
+from twisted.python import filepath
+
+import loggers
+import logreader
+
+
+class ParseLineTestCase(unittest.TestCase):
+    """
+    Tests for L{logreader.parse_line}
+    """
+
+    def _roundtrip(self, *args):
+        mixin = loggers.BaseLogger_Mixin()
+        line = '%s\n' % (mixin.stringify(*args),)
+        self.assertEqual(mixin.dictify(*args), logreader.parse_line(line))
+
+    def test_parses_stringified_message(self):
+        """
+        A line written by stringify should parse back into what dictify would
+        have produced for the same message
+        """
+        self._roundtrip(1339000000.0, 'me', '#channel1', 'MSG',
+                        'irc.example.com', 'hello (there) @ everyone')
+
+    def test_parses_none_values(self):
+        """
+        Messages and channels that were C{None} should be parsed as C{None}
+        """
+        self._roundtrip(1339000000.0, 'me', None, 'CONNECTION ESTABLISHED',
+                        'irc.example.com', None)
+
+    def test_unknown_channel_line_is_parsed(self):
+        """
+        Lines in the system log from unknown channels are indented by a tab
+        """
+        record = logreader.parse_line(
+            '\t[#other] Wed Jun  6 16:26:40 2012 :  <me> MSG (hi) @ host\n')
+        self.assertEqual('#other', record['channel'])
+        self.assertEqual('hi', record['message'])
+
+    def test_garbage_is_not_parsed(self):
+        """
+        Lines that aren't log lines should return C{None}
+        """
+        self.assertIdentical(None, logreader.parse_line(
+            '-- Received message from unknown channel:\n'))
+        self.assertIdentical(None, logreader.parse_line('\n'))
+
+
+class ReadLogFileTestCase(unittest.TestCase):
+    """
+    Tests for L{logreader.read_log_file}
+    """
+
+    def test_offsets_and_records(self):
+        """
+        Every log line should be yielded along with its byte offset
+        """
+        lines = [
+            '-- Received message from unknown channel:\n',
+            '\t[#a] Wed Jun  6 16:26:40 2012 :  <me> MSG (one) @ host\n',
+            '[#a] Wed Jun  6 16:26:41 2012 :  <me> MSG (two) @ host\n']
+        path = self.mktemp()
+        with open(path, 'wb') as f:
+            f.write(''.join(lines))
+
+        results = list(logreader.read_log_file(path))
+        self.assertEqual([len(lines[0]), len(lines[0]) + len(lines[1])],
+                         [offset for offset, record in results])
+        self.assertEqual(['one', 'two'],
+                         [record['message'] for offset, record in results])
+
+
+class FlatFileQuerysetTestCase(unittest.TestCase):
+    """
+    Tests for L{logreader.FlatFileQueryset}
+    """
+
+    def setUp(self):
+        self.directory = filepath.FilePath(self.mktemp())
+        self.directory.createDirectory()
+        self.midnight = time.mktime(date.today().timetuple())
+
+        # yesterday's rotated log, without an index
+        yesterday = date.today() - timedelta(days=1)
+        mixin = loggers.BaseLogger_Mixin()
+        lines = ['%s\n' % mixin.stringify(self.midnight - 60, user,
+                                          '#channel1', 'MSG', 'host', 'old')
+                 for user in ('me', 'you')]
+        rotated = '#channel1.%d_%d_%d' % yesterday.timetuple()[:3]
+        self.directory.child(rotated).setContent(''.join(lines))
+
+        logger = loggers.DailyFileLogger('#channel1', self.directory.path)
+        for minute, user in ((1, 'me'), (2, 'you'), (2, 'me'), (3, 'me')):
+            logger.log(loggers.LogEvent(self.midnight + minute * 60, user,
+                                        '#channel1', 'MSG', 'host',
+                                        str(minute)))
+        logger.close()
+
+    def _queryset(self, start_time=None, end_time=None):
+        return logreader.FlatFileQueryset(
+            self.directory.path, '#channel1', start_time, end_time)
+
+    def test_time_range(self):
+        """
+        Only messages in the time range should be returned
+        """
+        queryset = self._queryset(self.midnight + 120, self.midnight + 120)
+        self.assertEqual(['2', '2'], [msg.message for msg in queryset])
+        self.assertEqual(2, queryset.count())
+
+    def test_spans_rotated_files(self):
+        """
+        A time range covering several days should read each day's file
+        """
+        queryset = self._queryset(self.midnight - 3600)
+        self.assertEqual(['old', 'old', '1', '2', '2', '3'],
+                         [msg.message for msg in queryset])
+
+    def test_facets_and_filter(self):
+        """
+        Facets should count all the matching messages, not just one page
+        """
+        queryset = self._queryset(self.midnight).facet('user').limit(1)
+        self.assertEqual({'user': [('me', 3), ('you', 1)]}, queryset.facets)
+        self.assertEqual(1, len(list(queryset)))
+        self.assertEqual(
+            ['2'], [msg.message for msg in queryset.filter(user='you')])
+
+    def test_missing_channel(self):
+        """
+        A channel without logs has no messages
+        """
+        queryset = logreader.FlatFileQueryset(
+            self.directory.path, '#nothing').facet('user')
+        self.assertEqual([], list(queryset))
+        self.assertEqual({'user': []}, queryset.facets)
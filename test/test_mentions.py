@@ -0,0 +1,85 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{mentions}
+"""
+
+from twisted.trial import unittest
+
+from events import JOIN_EVENT, LEAVE_EVENT, MSG_EVENT
+import loggers
+import mentions
+
+
+class MentionIndexTestCase(unittest.TestCase):
+    """
+    Tests for L{mentions.MentionIndex}
+    """
+
+    def setUp(self):
+        self.index = mentions.MentionIndex(max_mentions=3, retention_days=1)
+        self._log(0.0, 'Me', '#channel1', JOIN_EVENT)
+        self._log(0.0, 'you', '#channel1', JOIN_EVENT)
+
+    def _log(self, event_time, user, channel, event=MSG_EVENT, message=None):
+        self.index.log(loggers.LogEvent(event_time, user, channel, event,
+                                        'host', message))
+
+    def test_mentions(self):
+        """
+        Messages naming a nick seen in the channel are mentions of it,
+        whatever the case and punctuation around it
+        """
+        self._log(1.0, 'you', '#channel1', message='me: hello')
+        self._log(2.0, 'you', '#channel1', message='hi ME!')
+        self._log(3.0, 'you', '#channel1', message='meet me, and me')
+        self._log(4.0, 'you', '#channel1', message='meeting')
+        self.assertEqual(3, self.index.count('me', '#channel1', 0))
+        self.assertEqual(1, self.index.count('ME', '#Channel1', 2.0))
+        self.assertEqual(0, self.index.count('me', '#channel2', 0))
+
+    def test_not_mentions(self):
+        """
+        Users don't mention themselves, nicks not seen in the channel aren't
+        mentioned, and only messages mention anyone
+        """
+        self._log(1.0, 'me', '#channel1', message='me me me')
+        self._log(1.0, 'you', '#channel1', message='stranger')
+        self._log(1.0, 'you', '#channel1', LEAVE_EVENT, 'me')
+        self._log(1.0, 'you', '#channel2', message='me')
+        self.assertEqual(0, self.index.count('me', '#channel1', 0))
+        self.assertEqual(0, self.index.count('stranger', '#channel1', 0))
+        self.assertEqual(0, self.index.count('me', '#channel2', 0))
+
+    def test_bounded(self):
+        """
+        Only the last few mentions are kept
+        """
+        for i in xrange(10):
+            self._log(float(i + 1), 'you', '#channel1', message='me')
+        self.assertEqual(3, self.index.count('me', '#channel1', 0))
+        self.assertTrue(
+            len(self.index._mentions['me', '#channel1']) <= 6)
+        self.assertEqual(2, self.index.count('me', '#channel1', 8.0))
+
+    def test_retention(self):
+        """
+        Mentions older than the retention period are forgotten
+        """
+        self._log(1.0, 'you', '#channel1', message='me')
+        self.assertEqual(1, self.index.count('me', '#channel1', 0))
+        self.assertEqual(0, self.index.count('me', '#channel1', 0,
+                                             now=86402.0))
+        self.index.sweep(86402.0)
+        self.assertEqual({}, self.index._mentions)
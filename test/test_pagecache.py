@@ -0,0 +1,151 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{web.pagecache}
+"""
+
+import gzip
+import time
+from datetime import date
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from web import pagecache
+
+
+class DayRangeTestCase(unittest.TestCase):
+    """
+    Tests for L{web.pagecache.day_range} and L{web.pagecache.day_from_range}
+    """
+
+    def test_roundtrip(self):
+        """
+        The canonical range of a day maps back to that day
+        """
+        day = date(2012, 6, 6)
+        start, end = pagecache.day_range(day)
+        self.assertEqual(time.mktime(day.timetuple()), start)
+        self.assertEqual(day, pagecache.day_from_range(str(start), str(end)))
+
+    def test_other_ranges(self):
+        """
+        Ranges that are not exactly a day, or not numbers, have no day
+        """
+        start, end = pagecache.day_range(date(2012, 6, 6))
+        self.assertIdentical(None, pagecache.day_from_range(start, end - 60))
+        self.assertIdentical(None, pagecache.day_from_range(start, None))
+        self.assertIdentical(None, pagecache.day_from_range('a', end))
+
+
+class PageCacheTestCase(unittest.TestCase):
+    """
+    Tests for L{web.pagecache.PageCache}
+    """
+
+    def setUp(self):
+        self.cache = pagecache.PageCache(self.mktemp())
+        self.day = date(2012, 6, 6)
+
+    def test_store_and_get(self):
+        """
+        Stored pages are gzipped, and can be found again
+        """
+        self.assertIdentical(None, self.cache.get('#channel1', self.day))
+        self.cache.store('#channel1', self.day, '<html/>')
+        path = self.cache.get('#channel1', self.day)
+        self.assertTrue(path.endswith('.html.gz'))
+        self.assertEqual('<html/>', gzip.open(path).read())
+        self.assertIdentical(None, self.cache.get('#channel2', self.day))
+
+    def test_invalidate(self):
+        """
+        Invalidated pages are gone, and invalidating a missing page is fine
+        """
+        self.cache.store('#channel1', self.day, '<html/>')
+        self.cache.invalidate('#channel1', self.day)
+        self.assertIdentical(None, self.cache.get('#channel1', self.day))
+        self.cache.invalidate('#channel1', self.day)
+
+
+class DayPageRendererTestCase(unittest.TestCase):
+    """
+    Tests for L{web.pagecache.DayPageRenderer}
+    """
+
+    def setUp(self):
+        self.cache = pagecache.PageCache(self.mktemp())
+        self.clock = task.Clock()
+        self.clock.advance(time.mktime(date(2012, 6, 6).timetuple()) + 3600)
+        self.rendered = []
+        self.channels = ['#channel1', '#channel2']
+        self.renderer = pagecache.DayPageRenderer(
+            self.cache, self._render, lambda: self.channels, self.clock)
+        self.addCleanup(self.renderer.stopService)
+
+    def _render(self, channel, day):
+        self.rendered.append((channel, day))
+        return defer.succeed('%s %s' % (channel, day))
+
+    def _stored(self, channel, day):
+        path = self.cache.get(channel, day)
+        return path and gzip.open(path).read()
+
+    @defer.inlineCallbacks
+    def test_renders_yesterday_on_start(self):
+        """
+        Yesterday's pages are rendered when the service starts, unless they
+        already have been
+        """
+        yesterday = date(2012, 6, 5)
+        self.cache.store('#channel2', yesterday, 'already')
+        self.renderer.startService()
+        yield self.renderer._rendering
+        self.assertEqual([('#channel1', yesterday)], self.rendered)
+        self.assertEqual('#channel1 2012-06-05',
+                         self._stored('#channel1', yesterday))
+        self.assertEqual('already', self._stored('#channel2', yesterday))
+
+    @defer.inlineCallbacks
+    def test_scheduled_after_midnight(self):
+        """
+        The next run is scheduled for shortly after the coming midnight
+        """
+        self.renderer.startService()
+        yield self.renderer._rendering
+        call = self.clock.getDelayedCalls()[0]
+        self.assertEqual(
+            time.mktime(date(2012, 6, 7).timetuple()) +
+            self.renderer.delay, call.getTime())
+        self.rendered = []
+        self.clock.advance(call.getTime() - self.clock.seconds())
+        yield self.renderer._rendering
+        today = date(2012, 6, 6)
+        self.assertEqual([('#channel1', today), ('#channel2', today)],
+                         self.rendered)
+
+    @defer.inlineCallbacks
+    def test_channels_read_each_run(self):
+        """
+        Each run renders the channels known at the time, so channels joined
+        since the last run get pages too
+        """
+        self.renderer.startService()
+        yield self.renderer._rendering
+        self.channels = ['#channel1', '#channel2', '#joined']
+        self.rendered = []
+        call = self.clock.getDelayedCalls()[0]
+        self.clock.advance(call.getTime() - self.clock.seconds())
+        yield self.renderer._rendering
+        self.assertIn(('#joined', date(2012, 6, 6)), self.rendered)
@@ -0,0 +1,354 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{plugins}
+"""
+import threading
+
+import mock
+
+from twisted.internet import defer, task, threads
+from twisted.trial import unittest
+
+import bot
+import plugins
+import presence
+import roster
+
+
+class RegistryTestCase(unittest.TestCase):
+    """
+    Tests for L{plugins.Registry}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = plugins.Registry(self.clock)
+        self.pending = []
+        self.registry.add('slow', self._slow, 'slow - takes a while',
+                          concurrency=1, max_waiting=1, timeout=10)
+
+    def _slow(self, bot, user, channel, args):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def _command(self, name, args=None):
+        replies = []
+        self.registry.run(name, None, 'me', '#channel', args).addCallback(
+            replies.append)
+        return replies
+
+    def test_dispatch(self):
+        """
+        Commands are looked up case insensitively, and replied to with what
+        they return
+        """
+        @self.registry.command('echo', 'echo <text>')
+        def echo(bot, user, channel, args):
+            return '%s said %s' % (user, args)
+
+        self.assertEqual(self._command('ECHO', 'hi'), ['me said hi'])
+        self.assertEqual(self.registry.names(), ['echo', 'slow'])
+        self.assertEqual(self._command('nope'), [plugins.UNKNOWN_COMMAND])
+
+    def test_deferred(self):
+        """
+        Commands can reply later, and how long they took is recorded
+        """
+        replies = self._command('slow')
+        self.assertEqual(replies, [])
+        self.clock.advance(2)
+        self.pending[0].callback('done')
+        self.assertEqual(replies, ['done'])
+        stats = self.registry.stats()['slow']
+        self.assertEqual((stats.calls, stats.mean, stats.slowest),
+                         (1, 2.0, 2.0))
+
+    def test_concurrency(self):
+        """
+        Calls over a command's concurrency wait for their turn, and calls
+        over how many can wait are turned away
+        """
+        first = self._command('slow')
+        second = self._command('slow')
+        third = self._command('slow')
+        self.assertEqual(len(self.pending), 1)
+        self.assertEqual(len(third), 1)
+        self.assertIn('Too many people', third[0])
+        self.assertEqual(self.registry.stats()['slow'].rejected, 1)
+        self.pending[0].callback('one')
+        self.assertEqual(first, ['one'])
+        self.assertEqual(len(self.pending), 2)
+        self.pending[1].callback('two')
+        self.assertEqual(second, ['two'])
+
+    def test_timeout(self):
+        """
+        Calls that take too long are replied to, but keep their slot until
+        they actually finish, as their work can't be stopped
+        """
+        replies = self._command('slow')
+        self.clock.advance(10)
+        self.assertEqual(replies, ['slow took too long, sorry'])
+        self.assertEqual(self.registry.stats()['slow'].timeouts, 1)
+        self.assertFalse(self.pending[0].called)
+        second = self._command('slow')
+        self.assertEqual(len(self.pending), 1)
+        self.pending[0].callback('late')
+        self.assertEqual(replies, ['slow took too long, sorry'])
+        self.assertEqual(len(self.pending), 2)
+        self.pending[1].callback('two')
+        self.assertEqual(second, ['two'])
+
+    def test_failure_after_timeout(self):
+        """
+        Calls that fail after timing out are logged, and free up their slot
+        """
+        replies = self._command('slow')
+        self.clock.advance(10)
+        self.pending[0].errback(ValueError('late'))
+        self.assertEqual(replies, ['slow took too long, sorry'])
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self._command('slow')
+        self.assertEqual(len(self.pending), 2)
+
+    def test_thread_keeps_slot(self):
+        """
+        A command running in a thread keeps its slot after timing out, until
+        the thread returns
+        """
+        finish = threading.Event()
+        running = []
+
+        def _work():
+            finish.wait(5)
+            return 'done'
+
+        def _threaded(bot, user, channel, args):
+            running.append(threads.deferToThread(_work))
+            return running[0]
+
+        self.registry.add('threaded', _threaded, 'threaded', concurrency=1,
+                          timeout=10)
+        semaphore = self.registry.get('threaded').semaphore
+        replies = self._command('threaded')
+        self.clock.advance(10)
+        self.assertEqual(replies, ['threaded took too long, sorry'])
+        self.assertEqual(semaphore.tokens, 0)
+        finish.set()
+        return running[0].addCallback(
+            lambda _: self.assertEqual(semaphore.tokens, 1))
+
+    def test_errors(self):
+        """
+        Failures are logged, counted and replied to
+        """
+        @self.registry.command('broken', 'broken')
+        def broken(bot, user, channel, args):
+            raise ValueError('oops')
+
+        self.assertEqual(self._command('broken'),
+                         ['Something went wrong, please try again later'])
+        self.assertEqual(self.registry.stats()['broken'].errors, 1)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+
+class CommandsTestCase(unittest.TestCase):
+    """
+    Tests for the bot's commands in L{plugins.registry}
+    """
+
+    def setUp(self):
+        self.bot = mock.MagicMock(bot.LogBot, factory=mock.MagicMock(
+            presence=presence.Presence(), roster=roster.Roster()))
+
+    def _command(self, name, args=None):
+        replies = []
+        plugins.registry.run(name, self.bot, 'me', '#channel', args
+                             ).addCallback(replies.append)
+        return replies[0]
+
+    def test_help(self):
+        """
+        Help lists the commands, or describes one
+        """
+        self.assertIn('search, seen, stats', self._command('help'))
+        self.assertEqual(self._command('help', 'search'),
+                         'search <lucene query> - searches for messages')
+
+    def test_ignore(self):
+        """
+        Ignore ignores the user if no one else is given
+        """
+        self._command('ignore')
+        self.bot.do_ignore.assert_called_once_with('me')
+        self._command('unignore', 'you')
+        self.bot.do_unignore.assert_called_once_with('you')
+
+    def test_seen(self):
+        """
+        Seen says which channels a user is in, or when they last left one
+        """
+        self.bot.factory.presence.joined('you', '#a', 1.0)
+        self.bot.factory.presence.joined('them', '#a', 1.0)
+        self.bot.factory.presence.left('them', '#a', 5.0)
+        self.assertEqual(self._command('seen', 'you'), 'you is in #a')
+        self.assertTrue(self._command('seen', 'them').startswith(
+            'them was last seen leaving #a at'))
+        self.assertEqual(self._command('seen', 'nobody'),
+                         "I haven't seen nobody")
+
+    def test_seen_roster(self):
+        """
+        Seen knows about users who were in a channel before the bot joined it
+        """
+        self.bot.factory.roster.names('#a', ['@you'])
+        self.bot.factory.roster.end_of_names('#a')
+        self.assertEqual(self._command('seen', 'YOU'), 'YOU is in #a')
+
+    def test_who(self):
+        """
+        Who lists the users in the channel asked about, or asked in
+        """
+        self.bot.factory.roster.names('#channel', ['@b', '+a', 'c'])
+        self.bot.factory.roster.end_of_names('#channel')
+        self.assertEqual(self._command('who'), '3 in #channel: a, b, c')
+        self.assertEqual(self._command('who', '#other'),
+                         "I don't know who is in #other")
+        self.bot.factory.roster.names(
+            '#big', ['n%02d' % (i,) for i in range(plugins.MAX_WHO + 2)])
+        self.bot.factory.roster.end_of_names('#big')
+        self.assertTrue(self._command('who', '#big').endswith(' and 2 more'))
+
+    def test_stats(self):
+        """
+        Stats describes how the commands have been used
+        """
+        self._command('help')
+        self.assertIn('help: ', self._command('stats'))
+
+
+class HandleCommandTestCase(unittest.TestCase):
+    """
+    Tests for L{bot.LogBot.handle_command}
+    """
+
+    def setUp(self):
+        self.bot = mock.MagicMock(bot.LogBot, nickname='slogger')
+        self.bot._reply = lambda reply, reply_to: bot.LogBot._reply.im_func(
+            self.bot, reply, reply_to)
+
+    def test_mentioned(self):
+        """
+        Commands addressed to the bot in a channel are replied to there
+        """
+        bot.LogBot.handle_command.im_func(self.bot, 'me', '#channel',
+                                          'slogger: help search')
+        self.bot.msg.assert_called_once_with(
+            '#channel', 'search <lucene query> - searches for messages')
+
+    def test_private(self):
+        """
+        Commands sent privately are replied to privately
+        """
+        bot.LogBot.handle_command.im_func(self.bot, 'me', 'slogger', 'bogus')
+        self.bot.msg.assert_called_once_with('me', plugins.UNKNOWN_COMMAND)
+
+    def test_replies_to_others(self):
+        """
+        Commands can reply with messages for other recipients too
+        """
+        @plugins.registry.command('multi', 'multi')
+        def multi(bot, user, channel, args):
+            return [('#channel', 'one'), (user, 'two')]
+        self.addCleanup(plugins.registry._commands.pop, 'multi')
+
+        bot.LogBot.handle_command.im_func(self.bot, 'me', '#channel',
+                                          'slogger: multi')
+        self.assertEqual(
+            [mock.call('#channel', 'one'), mock.call('me', 'two')],
+            self.bot.msg.call_args_list)
+
+    def test_not_a_command(self):
+        """
+        Messages not addressed to the bot, or empty ones, are not commands
+        """
+        bot.LogBot.handle_command.im_func(self.bot, 'me', '#channel', 'help')
+        bot.LogBot.handle_command.im_func(self.bot, 'me', '#channel',
+                                          'slogger:  ')
+        self.assertFalse(self.bot.msg.called)
+
+
+class ChannelCommandsTestCase(unittest.TestCase):
+    """
+    Tests for the join and part commands
+    """
+
+    def setUp(self):
+        self.bot = mock.MagicMock(bot.LogBot, nickname='slogger',
+                                  factory=mock.MagicMock(irc_host='irc'))
+        self.bot.is_admin = lambda user: bot.LogBot.is_admin.im_func(
+            self.bot, user)
+        self.manager = self.bot.factory.channel_manager
+        admins = getattr(bot.settings, 'IRC_ADMINS', None)
+        bot.settings.IRC_ADMINS = ['Boss']
+        self.addCleanup(self._restore, admins)
+
+    def _restore(self, admins):
+        if admins is None:
+            del bot.settings.IRC_ADMINS
+        else:
+            bot.settings.IRC_ADMINS = admins
+
+    def _command(self, name, args=None, user='boss', channel='#channel'):
+        replies = []
+        plugins.registry.run(name, self.bot, user, channel, args
+                             ).addCallback(replies.append)
+        return replies[0]
+
+    def test_admins_only(self):
+        """
+        Only admins can join and part channels
+        """
+        self.assertEqual(self._command('join', '#new', user='me'),
+                         'Only admins can join channels')
+        self.assertFalse(self.manager.join.called)
+
+    def test_join(self):
+        """
+        Join joins the channel given on the bot's network
+        """
+        self.manager.join.return_value = True
+        self.assertEqual(self._command('join', ' #new '), 'Joining #new')
+        self.manager.join.assert_called_once_with('#new', 'irc')
+        self.manager.join.return_value = False
+        self.assertEqual(self._command('join', '#new'),
+                         "I'm already logging #new")
+        self.manager.join.side_effect = ValueError('new is not a channel name')
+        self.assertEqual(self._command('join', 'new'),
+                         'new is not a channel name')
+        self.assertTrue(self._command('join').startswith('join <channel>'))
+
+    def test_part(self):
+        """
+        Part leaves the channel given, or the one it was asked in
+        """
+        self.manager.part.return_value = True
+        self.assertEqual(self._command('part'), 'Leaving #channel')
+        self.manager.part.assert_called_once_with('#channel', 'irc')
+        self.manager.part.return_value = False
+        self.assertEqual(self._command('part', '#old'), "I'm not logging #old")
+        self.assertTrue(self._command('part', channel='slogger').startswith(
+            'part <optional: channel>'))
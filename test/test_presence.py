@@ -0,0 +1,189 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{presence}
+"""
+
+import json
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from elasticsearch import ESLogLine
+from elasticsearch.core.sqlitestore import SQLiteClient
+import presence
+
+
+class PresenceTestCase(unittest.TestCase):
+    """
+    Tests for L{presence.Presence}
+    """
+
+    def setUp(self):
+        self.presence = presence.Presence()
+
+    def test_join_and_leave(self):
+        """
+        The last join and leave times are kept for each user and channel,
+        whatever the case of their names
+        """
+        self.presence.joined('me', '#channel1', 1.0)
+        self.presence.left('Me', '#Channel1', 2.0)
+        self.presence.joined('me', '#channel1', 3.0)
+        self.presence.left('me', '#channel2', 4.0)
+        self.assertEqual({'#channel1': 3.0},
+                         self.presence.last_joined('ME'))
+        self.assertEqual({'#channel1': 2.0, '#channel2': 4.0},
+                         self.presence.last_left('me'))
+        self.assertEqual({'#channel2': 4.0},
+                         self.presence.last_left('me', '#channel2'))
+        self.assertEqual({}, self.presence.last_left('me', '#channel3'))
+        self.assertEqual({}, self.presence.last_left('you'))
+
+    def test_older_times_ignored(self):
+        """
+        Times older than those already known don't replace them
+        """
+        self.presence.left('me', '#channel1', 2.0)
+        self.presence.left('me', '#channel1', 1.0)
+        self.assertEqual({'#channel1': 2.0}, self.presence.last_left('me'))
+
+    def test_quit(self):
+        """
+        Quitting leaves every channel the user is in
+        """
+        self.presence.joined('me', '#channel1', 1.0)
+        self.presence.joined('me', '#channel2', 1.0)
+        self.presence.left('me', '#channel2', 2.0)
+        self.presence.joined('me', '#channel3', 1.0)
+        self.assertEqual(['#channel1', '#channel3'],
+                         self.presence.quit('me', 5.0))
+        self.assertEqual({'#channel1': 5.0, '#channel2': 2.0,
+                          '#channel3': 5.0}, self.presence.last_left('me'))
+        self.assertEqual([], self.presence.channels('me'))
+
+    def test_renamed(self):
+        """
+        Renaming moves the user from their old nick to their new one
+        """
+        self.presence.joined('me', '#channel1', 1.0)
+        self.assertEqual(['#channel1'],
+                         self.presence.renamed('me', 'you', 2.0))
+        self.assertEqual({'#channel1': 2.0}, self.presence.last_left('me'))
+        self.assertEqual(['#channel1'], self.presence.channels('you'))
+
+    def test_dump_and_restore(self):
+        """
+        A presence can be restored from what it dumps
+        """
+        self.presence.joined('me', '#channel1', 1.0)
+        self.presence.left('me', '#channel1', 2.0)
+        self.presence.left('you', '#channel2', 3.0)
+        restored = presence.Presence()
+        restored.restore(json.loads(json.dumps(self.presence.dump())))
+        self.assertEqual(self.presence.last_left('me'),
+                         restored.last_left('me'))
+        self.assertEqual(self.presence.last_joined('me'),
+                         restored.last_joined('me'))
+        self.assertEqual(self.presence.last_left('you'),
+                         restored.last_left('you'))
+
+    def test_seed(self):
+        """
+        The presence can be seeded with a single query to the index
+        """
+        self.patch(ESLogLine, '_client', SQLiteClient(self.mktemp()))
+        ESLogLine.objects.bulk_create([
+            {'time': 1.0, 'user': 'me', 'channel': '#channel1',
+             'event': 'JOIN', 'host': 'host', 'message': None},
+            {'time': 2.0, 'user': 'me', 'channel': '#channel1',
+             'event': 'LEAVE', 'host': 'host', 'message': None},
+            {'time': 3.0, 'user': 'me', 'channel': '#channel1',
+             'event': 'JOIN', 'host': 'host', 'message': None},
+            {'time': 4.0, 'user': 'me', 'channel': '#channel2',
+             'event': 'LEAVE', 'host': 'host', 'message': None}])
+        channels = ['#channel1', '#channel2']
+        response = ESLogLine._client.search(
+            ESLogLine._get_index(), ESLogLine._get_doctype(),
+            json.dumps(self.presence.seed_query(channels)), size=1)
+        self.presence.seed(response, channels)
+        self.assertEqual({'#channel1': 3.0}, self.presence.last_joined('me'))
+        self.assertEqual({'#channel1': 2.0, '#channel2': 4.0},
+                         self.presence.last_left('me'))
+
+
+class PresenceServiceTestCase(unittest.TestCase):
+    """
+    Tests for L{presence.PresenceService}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.path = self.mktemp()
+        self.presence = presence.Presence()
+        self.service = presence.PresenceService(
+            self.presence, self.path, ['#channel1'], 60, self.clock)
+        self.service.load = lambda: defer.succeed(None)
+
+    def test_checkpoints(self):
+        """
+        The presence is checkpointed periodically and when the service stops,
+        and restored when it starts
+        """
+        self.service.startService()
+        self.presence.left('me', '#channel1', 1.0)
+        self.clock.advance(60)
+        with open(self.path) as f:
+            self.assertEqual([['me', '#channel1', None, 1.0]], json.load(f))
+
+        self.presence.left('me', '#channel1', 2.0)
+        self.service.stopService()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+        restored = presence.Presence()
+        service = presence.PresenceService(restored, self.path, [],
+                                           clock=self.clock)
+        service.load = lambda: defer.succeed(None)
+        service.startService()
+        self.assertEqual({'#channel1': 2.0}, restored.last_left('me'))
+        service.stopService()
+
+    def test_shared_checkpoint(self):
+        """
+        Services sharing a checkpoint add what they know to it, keeping the
+        latest times
+        """
+        other = presence.Presence()
+        service = presence.PresenceService(other, self.path, ['#channel2'],
+                                           clock=self.clock)
+        self.presence.joined('me', '#channel1', 1.0)
+        self.presence.left('me', '#channel2', 1.0)
+        other.left('me', '#channel2', 2.0)
+        self.service.checkpoint()
+        service.checkpoint()
+
+        restored = presence.Presence()
+        presence.PresenceService(restored, self.path, []).restore()
+        self.assertEqual({'#channel1': 1.0}, restored.last_joined('me'))
+        self.assertEqual({'#channel2': 2.0}, restored.last_left('me'))
+
+    def test_bad_checkpoint(self):
+        """
+        An unreadable checkpoint is logged and ignored
+        """
+        with open(self.path, 'w') as f:
+            f.write('not json')
+        self.service.restore()
+        self.assertEqual(1, len(self.flushLoggedErrors(ValueError)))
+        self.assertEqual([], self.presence.dump())
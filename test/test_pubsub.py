@@ -0,0 +1,75 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{pubsub}
+"""
+
+from twisted.trial import unittest
+
+import loggers
+import pubsub
+
+
+def _event(channel, message):
+    return loggers.LogEvent(1.0, 'me', channel, 'MSG', 'host', message)
+
+
+class HubTestCase(unittest.TestCase):
+    """
+    Tests for L{pubsub.Hub} and L{pubsub.Subscription}
+    """
+
+    def setUp(self):
+        self.hub = pubsub.Hub()
+        self.received = []
+
+    def test_channel_subscribers(self):
+        """
+        Events are only delivered to the subscribers of their channel,
+        whatever the case of the channel name
+        """
+        self.hub.subscribe('#Channel1', self.received.append)
+        self.hub.log(_event('#channel1', 'one'))
+        self.hub.log(_event('#channel2', 'two'))
+        self.hub.log(_event(None, 'three'))
+        self.assertEqual(['one'], [e.message for e in self.received])
+
+    def test_unsubscribe(self):
+        """
+        Unsubscribed subscribers get no more events, and channels without
+        subscribers are forgotten
+        """
+        subscription = self.hub.subscribe('#channel1', self.received.append)
+        self.assertEqual(1, self.hub.subscribers('#channel1'))
+        subscription.stopProducing()
+        self.hub.log(_event('#channel1', 'one'))
+        self.assertEqual([], self.received)
+        self.assertEqual({}, self.hub._subscriptions)
+
+    def test_paused_subscribers_queue(self):
+        """
+        Events are queued while a subscriber is paused, up to a limit past
+        which the oldest are dropped
+        """
+        subscription = self.hub.subscribe('#channel1', self.received.append,
+                                          max_queued=2)
+        subscription.pauseProducing()
+        for message in ('one', 'two', 'three'):
+            self.hub.log(_event('#channel1', message))
+        self.assertEqual([], self.received)
+
+        subscription.resumeProducing()
+        self.assertEqual(['two', 'three'], [e.message for e in self.received])
+        self.assertEqual(1, subscription.take_dropped())
+        self.assertEqual(0, subscription.take_dropped())
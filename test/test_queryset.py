@@ -0,0 +1,173 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{elasticsearch.core.queryset}
+"""
+
+import threading
+import time
+
+import mock
+
+from twisted.trial import unittest
+
+from elasticsearch import ESLogLine
+from elasticsearch.core import queryset
+
+
+def _wait_for(condition):
+    """
+    Waits (for at most a few seconds) for a condition another thread will make
+    true
+    """
+    for i in xrange(500):
+        if condition():
+            return
+        time.sleep(0.01)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """
+    Tests for L{elasticsearch.core.queryset.SingleFlight}
+    """
+
+    def setUp(self):
+        self.flight = queryset.SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _call(self, result):
+        self.calls.append(result)
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _in_threads(self, count, key, result):
+        """
+        Makes C{count} calls at once from different threads, letting the first
+        one finish only once the rest have had the chance to join it
+        """
+        results = []
+
+        def _do():
+            try:
+                results.append(self.flight.do(key, self._call, result))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=_do) for i in xrange(count)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: self.calls)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_calls_share_result(self):
+        """
+        Calls with the same key made while one is in flight get its result,
+        without calling the function again
+        """
+        result = object()
+        results = self._in_threads(5, 'key', result)
+        self.assertEqual([result], self.calls)
+        self.assertEqual([result] * 5, results)
+        self.assertEqual(0, self.flight.in_flight())
+
+    def test_concurrent_calls_share_exception(self):
+        """
+        If the call in flight raises, so do the calls waiting on it
+        """
+        error = ValueError('oops')
+        results = self._in_threads(3, 'key', error)
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual([error] * 3, results)
+        self.assertEqual(0, self.flight.in_flight())
+
+    def test_sequential_calls_not_shared(self):
+        """
+        Nothing is cached once a call has returned
+        """
+        self.release.set()
+        self.assertEqual(1, self.flight.do('key', self._call, 1))
+        self.assertEqual(2, self.flight.do('key', self._call, 2))
+        self.assertEqual([1, 2], self.calls)
+
+    def test_different_keys_not_shared(self):
+        """
+        Calls with different keys are made separately
+        """
+        self.release.set()
+        self.flight.do('key1', self._call, 1)
+        self.flight.do('key2', self._call, 2)
+        self.assertEqual([1, 2], self.calls)
+
+
+class QuerysetCoalescingTestCase(unittest.TestCase):
+    """
+    Identical querysets evaluated at the same time share one search
+    """
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.client = mock.Mock()
+        self.client.search.side_effect = self._search
+        self.patch(ESLogLine, '_client', self.client)
+
+    def _search(self, *args, **kwargs):
+        self.release.wait(5)
+        return {'took': 1, 'timed_out': False, 'hits': {'total': 1, 'hits': [
+            {'_source': {'time': 1.0, 'user': 'me', 'channel': '#channel1',
+                         'event': 'MSG', 'host': 'host',
+                         'message': 'hello'}}]}}
+
+    def _evaluate(self, querysets):
+        results = []
+        threads = [threading.Thread(target=lambda qs=qs: results.append(
+            qs.results)) for qs in querysets]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: self.client.search.called)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_identical_queries_coalesced(self):
+        """
+        Querysets with the same query, order and slice make one request
+        """
+        results = self._evaluate([
+            ESLogLine.objects.filter(channel='channel1').order_by('time')[:10]
+            for i in xrange(4)])
+        self.assertEqual(1, self.client.search.call_count)
+        self.assertEqual(4, len(results))
+        for result in results:
+            self.assertEqual(['hello'], [msg.message for msg in result])
+        # every queryset has its own list of the shared results
+        self.assertNotIdentical(results[0], results[1])
+        self.assertIdentical(results[0][0], results[1][0])
+
+    def test_different_slices_not_coalesced(self):
+        """
+        Querysets for different pages make their own requests
+        """
+        self.release.set()
+        list(ESLogLine.objects.filter(channel='channel1')[:10])
+        list(ESLogLine.objects.filter(channel='channel1')[10:20])
+        self.assertEqual(2, self.client.search.call_count)
@@ -0,0 +1,142 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{reindex}
+"""
+import os
+
+import mock
+
+from twisted.python import usage
+from twisted.trial import unittest
+
+import reindex
+from elasticsearch import ESLogLine
+
+
+LINES = ('\t[#channel1] Wed Jun  6 16:26:40 2012 :  <alice> MSG (hello) '
+         '@ host\n'
+         '\t[#channel1] Wed Jun  6 16:26:41 2012 :  <bob> MSG (hi) @ host\n')
+
+
+class IndexFileTestCase(unittest.TestCase):
+    """
+    Tests for L{reindex.index_file}
+    """
+
+    def setUp(self):
+        self.client = mock.Mock(spec=['bulk'])
+        self.patch(ESLogLine, '_client', self.client)
+        directory = self.mktemp()
+        os.makedirs(directory)
+        self.path = os.path.join(directory, '#channel1')
+        with open(self.path, 'w') as f:
+            f.write(LINES)
+
+    def test_indexed(self):
+        """
+        Every message is sent, and counted once the batch is accepted
+        """
+        self.client.bulk.return_value = {'took': 1, 'items': [
+            {'index': {'_id': 'a', 'ok': True}},
+            {'index': {'_id': 'b', 'status': 201}}]}
+        path, count, took, error, days = reindex.index_file((self.path, 10))
+        self.assertEqual((path, count, error), (self.path, 2, None))
+        self.assertEqual(len(self.client.bulk.call_args[0][0]), 2)
+
+    def test_rejected_documents(self):
+        """
+        A batch with rejected documents fails the file, so it is not
+        checkpointed, and isn't counted
+        """
+        self.client.bulk.return_value = {'took': 1, 'errors': True, 'items': [
+            {'index': {'_id': 'a', 'status': 201}},
+            {'index': {'_id': 'b', 'status': 400,
+                       'error': 'MapperParsingException'}}]}
+        path, count, took, error, days = reindex.index_file((self.path, 10))
+        self.assertEqual(count, 0)
+        self.assertIn('1 documents were not indexed', error)
+        self.assertIn('MapperParsingException', error)
+
+    def test_errors_without_items(self):
+        """
+        A response that only says there were errors still fails the file
+        """
+        self.client.bulk.return_value = {'took': 1, 'errors': True}
+        error = reindex.index_file((self.path, 10))[3]
+        self.assertEqual(error, 'documents were not indexed')
+
+
+class RefreshIntervalTestCase(unittest.TestCase):
+    """
+    Tests for L{reindex._refresh_interval}
+    """
+
+    def test_flat_settings(self):
+        """
+        The interval is read from settings keyed by their full name
+        """
+        client = mock.Mock(spec=['get_settings'])
+        client.get_settings.return_value = {'logs': {'settings': {
+            'index.refresh_interval': '30s'}}}
+        self.assertEqual(reindex._refresh_interval(client, 'logs'), '30s')
+        client.get_settings.assert_called_once_with('logs')
+
+    def test_nested_settings(self):
+        """
+        The interval is read from nested settings too
+        """
+        client = mock.Mock(spec=['get_settings'])
+        client.get_settings.return_value = {'logs': {'settings': {
+            'index': {'refresh_interval': '5s'}}}}
+        self.assertEqual(reindex._refresh_interval(client, 'logs'), '5s')
+
+    def test_unset(self):
+        """
+        An index without an interval uses elasticsearch's default
+        """
+        client = mock.Mock(spec=['get_settings'])
+        client.get_settings.return_value = {'logs': {'settings': {}}}
+        self.assertEqual(reindex._refresh_interval(client, 'logs'), '1s')
+
+
+class OptionsTestCase(unittest.TestCase):
+    """
+    Tests for L{reindex.Options}
+    """
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        self.checkpoint = os.path.join(self.directory, 'reindex.checkpoint')
+
+    def test_fresh_required(self):
+        """
+        Without a checkpoint to resume from, a run has to be a fresh one,
+        since documents the bot indexed would be indexed again
+        """
+        config = reindex.Options()
+        self.assertRaises(usage.UsageError, config.parseOptions,
+                          [self.directory])
+        config.parseOptions(['--fresh', self.directory])
+        self.assertEqual(config['checkpoint'], self.checkpoint)
+
+    def test_resume(self):
+        """
+        An interrupted run can be resumed without C{--fresh}
+        """
+        open(self.checkpoint, 'w').close()
+        config = reindex.Options()
+        config.parseOptions([self.directory])
+        self.assertFalse(config['fresh'])
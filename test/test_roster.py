@@ -0,0 +1,88 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{roster}
+"""
+
+from twisted.trial import unittest
+
+import roster
+
+
+class RosterTestCase(unittest.TestCase):
+    """
+    Tests for L{roster.Roster}
+    """
+
+    def setUp(self):
+        self.roster = roster.Roster()
+        self.roster.names('#Channel', ['@op', '+Voiced'])
+        self.roster.names('#channel', ['plain'])
+        self.roster.end_of_names('#Channel')
+
+    def test_names(self):
+        """
+        The names the server sends become the channel's members, without
+        their mode prefixes, once they have all been sent
+        """
+        self.assertEqual(self.roster.members('#CHANNEL'),
+                         ['Voiced', 'op', 'plain'])
+        self.assertEqual(self.roster.count('#channel'), 3)
+        self.assertTrue(self.roster.is_in('voiced', '#channel'))
+        self.roster.names('#channel', ['other'])
+        self.assertEqual(self.roster.count('#channel'), 3)
+        self.roster.end_of_names('#channel')
+        self.assertEqual(self.roster.members('#channel'), ['other'])
+        self.assertEqual(self.roster.channels('op'), [])
+
+    def test_join_and_leave(self):
+        """
+        Users joining and leaving are added to and removed from the channel
+        """
+        self.roster.joined('new', '#channel')
+        self.roster.joined('new', '#second')
+        self.assertEqual(self.roster.channels('NEW'), ['#Channel', '#second'])
+        self.roster.left('new', '#channel')
+        self.assertFalse(self.roster.is_in('new', '#channel'))
+        self.assertEqual(self.roster.channels('new'), ['#second'])
+
+    def test_quit(self):
+        """
+        A user quitting leaves every channel they were in
+        """
+        self.roster.joined('op', '#second')
+        self.assertEqual(self.roster.quit('OP'), ['#Channel', '#second'])
+        self.assertEqual(self.roster.channels('op'), [])
+        self.assertEqual(self.roster.members('#second'), [])
+        self.assertEqual(self.roster.quit('nobody'), [])
+
+    def test_renamed(self):
+        """
+        A nick change moves the user to their new nick in all their channels
+        """
+        self.assertEqual(self.roster.renamed('plain', 'fancy'), ['#Channel'])
+        self.assertEqual(self.roster.members('#channel'),
+                         ['Voiced', 'fancy', 'op'])
+
+    def test_forget(self):
+        """
+        Forgetting a channel forgets its members, and clearing forgets every
+        channel
+        """
+        self.roster.joined('op', '#second')
+        self.roster.forget('#channel')
+        self.assertEqual(self.roster.members('#channel'), [])
+        self.assertEqual(self.roster.channels('op'), ['#second'])
+        self.roster.clear()
+        self.assertEqual(self.roster.channels('op'), [])
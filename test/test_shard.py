@@ -0,0 +1,482 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{shard}
+"""
+import json
+
+import mock
+
+from twisted.internet import error, task
+from twisted.python import failure
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+from twisted.web.test.test_web import DummyRequest
+
+from events import MSG_EVENT
+import bot
+import loggers
+import shard
+
+
+def _network(host='irc.example.net', channels=None):
+    return {'host': host, 'port': 6667, 'nick': 'slogger',
+            'alt_nick': '_slogger',
+            'channels': channels or ['#c%d' % (i,) for i in range(50)]}
+
+
+class HashRingTestCase(unittest.TestCase):
+    """
+    Tests for L{shard.HashRing}
+    """
+
+    def setUp(self):
+        self.keys = ['#channel%d' % (i,) for i in range(1000)]
+
+    def _owners(self, ring):
+        return dict((key, ring.node_for(key)) for key in self.keys)
+
+    def test_empty(self):
+        """
+        An empty ring has no node for any key
+        """
+        self.assertIdentical(shard.HashRing().node_for('#channel'), None)
+
+    def test_stable(self):
+        """
+        Keys are placed the same way by rings with the same nodes, however
+        they were added
+        """
+        self.assertEqual(
+            self._owners(shard.HashRing(['a', 'b', 'c'])),
+            self._owners(shard.HashRing(['c', 'b', 'a'])))
+
+    def test_spread(self):
+        """
+        Every node gets a fair share of the keys
+        """
+        owners = self._owners(shard.HashRing(['a', 'b', 'c', 'd']))
+        for node in 'abcd':
+            share = owners.values().count(node)
+            self.assertTrue(150 < share < 350, (node, share))
+
+    def test_add_moves_few_keys(self):
+        """
+        Adding a node only moves keys to it
+        """
+        ring = shard.HashRing(['a', 'b', 'c'])
+        before = self._owners(ring)
+        ring.add('d')
+        after = self._owners(ring)
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(0 < len(moved) < 400, len(moved))
+        self.assertEqual(set(after[key] for key in moved), set(['d']))
+
+    def test_remove(self):
+        """
+        Removing a node only moves its keys
+        """
+        ring = shard.HashRing(['a', 'b', 'c'])
+        before = self._owners(ring)
+        ring.remove('b')
+        after = self._owners(ring)
+        self.assertEqual(len(ring), 2)
+        for key in self.keys:
+            if before[key] != 'b':
+                self.assertEqual(before[key], after[key])
+            else:
+                self.assertIn(after[key], ('a', 'c'))
+
+
+class AssignTestCase(unittest.TestCase):
+    """
+    Tests for L{shard.assign} and L{shard.worker_nick}
+    """
+
+    def test_assign(self):
+        """
+        Every channel of every network is given to exactly one node
+        """
+        networks = [_network(), _network('irc.other.net', ['#x', '#y'])]
+        assignments = shard.assign(shard.HashRing(['a', 'b']), networks)
+        channels = sorted(
+            (network['host'], channel)
+            for node_networks in assignments.itervalues()
+            for network in node_networks
+            for channel in network['channels'])
+        self.assertEqual(channels, sorted(
+            (network['host'], channel) for network in networks
+            for channel in network['channels']))
+        for node_networks in assignments.itervalues():
+            for network in node_networks:
+                self.assertEqual(network['port'], 6667)
+
+    def test_worker_nick(self):
+        """
+        Worker nicks have the worker's number, and fit in 16 characters
+        """
+        self.assertEqual(shard.worker_nick('slogger', 'worker-3'),
+                         'slogger3')
+        self.assertEqual(shard.worker_nick('a' * 16, 'worker-12'),
+                         'a' * 14 + '12')
+
+    def test_network_path(self):
+        """
+        Files kept by a worker's bots have the network's host in their path,
+        but not the worker's name, so that all the workers logging the
+        network's channels share them
+        """
+        network = dict(_network(), shard='worker-1')
+        self.assertEqual(bot.network_path('./p.json', network, [network]),
+                         './p.irc.example.net.json')
+        self.assertEqual(
+            bot.network_path('./p.json', network, [network, _network('x')]),
+            './p.irc.example.net.json')
+
+
+class FakeProcess(object):
+
+    def __init__(self, protocol, pid):
+        self.protocol = protocol
+        self.pid = pid
+        self.signals = []
+        self.written = ''
+
+    def writeToChild(self, fd, data):
+        self.written += data
+
+    def signalProcess(self, signal):
+        if self.signals:
+            raise error.ProcessExitedAlready()
+        self.signals.append(signal)
+
+
+class CoordinatorTestCase(unittest.TestCase):
+    """
+    Tests for L{shard.Coordinator}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.processes = []
+        self.logger = mock.Mock(spec=['log'])
+        self.coordinator = shard.Coordinator(
+            [_network()], 3, [self.logger], heartbeat_timeout=30,
+            spawn=self._spawn, clock=self.clock)
+
+    def _spawn(self, protocol, executable, args, **kwargs):
+        self.assertEqual(args[2:4], ['worker', protocol.name])
+        self.assertEqual(kwargs['childFDs'][shard.CONTROL_FD], 'r')
+        process = FakeProcess(protocol, len(self.processes) + 1)
+        process.args = args
+        self.processes.append(process)
+        return process
+
+    def _running(self):
+        return dict((p.protocol.name, p) for p in self.processes
+                    if not p.signals)
+
+    def _end(self, process):
+        process.protocol.processEnded(
+            failure.Failure(error.ProcessTerminated(signal=9)))
+
+    def test_start(self):
+        """
+        A worker is started for each node, with its channels and its own nick
+        """
+        self.coordinator.startService()
+        self.assertEqual(sorted(self._running()),
+                         ['worker-0', 'worker-1', 'worker-2'])
+        channels = []
+        for process in self.processes:
+            networks = json.loads(process.args[4])
+            self.assertEqual(networks[0]['shard'], process.protocol.name)
+            self.assertEqual(networks[0]['nick'],
+                             'slogger' + process.protocol.name[-1])
+            channels.extend(networks[0]['channels'])
+        self.assertEqual(sorted(channels), sorted(_network()['channels']))
+
+    def test_heartbeat(self):
+        """
+        Workers are healthy while they send heartbeats
+        """
+        self.coordinator.startService()
+        self.clock.advance(20)
+        self.processes[0].protocol.childDataReceived(
+            shard.CONTROL_FD, json.dumps({'type': shard.HEARTBEAT,
+                                          'events': 7}) + '\n')
+        self.clock.advance(20)
+        status = self.coordinator.status()
+        self.assertTrue(status['worker-0']['healthy'])
+        self.assertEqual(status['worker-0']['events'], 7)
+        self.assertFalse(status['worker-1']['healthy'])
+
+    def test_kill_unhealthy(self):
+        """
+        Workers that stop sending heartbeats are killed, and started again
+        once they exit
+        """
+        self.coordinator.startService()
+        self.clock.advance(30)
+        self.assertEqual(self._running(), {})
+        self.assertEqual(self.processes[0].signals, ['KILL'])
+        self._end(self.processes[0])
+        self.assertEqual(len(self.processes), 3)
+        self.clock.advance(shard.Coordinator.restart_delay)
+        self.assertEqual(len(self.processes), 4)
+        self.assertEqual(self.processes[3].protocol.name,
+                         self.processes[0].protocol.name)
+
+    def test_events(self):
+        """
+        The events workers send are given to the loggers, even if they arrive
+        in pieces
+        """
+        self.coordinator.startService()
+        event = loggers.LogEvent(1.0, 'me', '#c1', MSG_EVENT, 'irc', 'hi')
+        line = json.dumps({'type': shard.EVENT, 'event': event.document})
+        protocol = self.processes[0].protocol
+        protocol.childDataReceived(shard.CONTROL_FD, line[:10])
+        self.assertFalse(self.logger.log.called)
+        protocol.childDataReceived(shard.CONTROL_FD, line[10:] + '\nbad\n')
+        logged = self.logger.log.call_args[0][0]
+        self.assertEqual(list(logged), list(event))
+        self.assertIsInstance(logged.user, str)
+
+    def test_resize(self):
+        """
+        Adding a worker only restarts the workers whose channels move to it
+        """
+        self.coordinator.startService()
+        before = dict((name, networks[0]['channels']) for name, networks in
+                      self.coordinator.assignments.iteritems())
+        self.coordinator.resize(4)
+        self.assertEqual(len(self.processes), 4)
+        self.assertEqual(self.processes[3].protocol.name, 'worker-3')
+        for process in self.processes[:3]:
+            name = process.protocol.name
+            moved = (before[name] !=
+                     self.coordinator.assignments[name][0]['channels'])
+            self.assertEqual(process.signals, moved and ['KILL'] or [])
+
+    def test_shrink(self):
+        """
+        Workers that are no longer needed are not started again
+        """
+        self.coordinator.startService()
+        self.coordinator.resize(2)
+        removed = [p for p in self.processes
+                   if p.protocol.name == 'worker-2'][0]
+        self.assertEqual(removed.signals, ['KILL'])
+        self._end(removed)
+        self.clock.advance(shard.Coordinator.restart_delay)
+        self.assertNotIn('worker-2', [p.protocol.name
+                                      for p in self.processes[3:]])
+        self.assertNotIn('worker-2', self.coordinator.status())
+
+    def test_stop(self):
+        """
+        Stopping the coordinator stops the workers, for good
+        """
+        self.coordinator.startService()
+        self.coordinator.stopService()
+        self.assertEqual([p.signals for p in self.processes], [['TERM']] * 3)
+        for process in self.processes:
+            self._end(process)
+        self.clock.advance(shard.Coordinator.restart_delay)
+        self.assertEqual(len(self.processes), 3)
+
+    def _owner(self, channel):
+        name = self.coordinator.ring.node_for(
+            shard.channel_key('irc.example.net', channel))
+        return [p for p in self.processes if p.protocol.name == name][0]
+
+    def test_join_and_part(self):
+        """
+        Joining and parting a channel only tells the worker that logs it,
+        which is given the channel if it is started again
+        """
+        self.coordinator.startService()
+        self.assertTrue(self.coordinator.join('#new'))
+        self.assertFalse(self.coordinator.join('#NEW', 'irc.example.net'))
+        owner = self._owner('#new')
+        self.assertEqual(json.loads(owner.written), {
+            'type': shard.JOIN, 'host': 'irc.example.net', 'channel': '#new'})
+        self.assertEqual(
+            [p for p in self.processes if p.written], [owner])
+        self.assertIn('#new', self.coordinator.assignments[
+            owner.protocol.name][0]['channels'])
+        self.assertIn('#new', self.coordinator.channels()['irc.example.net'])
+        self.assertEqual(owner.signals, [])
+
+        self.assertTrue(self.coordinator.part('#c1'))
+        self.assertFalse(self.coordinator.part('#c1'))
+        self.assertIn('"part"', self._owner('#c1').written)
+        self.assertNotIn('#c1', self.coordinator.channels()['irc.example.net'])
+        self.assertRaises(ValueError, self.coordinator.join, 'c1')
+        self.assertRaises(ValueError, self.coordinator.join, '#c1', 'nope')
+
+    def test_join_logged_elsewhere(self):
+        """
+        A channel logged on one network can't be joined on another
+        """
+        self.coordinator.networks.append(_network('irc.other.net', ['#x']))
+        self.assertRaises(ValueError, self.coordinator.join, '#C1',
+                          'irc.other.net')
+        self.assertEqual(['#x'], self.coordinator.channels()['irc.other.net'])
+
+    def test_join_from_worker(self):
+        """
+        Workers can ask the coordinator to join a channel, and bad requests
+        are only logged
+        """
+        self.coordinator.startService()
+        protocol = self.processes[0].protocol
+        for channel in ('#new', 'bad'):
+            protocol.childDataReceived(shard.CONTROL_FD, json.dumps(
+                {'type': shard.JOIN, 'host': 'irc.example.net',
+                 'channel': channel}) + '\n')
+        self.assertEqual(self.coordinator.channels()['irc.example.net'][-1],
+                         '#new')
+        self.assertIn('#new', self._owner('#new').written)
+
+    def test_watches_changed(self):
+        """
+        When a worker changes the watches of a network, the other workers
+        logging the network are told to read them again
+        """
+        self.coordinator.startService()
+        sender = self.processes[0]
+        sender.protocol.childDataReceived(shard.CONTROL_FD, json.dumps(
+            {'type': shard.WATCHES, 'host': 'irc.example.net'}) + '\n')
+        self.assertEqual(sender.written, '')
+        for process in self.processes[1:]:
+            self.assertEqual(json.loads(process.written), {
+                'type': shard.WATCHES, 'host': 'irc.example.net'})
+
+        # workers that don't log the network aren't told
+        for process in self.processes:
+            process.written = ''
+        sender.protocol.childDataReceived(shard.CONTROL_FD, json.dumps(
+            {'type': shard.WATCHES, 'host': 'irc.other.net'}) + '\n')
+        self.assertEqual([p.written for p in self.processes], [''] * 3)
+
+    def _render_status(self):
+        request = DummyRequest([''])
+        body = json.loads(
+            shard.StatusResource(self.coordinator).render_GET(request))
+        return request.responseCode or 200, body
+
+    def test_status_resource(self):
+        """
+        The status resource responds with a 503 unless every worker is healthy
+        """
+        self.coordinator.startService()
+        code, body = self._render_status()
+        self.assertEqual(code, 200)
+        self.assertTrue(body['healthy'])
+        self.assertEqual(sorted(body['workers']),
+                         ['worker-0', 'worker-1', 'worker-2'])
+        self.clock.advance(30)
+        code, body = self._render_status()
+        self.assertEqual(code, 503)
+        self.assertFalse(body['healthy'])
+
+
+class WorkerControlTestCase(unittest.TestCase):
+    """
+    Tests for L{shard.WorkerControl}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.control = shard.WorkerControl('worker-1', 5, self.clock)
+        self.transport = proto_helpers.StringTransport()
+        self.control.makeConnection(self.transport)
+
+    def _messages(self):
+        return [json.loads(line) for line in
+                self.transport.value().splitlines()]
+
+    def test_heartbeats(self):
+        """
+        Heartbeats are sent every interval, with how many events were logged
+        """
+        self.control.log(
+            loggers.LogEvent(1.0, 'me', '#c1', MSG_EVENT, 'irc', 'hi'))
+        self.clock.advance(5)
+        messages = self._messages()
+        self.assertEqual([m['type'] for m in messages],
+                         [shard.HEARTBEAT, shard.EVENT, shard.HEARTBEAT])
+        self.assertEqual(messages[1]['event']['message'], 'hi')
+        self.assertEqual(messages[2]['events'], 1)
+        self.assertEqual(messages[2]['name'], 'worker-1')
+
+    def test_connection_lost(self):
+        """
+        Heartbeats stop when the coordinator goes away
+        """
+        with mock.patch.object(shard, 'reactor') as reactor:
+            reactor.running = False
+            self.control.connectionLost(None)
+        self.transport.clear()
+        self.clock.advance(10)
+        self.assertEqual(self.transport.value(), '')
+
+    def test_join_and_part(self):
+        """
+        The coordinator's joins and parts are given to the bot of the network
+        """
+        factory = mock.Mock(spec=['join_channel', 'part_channel', 'channels'],
+                            channels=['#a'])
+        self.control.factories['irc.example.net'] = factory
+        for action in (shard.JOIN, shard.PART):
+            self.control.lineReceived(json.dumps(
+                {'type': action, 'host': 'irc.example.net',
+                 'channel': u'#caf\xe9'}))
+        factory.join_channel.assert_called_once_with('#caf\xc3\xa9')
+        factory.part_channel.assert_called_once_with('#caf\xc3\xa9')
+        self.control.lineReceived('bad')
+        self.control.lineReceived(json.dumps({'type': shard.JOIN,
+                                              'host': 'nope'}))
+        self.assertEqual(self.control.channels(), {'irc.example.net': ['#a']})
+
+    def test_watches_changed(self):
+        """
+        Changes to the watches are sent to the coordinator, and the watches
+        are read again when the coordinator says another worker changed them
+        """
+        factory = mock.Mock(spec=['watches'])
+        self.control.factories['irc.example.net'] = factory
+        self.transport.clear()
+        self.control.watches_changed('irc.example.net')
+        self.assertEqual(self._messages(), [
+            {'type': shard.WATCHES, 'host': 'irc.example.net'}])
+        self.control.lineReceived(json.dumps(
+            {'type': shard.WATCHES, 'host': 'irc.example.net'}))
+        factory.watches.reload.assert_called_once_with()
+
+    def test_commands_sent_to_coordinator(self):
+        """
+        Bot commands joining and parting channels are sent to the coordinator
+        """
+        self.transport.clear()
+        self.assertIdentical(self.control.join('#new', 'irc.example.net'),
+                             None)
+        self.control.part('#old', 'irc.example.net')
+        self.assertEqual(self._messages(), [
+            {'type': shard.JOIN, 'host': 'irc.example.net', 'channel': '#new'},
+            {'type': shard.PART, 'host': 'irc.example.net',
+             'channel': '#old'}])
+        self.assertRaises(ValueError, self.control.join, 'new')
@@ -0,0 +1,133 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{elasticsearch.core.sqlitestore}
+"""
+
+from twisted.trial import unittest
+
+from elasticsearch import ESLogLine
+from elasticsearch.core import utils
+from elasticsearch.core.sqlitestore import SQLiteClient
+
+
+class SQLiteClientTestCase(unittest.TestCase):
+    """
+    Tests for L{elasticsearch.core.sqlitestore.SQLiteClient}, used through the
+    normal model/manager/queryset API
+    """
+
+    def setUp(self):
+        self.patch(ESLogLine, '_client', SQLiteClient(self.mktemp()))
+        ESLogLine.objects.bulk_create([
+            {'time': 1.0, 'user': 'me', 'channel': '#channel1',
+             'event': 'MSG', 'host': 'host', 'message': 'hello world'},
+            {'time': 2.0, 'user': 'you', 'channel': '#channel1',
+             'event': 'MSG', 'host': 'host', 'message': 'goodbye world'},
+            {'time': 3.0, 'user': 'me', 'channel': '#channel2',
+             'event': 'MSG', 'host': 'host', 'message': 'hello again'}])
+
+    def _messages(self, queryset):
+        return [msg.message for msg in queryset]
+
+    def test_full_text_search(self):
+        """
+        Query strings should search the message text
+        """
+        self.assertEqual(
+            ['hello world', 'hello again'],
+            self._messages(ESLogLine.objects.filter('hello').order_by('time')))
+        self.assertEqual(
+            ['hello world', 'goodbye world'],
+            self._messages(ESLogLine.objects.filter('wor*').order_by('time')))
+
+    def test_fields_in_query_string(self):
+        """
+        field:value terms in query strings should match their field
+        """
+        self.assertEqual(
+            ['hello world'],
+            self._messages(ESLogLine.objects.filter('hello channel:channel1')))
+
+    def test_term_filters(self):
+        """
+        Term filters should match like elasticsearch's analyzer does, ignoring
+        case and the channel's leading '#'
+        """
+        self.assertEqual(
+            ['goodbye world', 'hello world'],
+            self._messages(ESLogLine.objects.filter(
+                channel='CHANNEL1').order_by('-time')))
+
+    def test_raw_range_query(self):
+        """
+        The raw term and range queries used by the logs page should work
+        """
+        queryset = ESLogLine.objects._get_queryset([
+            utils.RawQuery({"query": {"term": {"channel": "channel1"}}}),
+            utils.RawQuery({"range": {"time": {"from": "2", "to": None}}})])
+        self.assertEqual(['goodbye world'], self._messages(queryset))
+
+    def test_facets_count_and_slicing(self):
+        """
+        Facets count all matching documents, while slices limit the results
+        """
+        queryset = ESLogLine.objects.all().facet('user').order_by('time')[1:2]
+        self.assertEqual({'user': [('me', 2), ('you', 1)]}, queryset.facets)
+        self.assertEqual(1, queryset.count())
+        self.assertEqual(['goodbye world'], self._messages(queryset))
+
+    def test_facets_ignore_case(self):
+        """
+        Terms facets count spellings that only differ in case together, as
+        elasticsearch counts its analyzed terms
+        """
+        ESLogLine.objects.bulk_create([
+            {'time': 4.0, 'user': 'ME', 'channel': '#Channel1',
+             'event': 'MSG', 'host': 'host', 'message': 'shouting'}])
+        facets = ESLogLine.objects.all().facet('user').facets
+        self.assertEqual(['me', 'you'],
+                         [term.lower() for term, count in facets['user']])
+        self.assertEqual([3, 1], [count for term, count in facets['user']])
+
+    def test_reindexing_with_ids_overwrites(self):
+        """
+        Indexing a document with an existing id replaces it
+        """
+        client = ESLogLine._client
+        for message in ('first', 'second'):
+            client.bulk([{'time': 4.0, 'message': message}],
+                        ESLogLine._get_index(), ESLogLine._get_doctype(),
+                        ['same-id'])
+        self.assertEqual(
+            ['second'], self._messages(ESLogLine.objects.filter('second')))
+        self.assertEqual([], self._messages(ESLogLine.objects.filter('first')))
+
+    def test_term_queries_use_indexes(self):
+        """
+        Channel and user terms are matched against their normalized columns,
+        so the (term, time) indexes are used rather than scanning every row
+        """
+        client = ESLogLine._client
+        for field, index in (('channel', 'documents_channel_term_time'),
+                             ('user', 'documents_user_term_time')):
+            where, params = client._where(
+                ESLogLine._get_index(), ESLogLine._get_doctype(),
+                {'filtered': {
+                    'query': {'term': {field: 'X'}},
+                    'filter': {'range': {'time': {'from': 1.0}}}}})
+            plan = ' '.join(str(row[-1]) for row in client._execute(
+                'EXPLAIN QUERY PLAN SELECT docid FROM documents WHERE %s '
+                'ORDER BY time' % (where,), params).fetchall())
+            self.assertIn('USING INDEX %s' % (index,), plan)
@@ -0,0 +1,227 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for L{watches}
+"""
+
+import json
+
+from twisted.trial import unittest
+
+from events import JOIN_EVENT, MSG_EVENT
+import loggers
+import watches
+
+
+class AhoCorasickTestCase(unittest.TestCase):
+    """
+    Tests for L{watches.AhoCorasick}
+    """
+
+    def test_finds_all_words(self):
+        """
+        Every occurrence of every word is found, including overlapping ones
+        and words inside others
+        """
+        matcher = watches.AhoCorasick(['he', 'she', 'his', 'hers'])
+        self.assertEqual(
+            [(4, 'she'), (4, 'he'), (6, 'hers')],
+            list(matcher.finditer('ushers')))
+        self.assertEqual([(4, 'his')], list(matcher.finditer('this')))
+        self.assertEqual([], list(matcher.finditer('nothing')))
+
+    def test_repeated_prefix(self):
+        """
+        Failure links back into the same word are followed
+        """
+        matcher = watches.AhoCorasick(['aab'])
+        self.assertEqual([(4, 'aab')], list(matcher.finditer('aaab')))
+
+
+class MatcherTestCase(unittest.TestCase):
+    """
+    Tests for L{watches.Matcher}
+    """
+
+    def test_words(self):
+        """
+        Words match whole words, whatever their case
+        """
+        matcher = watches.Matcher(['deploy', 'ops'])
+        self.assertEqual(set(['deploy']), matcher.match('Deploy done!'))
+        self.assertEqual(set(), matcher.match('deployment and tops'))
+        self.assertEqual(set(['deploy', 'ops']),
+                         matcher.match('ops: deploy'))
+
+    def test_patterns(self):
+        """
+        Terms between slashes are regular expressions
+        """
+        matcher = watches.Matcher(['/error \\d+/', '/fail(ed)?/'])
+        self.assertEqual(set(['/error \\d+/']),
+                         matcher.match('got ERROR 500'))
+        self.assertEqual(set(['/error \\d+/', '/fail(ed)?/']),
+                         matcher.match('error 1 failed'))
+        self.assertEqual(set(), matcher.match('all good'))
+
+    def test_back_references(self):
+        """
+        Patterns that can't be combined into one are still matched
+        """
+        matcher = watches.Matcher(['/(b)/', '/(a)\\1/'])
+        self.assertIdentical(None, matcher._prefilter)
+        self.assertEqual(set(['/(a)\\1/']), matcher.match('aa'))
+        self.assertEqual(set(), matcher.match('ac'))
+
+
+class WatchRegistryTestCase(unittest.TestCase):
+    """
+    Tests for L{watches.WatchRegistry}
+    """
+
+    def setUp(self):
+        self.now = 0.0
+        self.path = self.mktemp()
+        self.registry = watches.WatchRegistry(self.path, max_notifications=2,
+                                              period=60,
+                                              clock=lambda: self.now)
+        self.sent = []
+        self.registry.notify = lambda user, text: self.sent.append(
+            (user, text))
+        self.outsiders = set()
+        self.registry.in_channel = (
+            lambda user, channel: user not in self.outsiders)
+
+    def _log(self, message, user='you', channel='#channel1', event=MSG_EVENT):
+        self.registry.log(loggers.LogEvent(self.now, user, channel, event,
+                                           'host', message))
+
+    def test_add_and_remove(self):
+        """
+        Watches can be added, listed and removed
+        """
+        self.registry.add('Me', 'Deploy')
+        self.registry.add('me', '/error \\d+/', patterns=True)
+        self.assertEqual(['/error \\d+/', 'deploy'],
+                         self.registry.watches('ME'))
+        self.assertTrue(self.registry.remove('me', 'deploy'))
+        self.assertFalse(self.registry.remove('me', 'deploy'))
+        self.assertEqual(['/error \\d+/'], self.registry.watches('me'))
+
+    def test_invalid(self):
+        """
+        Empty, over long and invalid terms are not watched for, and nobody can
+        watch for too many things
+        """
+        for term in (None, ' ', 'x' * 101, '/(/'):
+            self.assertRaises(watches.WatchError, self.registry.add, 'me',
+                              term, True)
+        self.registry.max_watches = 1
+        self.registry.add('me', 'one')
+        self.assertRaises(watches.WatchError, self.registry.add, 'me', 'two')
+
+    def test_notify(self):
+        """
+        Watchers are told about messages matching their watches, except their
+        own, and only messages in channels count
+        """
+        self.registry.add('me', 'deploy')
+        self.registry.add('you', 'deploy')
+        self._log('deploy time')
+        self._log('deploy', channel='slogger')
+        self._log('deploy', event=JOIN_EVENT)
+        self.assertEqual(
+            [('me', '[#channel1] <you> deploy time (watching for deploy)')],
+            self.sent)
+
+    def test_only_members_notified(self):
+        """
+        Watchers are only told about messages in channels they are in, and
+        nobody is told anything if who is in which channel isn't known
+        """
+        self.registry.add('me', 'secret')
+        self.outsiders.add('me')
+        self._log('the secret plan')
+        self.assertEqual([], self.sent)
+        self.outsiders.clear()
+        self.registry.in_channel = None
+        self._log('the secret plan')
+        self.assertEqual([], self.sent)
+
+    def test_patterns_admins_only(self):
+        """
+        Only admins can watch for patterns
+        """
+        self.assertRaises(watches.WatchError, self.registry.add, 'me',
+                          '/./')
+        self.registry.add('me', '/./', patterns=True)
+        self.assertEqual(['/./'], self.registry.watches('me'))
+
+    def test_hostile_patterns(self):
+        """
+        Patterns that could backtrack for a long time are not watched for,
+        even for admins or when they were saved before they were checked
+        """
+        for term in ('/(a+)+$/', '/(a|aa)+$/', '/.*a.*a.*b/', '/(a)\\1/',
+                     '/(?=a)b/'):
+            self.assertRaises(watches.WatchError, self.registry.add, 'me',
+                              term, True)
+        with open(self.path, 'w') as f:
+            json.dump({'me': ['/(a+)+$/', 'deploy']}, f)
+        registry = watches.WatchRegistry(self.path)
+        self.assertEqual(['deploy'], registry.watches('me'))
+        self.assertEqual({}, registry.match('a' * 30 + '!'))
+
+    def test_rate_limited(self):
+        """
+        Watchers are only sent so many notifications in a period, and are
+        told how many they missed when they next get one
+        """
+        self.registry.add('me', 'deploy')
+        for i in xrange(4):
+            self._log('deploy %d' % (i,))
+        self.assertEqual(2, len(self.sent))
+        self.now = 61.0
+        self._log('deploy again')
+        self.assertEqual(3, len(self.sent))
+        self.assertTrue(self.sent[-1][1].endswith(
+            ' - and 2 more matches you were not told about'))
+
+    def test_shared(self):
+        """
+        Registries sharing a file read it again before changing it, and when
+        told to, and say when they have changed it
+        """
+        other = watches.WatchRegistry(self.path)
+        changed = []
+        other.changed = lambda: changed.append(True)
+        self.registry.add('me', 'deploy')
+        other.add('you', 'release')
+        self.assertEqual([True], changed)
+        self.assertEqual(['deploy'], other.watches('me'))
+        self.assertEqual([], self.registry.watches('you'))
+        self.registry.reload()
+        self.assertEqual(['release'], self.registry.watches('you'))
+        self.assertTrue(other.remove('me', 'deploy'))
+        self.assertEqual([], watches.WatchRegistry(self.path).watches('me'))
+
+    def test_saved(self):
+        """
+        Watches are saved, and loaded by new registries
+        """
+        self.registry.add('me', 'deploy')
+        self.registry.add('you', '/error/', patterns=True)
+        registry = watches.WatchRegistry(self.path)
+        self.assertEqual(['deploy'], registry.watches('me'))
+        self.assertEqual({'you': ['/error/']}, registry.match('an error'))
@@ -15,13 +15,28 @@
 Tests for L{web.view}
 """
 
+import os
+import time
+from datetime import date, timedelta
+
 import mock
 
+from twisted.internet import defer
+from twisted.internet.error import ConnectionLost
+from twisted.python import failure
 from twisted.trial import unittest
-from twisted.web.template import XMLString, flattenString
+from twisted.web import http, server
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyChannel
+from twisted.web.template import (XMLString, flattenString, Element,
+                                  renderer)
 
 from elasticsearch import ESLogLine
-from web import view
+from web import admission, pagecache, view
+import directory
+import history
+import loggers
+import logreader
 
 import settings
 
@@ -178,10 +193,12 @@ class NavElementTestCase(BaseElementTestCase):
 
     def setUp(self):
         self.patch(settings, 'IRC_CHANNELS', ['#channel1', '#channel2'])
+        self.patch(directory, 'directory',
+                   directory.Directory(settings.IRC_CHANNELS))
 
     def test_render_channel(self):
         """
-        Channel slots should be filled correctly
+        Channel slots should be filled correctly, from the channel directory
         """
         element = view.NavElement(self._get_XMLString(self.channel_xml))
         return self._run_test(element, self._get_check_equals_callback(
@@ -286,3 +303,418 @@ class SearchResourceTestCase(unittest.TestCase):
             args={'search': ['searchstring1', 'searchstring2']}))
         ESLogLine.objects.filter.assert_called_once_with('searchstring1')
         self.assertFalse(ESLogLine.objects.all.called)
+
+
+class LogsResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.view.LogsResource}
+    """
+
+    def setUp(self):
+        self.patch(
+            ESLogLine, 'objects', mock.MagicMock(spec=ESLogLine.objects))
+
+    def _queryset_from_request(self, args):
+        d = defer.maybeDeferred(view.LogsResource().element_from_request,
+                                mock.MagicMock(args=args))
+        d.addCallback(lambda element: element._args[0])
+        return d
+
+    def test_uses_elasticsearch_when_available(self):
+        """
+        When elasticsearch is available, the logs should be queried from it
+        """
+        ESLogLine.objects.is_available.return_value = True
+        d = self._queryset_from_request({'channel': ['#channel1']})
+        d.addCallback(lambda queryset: self.assertEqual(
+            1, ESLogLine.objects._get_queryset.call_count))
+        return d
+
+    def test_falls_back_to_flat_files(self):
+        """
+        When elasticsearch is unavailable, the logs should be read from the
+        flat files
+        """
+        ESLogLine.objects.is_available.return_value = False
+        self.patch(settings, 'LOG_FILE_PATH', self.mktemp())
+        os.mkdir(settings.LOG_FILE_PATH)
+
+        def _check(queryset):
+            self.assertIsInstance(queryset, logreader.FlatFileQueryset)
+            self.assertEqual((5.0, 10.0),
+                             (queryset._start_time, queryset._end_time))
+            self.assertFalse(ESLogLine.objects._get_queryset.called)
+
+        d = self._queryset_from_request(
+            {'channel': ['#channel1'], 'from': ['5'], 'to': ['10']})
+        d.addCallback(_check)
+        return d
+
+    def test_queryset_evaluated_before_rendering(self):
+        """
+        The query should have been run (in a thread) by the time the element
+        is ready to render, so that rendering does not block
+        """
+        ESLogLine.objects.is_available.return_value = True
+        d = self._queryset_from_request({'channel': ['#channel1']})
+        d.addCallback(lambda queryset: self.assertTrue(queryset.count.called))
+        return d
+
+    def _history(self):
+        recent = history.History()
+        recent._started = 100.0
+        for i in xrange(3):
+            recent.log(loggers.LogEvent(200.0 + i, 'me', '#channel1',
+                                        'MSG', 'host', str(i)))
+        self.patch(history, 'history', recent)
+
+    def test_recent_history(self):
+        """
+        Time ranges the bot's recent history has all of are read from it,
+        without querying elasticsearch
+        """
+        self._history()
+        d = self._queryset_from_request(
+            {'channel': ['#Channel1'], 'from': ['150'], 'to': ['201']})
+        d.addCallback(lambda queryset: self.assertEqual(
+            ['0', '1'], [msg.message for msg in queryset]))
+        d.addCallback(lambda _: self.assertFalse(
+            ESLogLine.objects.is_available.called))
+        return d
+
+    def test_older_than_recent_history(self):
+        """
+        Time ranges reaching back further than the recent history are queried
+        """
+        self._history()
+        ESLogLine.objects.is_available.return_value = True
+        d = self._queryset_from_request(
+            {'channel': ['#channel1'], 'from': ['50'], 'to': ['201']})
+        d.addCallback(lambda queryset: self.assertEqual(
+            1, ESLogLine.objects._get_queryset.call_count))
+        return d
+
+
+class _ListElement(Element):
+    """
+    An element rendering many items, to be streamed
+    """
+    loader = XMLString('<ul xmlns:t="http://twistedmatrix.com/ns/twisted.web.'
+                       'template/0.1"><li t:render="items" /></ul>')
+
+    @renderer
+    def items(self, request, tag):
+        for i in xrange(3):
+            yield tag.clone()(str(i))
+
+
+class _SlowElement(Element):
+    """
+    An element that finishes rendering when its Deferred fires
+    """
+    loader = XMLString('<p xmlns:t="http://twistedmatrix.com/ns/twisted.web.'
+                       'template/0.1"><t:transparent t:render="rest" /></p>')
+
+    def __init__(self):
+        Element.__init__(self)
+        self.remaining = defer.Deferred()
+
+    @renderer
+    def rest(self, request, tag):
+        return self.remaining
+
+
+class BaseElementRendererResourceTestCase(unittest.TestCase):
+    """
+    Tests for L{web.view.BaseElementRendererResource}
+    """
+
+    def _render(self, element):
+        resource = view.BaseElementRendererResource()
+        resource.element_from_request = lambda request: element
+        request = mock.MagicMock(startedWriting=False)
+        self.assertEqual(NOT_DONE_YET, resource.render_GET(request))
+        return request
+
+    def test_page_is_streamed(self):
+        """
+        The doctype should be written first and the page written in pieces as
+        it is rendered, rather than all at once at the end
+        """
+        request = self._render(_ListElement())
+        written = [args[0] for args, kwargs in request.write.call_args_list]
+        self.assertEqual('<!DOCTYPE html>\n', written[0])
+        self.assertTrue(len(written) > 2)
+        self.assertEqual('<ul><li>0</li><li>1</li><li>2</li></ul>',
+                         ''.join(written[1:]))
+        self.assertTrue(request.registerProducer.called)
+        request.finish.assert_called_once_with()
+
+    def test_render_failure(self):
+        """
+        A failure before anything has been written becomes a 500
+        """
+        def _fail(request):
+            raise ValueError('broken')
+        resource = view.BaseElementRendererResource()
+        resource.element_from_request = _fail
+        request = mock.MagicMock(startedWriting=False)
+        resource.render_GET(request)
+        request.setResponseCode.assert_called_once_with(500)
+        request.finish.assert_called_once_with()
+        self.assertEqual(1, len(self.flushLoggedErrors(ValueError)))
+
+    def test_rejected(self):
+        """
+        A query turned away by the admission gate gets its status and
+        Retry-After header, and is not logged as an error
+        """
+        def _reject(request):
+            raise admission.Rejected(503, 'busy', 5)
+        resource = view.BaseElementRendererResource()
+        resource.element_from_request = _reject
+        request = mock.MagicMock(startedWriting=False)
+        resource.render_GET(request)
+        request.setResponseCode.assert_called_once_with(503)
+        request.setHeader.assert_called_once_with('retry-after', '5')
+        request.write.assert_called_once_with('busy')
+        request.finish.assert_called_once_with()
+        self.assertEqual([], self.flushLoggedErrors())
+
+
+    def _disconnect_while_streaming(self, result):
+        element = _SlowElement()
+        resource = view.BaseElementRendererResource()
+        resource.element_from_request = lambda request: element
+        request = server.Request(DummyChannel(), False)
+        request.method = 'GET'
+        self.assertEqual(NOT_DONE_YET, resource.render_GET(request))
+        request.connectionLost(failure.Failure(ConnectionLost()))
+        if isinstance(result, Exception):
+            element.remaining.errback(result)
+        else:
+            element.remaining.callback(result)
+        self.assertEqual([], self.flushLoggedErrors())
+
+    def test_disconnected_while_streaming(self):
+        """
+        A client that goes away in the middle of a page is left alone once
+        the page has been rendered
+        """
+        self._disconnect_while_streaming('the rest')
+
+    def test_disconnected_before_failure(self):
+        """
+        A client that goes away before rendering fails is left alone, and
+        the failure isn't logged
+        """
+        self._disconnect_while_streaming(ValueError('broken'))
+
+
+class RenderProducerTestCase(unittest.TestCase):
+    """
+    Tests for L{web.view._RenderProducer}
+    """
+
+    def test_wait_while_paused(self):
+        """
+        Rendering should wait while the client is not reading, and carry on
+        once it is
+        """
+        producer = view._RenderProducer()
+        self.assertIdentical(None, producer.wait())
+        producer.pauseProducing()
+        d = producer.wait()
+        self.assertNoResult(d)
+        producer.resumeProducing()
+        self.assertEqual('', self.successResultOf(d))
+        self.assertIdentical(None, producer.wait())
+
+    def test_stopped(self):
+        """
+        Rendering should stop once the client has gone away
+        """
+        producer = view._RenderProducer()
+        producer.pauseProducing()
+        d = producer.wait()
+        producer.stopProducing()
+        self.successResultOf(d)
+        self.failureResultOf(producer.wait(), ConnectionLost)
+
+
+class LogsResourceCachingTestCase(unittest.TestCase):
+    """
+    Tests for the HTTP caching of L{web.view.LogsResource}
+    """
+
+    def setUp(self):
+        self.patch(directory, 'directory', directory.Directory(['#channel1']))
+
+    def _request(self, args, headers=None):
+        request = server.Request(DummyChannel(), False)
+        request.method = 'GET'
+        request.args = args
+        for name, value in (headers or {}).iteritems():
+            request.requestHeaders.setRawHeaders(name, [value])
+        return request
+
+    def _closed_args(self):
+        yesterday = time.mktime(date.today().timetuple()) - 3600
+        return {'channel': ['#channel1'], 'from': [str(yesterday - 60)],
+                'to': [str(yesterday)]}
+
+    def test_open_range_cached_briefly(self):
+        """
+        Today's logs may still change, so should only be cached for a short
+        time, and without validators
+        """
+        request = self._request({'channel': ['#channel1']})
+        self.assertIdentical(
+            None, view.LogsResource()._set_cache_headers(request))
+        self.assertEqual(['public, max-age=30'],
+                         request.responseHeaders.getRawHeaders(
+                             'cache-control'))
+        self.assertIdentical(None, request.etag)
+
+    def test_closed_range_cached(self):
+        """
+        Days that are over get a longer max-age, an ETag and a Last-Modified
+        """
+        request = self._request(self._closed_args())
+        self.assertFalse(view.LogsResource()._set_cache_headers(request))
+        self.assertEqual(['public, max-age=3600'],
+                         request.responseHeaders.getRawHeaders(
+                             'cache-control'))
+        self.assertNotIdentical(None, request.etag)
+        self.assertNotIdentical(None, request.lastModified)
+
+    def test_if_none_match(self):
+        """
+        A request with the ETag of a closed range is not modified
+        """
+        resource = view.LogsResource()
+        first = self._request(self._closed_args())
+        resource._set_cache_headers(first)
+
+        request = self._request(self._closed_args(),
+                                {'if-none-match': first.etag})
+        self.assertEqual('', resource.render_GET(request))
+        self.assertEqual(http.NOT_MODIFIED, request.code)
+
+        request = self._request(self._closed_args(),
+                                {'if-none-match': '"other"'})
+        self.assertIdentical(None, resource._set_cache_headers(request))
+        self.assertEqual(http.OK, request.code)
+
+    def test_directory_changed(self):
+        """
+        The channels and users listed on the page of a closed range can still
+        change, and then it is modified
+        """
+        resource = view.LogsResource()
+        first = self._request(self._closed_args())
+        resource._set_cache_headers(first)
+
+        directory.directory._seen('#channel2', None, time.time() - 10)
+        request = self._request(self._closed_args(),
+                                {'if-none-match': first.etag})
+        self.assertIdentical(None, resource._set_cache_headers(request))
+        second = request.etag
+
+        directory.directory._seen('#channel1', 'me', time.time() - 5)
+        request = self._request(self._closed_args(),
+                                {'if-none-match': second})
+        self.assertIdentical(None, resource._set_cache_headers(request))
+
+        request = self._request(self._closed_args(), {
+            'if-modified-since': http.datetimeToString(time.time() - 8)})
+        self.assertIdentical(None, resource._set_cache_headers(request))
+
+    def test_next_day_link(self):
+        """
+        The page of a day is modified once the link to the next day appears
+        """
+        start, end = pagecache.day_range(date.today() - timedelta(days=2))
+        args = {'channel': ['#channel1'], 'from': [str(start)],
+                'to': [str(end)]}
+        request = self._request(args, {
+            'if-modified-since': http.datetimeToString(
+                time.mktime(date.today().timetuple()) - 1)})
+        self.assertIdentical(
+            None, view.LogsResource()._set_cache_headers(request))
+
+    def test_no_channel(self):
+        """
+        Without a channel, and no default one, the request is a bad one
+        """
+        self.patch(directory, 'default_channel', lambda: None)
+        request = self._request({})
+        self.assertEqual('channel is required',
+                         view.LogsResource().render_GET(request))
+        self.assertEqual(http.BAD_REQUEST, request.code)
+
+    def test_if_modified_since(self):
+        """
+        A request for a closed range modified since the end of the range is
+        not modified
+        """
+        request = self._request(self._closed_args(), {
+            'if-modified-since': http.datetimeToString(time.time())})
+        self.assertEqual(http.CACHED,
+                         view.LogsResource()._set_cache_headers(request))
+        self.assertEqual(http.NOT_MODIFIED, request.code)
+
+    def _day_args(self):
+        start, end = pagecache.day_range(date.today() - timedelta(days=1))
+        return {'channel': ['#channel1'], 'from': [str(start)],
+                'to': [str(end)]}
+
+    def test_serves_page_cache(self):
+        """
+        Whole days that have been pre-rendered are served gzipped from the
+        page cache, to clients that accept gzip
+        """
+        cache = pagecache.PageCache(self.mktemp())
+        cache.store('#channel1', date.today() - timedelta(days=1), 'page')
+        self.patch(view.LogsResource, 'page_cache', cache)
+        resource = view.LogsResource()
+
+        request = self._request(self._day_args(),
+                                {'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(NOT_DONE_YET, resource.render_GET(request))
+        self.assertEqual(['gzip'], request.responseHeaders.getRawHeaders(
+            'content-encoding'))
+        self.assertEqual(['Accept-Encoding'],
+                         request.responseHeaders.getRawHeaders('vary'))
+
+        request = self._request(self._day_args())
+        self.assertIdentical(None, resource.cached_page(request))
+        args = self._day_args()
+        args['user'] = ['me']
+        request = self._request(args, {'accept-encoding': 'gzip'})
+        self.assertIdentical(None, resource.cached_page(request))
+
+
+class FacetedMessageElementDirectoryTestCase(BaseElementTestCase):
+    """
+    Tests for L{web.view.FacetedMessageElement} when the queryset has no
+    facets, so channels and users come from the directory
+    """
+
+    def setUp(self):
+        self.patch(directory, 'directory', directory.Directory(['#channel1']))
+        directory.directory._seen('#channel1', 'me', time.time() - 20)
+        directory.directory._seen('#channel1', 'you', time.time() - 10)
+
+    def test_render_users(self):
+        """
+        The channel's recently active users are listed, most recent first
+        """
+        xml = ('<t:transparent t:render="faceted_users">'
+               '<t:slot name="user_name"/>\n</t:transparent>')
+        queryset = mock.MagicMock(facets={})
+        element = view.FacetedMessageElement(self._get_XMLString(xml),
+                                             queryset)
+        return self._run_test(
+            element, self._get_check_equals_callback(['you', 'me']),
+            mock.MagicMock(args={'channel': ['#channel1']}, prepath=['']))
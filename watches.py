@@ -0,0 +1,442 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_watches -*-
+
+"""
+Watches: words and regular expressions users want to be told about when they
+are said in a logged channel they are in.  All the watches are matched against
+each message at once, as it is logged, so the cost of matching hardly grows
+with the number of watches.
+
+Patterns are matched in the reactor, so a pattern that backtracks badly would
+hold up all the logging - only admins can watch for patterns, and only for
+ones L{check_pattern} accepts.
+"""
+import json
+import os
+import re
+import sre_constants
+import sre_parse
+import time
+from collections import deque
+
+from twisted.python import log
+
+from events import CTCPQUERY_EVENT, MSG_EVENT
+
+
+# back references to groups, by number or name
+_BACK_REFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+# how many ways a pattern may try to match at each place in a message, counting
+# the longest IRC message for repeats without a maximum
+_MAX_PATTERN_COST = 10000
+_MAX_MESSAGE = 512
+# what patterns may use besides characters, classes and repeats of them
+_SAFE_OPS = frozenset([
+    sre_constants.ANY, sre_constants.AT, sre_constants.CATEGORY,
+    sre_constants.IN, sre_constants.LITERAL, sre_constants.NOT_LITERAL,
+    sre_constants.RANGE, sre_constants.NEGATE])
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+class WatchError(Exception):
+    """
+    A watch could not be added
+    """
+
+
+class AhoCorasick(object):
+    """
+    Finds which of a set of words occur in a text in a single pass over it,
+    however many words there are
+    """
+
+    def __init__(self, words):
+        """
+        @param words: the words to look for
+        @type words: C{iterable} of C{str}
+        """
+        # each state is a dict of transitions, and the failure link and the
+        # words ending at each state are kept alongside
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for word in words:
+            self._add(word)
+        self._link()
+
+    def _add(self, word):
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] += (word,)
+
+    def _link(self):
+        # breadth first, so that the failure link of each state's parent is
+        # known before its own
+        queue = deque(self._goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                link = self._goto[fail].get(char, 0)
+                self._fail[next_state] = link if link != next_state else 0
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def finditer(self, text):
+        """
+        @return: an iterator of C{(end, word)} for each occurrence of a word,
+            where C{end} is the index just after it
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in out[state]:
+                yield i + 1, word
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class Matcher(object):
+    """
+    Finds which of a set of terms match a message.  Terms are either words,
+    which match case insensitively wherever they appear as a whole word, or
+    regular expressions written between slashes, like C{/error \\d+/}.
+    """
+
+    def __init__(self, terms):
+        words = set()
+        self._patterns = {}
+        for term in terms:
+            if is_pattern(term):
+                self._patterns[term] = re.compile(term[1:-1], re.I)
+            else:
+                words.add(term.lower())
+        self._words = AhoCorasick(words) if words else None
+        self._prefilter = None
+        # combining patterns renumbers their groups, so patterns with back
+        # references can't be combined
+        if self._patterns and not any(
+                _BACK_REFERENCE.search(term) for term in self._patterns):
+            self._prefilter = re.compile('|'.join(
+                '(?:%s)' % (term[1:-1],) for term in self._patterns), re.I)
+
+    def match(self, text):
+        """
+        @return: C{set} of the terms that match the text
+        """
+        matched = set()
+        if self._words is not None:
+            lowered = text.lower()
+            for end, word in self._words.finditer(lowered):
+                start = end - len(word)
+                if ((start == 0 or not _is_word_char(lowered[start - 1])) and
+                        (end == len(lowered) or
+                         not _is_word_char(lowered[end]))):
+                    matched.add(word)
+        if self._patterns:
+            # most messages match none of the patterns, and that only takes
+            # the one search to find out
+            if self._prefilter is None or self._prefilter.search(text):
+                for term, pattern in self._patterns.iteritems():
+                    if pattern.search(text):
+                        matched.add(term)
+        return matched
+
+
+def _pattern_cost(parsed, repeated=False):
+    cost = 1
+    for op, av in parsed:
+        if op in _REPEATS:
+            low, high, body = av
+            if repeated:
+                raise WatchError('patterns cannot repeat repeats')
+            cost *= min(high, _MAX_MESSAGE) * _pattern_cost(body, True)
+        elif op == sre_constants.SUBPATTERN:
+            cost *= _pattern_cost(av[-1], repeated)
+        elif op == sre_constants.BRANCH:
+            if repeated:
+                raise WatchError('patterns cannot repeat alternatives')
+            cost *= sum(_pattern_cost(branch) for branch in av[1])
+        elif op not in _SAFE_OPS:
+            raise WatchError('patterns cannot use back references or '
+                             'lookarounds')
+    return cost
+
+
+def check_pattern(term):
+    """
+    Checks that a pattern is valid, and can't take long to match - it can't
+    use back references or lookarounds, repeat anything that is itself
+    repeated or has alternatives, or have repeats that together could try
+    too many ways of matching
+
+    @raise WatchError: if it isn't
+    """
+    try:
+        parsed = sre_parse.parse(term[1:-1])
+    except (re.error, OverflowError) as e:
+        raise WatchError('that is not a valid pattern: %s' % (e,))
+    if _pattern_cost(parsed) > _MAX_PATTERN_COST:
+        raise WatchError('that pattern could take too long to match - use '
+                         'fewer repeats, or give them a maximum like {1,10}')
+
+
+def is_pattern(term):
+    return len(term) > 2 and term.startswith('/') and term.endswith('/')
+
+
+def normalize(term):
+    """
+    @return: the term as it is stored - words are case insensitive
+    """
+    term = term.strip()
+    if is_pattern(term):
+        return term
+    return term.lower()
+
+
+class WatchRegistry(object):
+    """
+    Everyone's watches, saved to a file whenever they change.  It has the
+    same C{log} method as the loggers in L{loggers}, so it can be one of the
+    bot's loggers - each message logged is matched against all the watches,
+    and the users watching for any of the terms it matches are notified
+    through L{notify}, if L{in_channel} says they are in the message's
+    channel.
+
+    Each user gets at most C{max_notifications} notifications every
+    C{period} seconds - matches over that are counted, and they are told how
+    many they missed with their next notification.
+
+    @ivar notify: called with the user and the text of each notification, or
+        C{None} if notifications can't be sent
+    @type notify: C{callable}
+
+    @ivar in_channel: called with a user and a channel, returns whether the
+        user is in the channel - nobody is notified without it, so that
+        watches can't be used to read channels their watchers aren't in
+    @type in_channel: C{callable}
+
+    @ivar changed: called after the watches have been changed and saved, or
+        C{None}.  Registries can share a file - the worker processes logging
+        a network's channels do (see L{shard}) - and each reads it again
+        before changing it, and when told to with L{reload}.
+    @type changed: C{callable}
+    """
+    max_watches = 20
+    max_term_length = 100
+
+    def __init__(self, path=None, max_notifications=5, period=60,
+                 clock=time.time):
+        """
+        @param path: the file to save the watches in, or C{None} not to
+        @type path: C{str}
+        """
+        self.path = path
+        self.max_notifications = max_notifications
+        self.period = period
+        self.notify = None
+        self.in_channel = None
+        self.changed = None
+        self._clock = clock
+        # lower case user name -> set of terms
+        self._watches = {}
+        # term -> set of lower case user names
+        self._watchers = {}
+        # lower case user name -> deque of recent notification times, and how
+        # many notifications were missed
+        self._sent = {}
+        self._missed = {}
+        self._matcher = None
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                watches = json.load(f)
+        except (IOError, ValueError):
+            log.err(None, 'Reading the watches failed')
+            return
+        for user, terms in watches.iteritems():
+            for term in terms:
+                if is_pattern(term):
+                    try:
+                        check_pattern(term)
+                    except WatchError as e:
+                        log.msg('Not watching for %s for %s: %s' % (
+                            term, user, e))
+                        continue
+                self._add(user, term)
+        self._compile()
+
+    def reload(self):
+        """
+        Read the watches from the file again, in case another registry
+        sharing it changed them
+        """
+        if self.path is None:
+            return
+        self._watches = {}
+        self._watchers = {}
+        self._matcher = None
+        if os.path.exists(self.path):
+            self._load()
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(dict((user, sorted(terms)) for user, terms in
+                               self._watches.iteritems()), f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            log.err(None, 'Saving the watches failed')
+            return
+        if self.changed is not None:
+            self.changed()
+
+    def _add(self, user, term):
+        self._watches.setdefault(user.lower(), set()).add(term)
+        self._watchers.setdefault(term, set()).add(user.lower())
+
+    def _compile(self):
+        self._matcher = Matcher(self._watchers) if self._watchers else None
+
+    def add(self, user, term, patterns=False):
+        """
+        Watch for a term for a user
+
+        @param patterns: whether the user may watch for patterns
+        @type patterns: C{bool}
+
+        @raise WatchError: if the term is not valid, or the user has too many
+            watches
+        """
+        term = normalize(term or '')
+        if not term:
+            raise WatchError('watch for what?')
+        if len(term) > self.max_term_length:
+            raise WatchError('that is too long to watch for')
+        if is_pattern(term):
+            if not patterns:
+                raise WatchError('only admins can watch for patterns - watch '
+                                 'for a word instead')
+            check_pattern(term)
+        self.reload()
+        terms = self._watches.get(user.lower(), set())
+        if term not in terms and len(terms) >= self.max_watches:
+            raise WatchError('you can only watch for %d things' % (
+                self.max_watches,))
+        self._add(user, term)
+        self._compile()
+        self._save()
+
+    def remove(self, user, term):
+        """
+        Stop watching for a term for a user
+
+        @return: whether the user was watching for it
+        """
+        term = normalize(term or '')
+        self.reload()
+        terms = self._watches.get(user.lower(), set())
+        if term not in terms:
+            return False
+        terms.discard(term)
+        if not terms:
+            del self._watches[user.lower()]
+        watchers = self._watchers[term]
+        watchers.discard(user.lower())
+        if not watchers:
+            del self._watchers[term]
+        self._compile()
+        self._save()
+        return True
+
+    def watches(self, user):
+        """
+        @return: C{list} of the terms the user is watching for
+        """
+        return sorted(self._watches.get(user.lower(), ()))
+
+    def match(self, text):
+        """
+        @return: C{dict} mapping the (lower case) names of the users watching
+            for terms the text matches to the terms
+        """
+        if self._matcher is None or not text:
+            return {}
+        matches = {}
+        for term in self._matcher.match(text):
+            for user in self._watchers.get(term, ()):
+                matches.setdefault(user, []).append(term)
+        return matches
+
+    def _allowed(self, user, now):
+        sent = self._sent.get(user)
+        if sent is None:
+            sent = self._sent[user] = deque()
+        while sent and sent[0] <= now - self.period:
+            sent.popleft()
+        if len(sent) >= self.max_notifications:
+            self._missed[user] = self._missed.get(user, 0) + 1
+            return False
+        sent.append(now)
+        return True
+
+    def log(self, event):
+        if (event.event not in (MSG_EVENT, CTCPQUERY_EVENT) or
+                not event.channel or not event.channel.startswith('#')):
+            return
+        if self.notify is None or self.in_channel is None:
+            return
+        matches = self.match(event.message)
+        if not matches:
+            return
+        now = self._clock()
+        for user, terms in matches.iteritems():
+            if user == (event.user or '').lower():
+                continue
+            if not self.in_channel(user, event.channel):
+                continue
+            if not self._allowed(user, now):
+                continue
+            text = '[%s] <%s> %s (watching for %s)' % (
+                event.channel, event.user, event.message,
+                ', '.join(sorted(terms)))
+            missed = self._missed.pop(user, 0)
+            if missed:
+                text += ' - and %d more match%s you were not told about' % (
+                    missed, missed != 1 and 'es' or '')
+            self.notify(user, text)
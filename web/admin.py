@@ -0,0 +1,96 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_admin -*-
+
+"""
+Admin endpoints, only served if C{settings.HTTP_ADMIN_TOKEN} is set.  Every
+request must have an C{Authorization: Bearer <HTTP_ADMIN_TOKEN>} header.
+
+GET /admin/channels - the channels being logged on each network::
+
+    {"channels": {"irc.example.net": ["#channel", ...], ...}}
+
+POST /admin/channels - join or part a channel, with the arguments:
+
+action - join or part
+channel - the channel
+network - the host of the network, which can be left out if only one network
+    is logged
+
+and responds with::
+
+    {"action": "join", "channel": "#channel", "changed": true}
+
+where C{changed} is false if the channel was already being logged (or
+wasn't, for part), and null if that isn't known yet.
+"""
+import hmac
+import json
+
+from twisted.web.http import BAD_REQUEST, UNAUTHORIZED
+from twisted.web.resource import Resource
+
+
+def _first(request, name, default=None):
+    return request.args.get(name, [default])[0]
+
+
+class ChannelsResource(Resource):
+    """
+    Lists, joins and parts channels through a channel manager - a
+    L{bot.ChannelManager}, or a L{shard.Coordinator} if the channels are
+    sharded
+    """
+    isLeaf = True
+
+    def __init__(self, manager, token):
+        Resource.__init__(self)
+        self.manager = manager
+        self.token = token
+
+    def _respond(self, request, body, code=None):
+        if code is not None:
+            request.setResponseCode(code)
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(body)
+
+    def _authorized(self, request):
+        header = request.getHeader('authorization') or ''
+        return bool(self.token) and hmac.compare_digest(
+            header, 'Bearer %s' % (self.token,))
+
+    def render(self, request):
+        if not self._authorized(request):
+            request.setHeader('www-authenticate', 'Bearer')
+            return self._respond(request, {'error': 'unauthorized'},
+                                 UNAUTHORIZED)
+        return Resource.render(self, request)
+
+    def render_GET(self, request):
+        return self._respond(request, {'channels': self.manager.channels()})
+
+    def render_POST(self, request):
+        action = _first(request, 'action')
+        channel = _first(request, 'channel')
+        if action not in ('join', 'part'):
+            return self._respond(
+                request, {'error': 'action must be join or part'},
+                BAD_REQUEST)
+        try:
+            changed = getattr(self.manager, action)(
+                channel, _first(request, 'network'))
+        except ValueError as e:
+            return self._respond(request, {'error': str(e)}, BAD_REQUEST)
+        return self._respond(request, {'action': action, 'channel': channel,
+                                       'changed': changed})
@@ -0,0 +1,278 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_admission -*-
+
+"""
+Admission control for the queries web pages make to the search index: how
+many can run at once, how many can wait for their turn (and for how long),
+how often each client can make them, and how expensive they can be.  Queries
+that are turned away fail fast with L{Rejected}, rather than piling up in the
+threadpool and on the search cluster.
+"""
+import math
+import re
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor, threads
+from twisted.web.http import BAD_REQUEST, SERVICE_UNAVAILABLE
+
+import settings
+
+
+TOO_MANY_REQUESTS = 429
+
+# the cost of a query with a term starting with a wildcard, which has to scan
+# every term in the index
+LEADING_WILDCARD_COST = 100
+
+# the cost of a query with a regular expression, fuzzy or other wildcard term
+EXPENSIVE_TERM_COST = 5
+
+_WORD = re.compile(r'\S+')
+
+
+class Rejected(Exception):
+    """
+    A query was not let through
+
+    @ivar code: the HTTP status to respond with
+    @type code: C{int}
+
+    @ivar retry_after: how many seconds the client should wait before trying
+        again, or C{None} if it should not
+    @type retry_after: C{int}
+    """
+
+    def __init__(self, code, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.retry_after = retry_after
+
+    def respond(self, request):
+        """
+        Sets the status and headers of the response to the rejected request
+
+        @return: C{str}, the reason the request was rejected
+        """
+        request.setResponseCode(self.code)
+        if self.retry_after is not None:
+            request.setHeader('retry-after', str(self.retry_after))
+        return self.message
+
+
+def client_address(request, trusted_proxies=None):
+    """
+    The address of the client that made a request.  Requests that come
+    through one of the trusted proxies - the reverse proxy in front of the
+    web interface, say - are from the last address in their
+    C{X-Forwarded-For} header that isn't also a trusted proxy, rather than
+    from the proxy itself.
+
+    @param trusted_proxies: the addresses of the proxies whose
+        C{X-Forwarded-For} headers can be believed, by default
+        C{settings.HTTP_TRUSTED_PROXIES}
+    @type trusted_proxies: C{list} of C{str}
+
+    @return: C{str}, or C{None} if the client's address is not known
+    """
+    if trusted_proxies is None:
+        trusted_proxies = getattr(settings, 'HTTP_TRUSTED_PROXIES', [])
+    address = request.getClientIP()
+    if address not in trusted_proxies:
+        return address
+    forwarded = [hop.strip() for header in
+                 request.requestHeaders.getRawHeaders('x-forwarded-for', [])
+                 for hop in header.split(',') if hop.strip()]
+    # every proxy appends the address it got the request from, so only the
+    # addresses the trusted proxies appended can be believed
+    for hop in reversed(forwarded):
+        address = hop
+        if hop not in trusted_proxies:
+            break
+    return address
+
+
+def query_cost(query_string):
+    """
+    A rough estimate of how expensive a query string is to search for: one
+    for each term, plus more for terms that have to be expanded against the
+    index's terms
+
+    @param query_string: the query string, or C{None}
+    @type query_string: C{str}
+
+    @return: C{int}
+    """
+    cost = 1
+    for word in _WORD.findall(query_string or ''):
+        # leave out the field name of field:value terms
+        term = word.split(':', 1)[-1].lstrip('+-(')
+        cost += 1
+        if term[:1] in ('*', '?'):
+            cost += LEADING_WILDCARD_COST
+        elif '*' in term or '?' in term or '~' in term or term[:1] == '/':
+            cost += EXPENSIVE_TERM_COST
+    return cost
+
+
+class TokenBucket(object):
+    """
+    Lets through C{rate} requests a second on average, and bursts of up to
+    C{burst} requests
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = now
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens +
+                           (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, now):
+        """
+        @return: C{0} if a request can go ahead, otherwise how many seconds
+            until one can
+        """
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class Gate(object):
+    """
+    Runs queries in threads, no more than C{concurrency} at a time.  Up to
+    C{max_waiting} more can wait for up to C{wait_timeout} seconds for their
+    turn - any others are rejected straight away.  Each client can make
+    C{rate} queries a second, in bursts of up to C{burst}, and no query can
+    cost more than C{max_cost} - see L{query_cost}.
+    """
+
+    # how many clients to keep track of before forgetting the one that has
+    # gone the longest without making a query
+    max_clients = 10000
+
+    def __init__(self, concurrency=10, max_waiting=20, wait_timeout=5,
+                 rate=2, burst=10, max_cost=50, clock=reactor):
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_cost = max_cost
+        self._semaphore = defer.DeferredSemaphore(concurrency)
+        # least recently used first
+        self._buckets = OrderedDict()
+        self._clock = clock
+
+    def waiting(self):
+        """
+        @return: how many queries are waiting for their turn
+        """
+        return len(self._semaphore.waiting)
+
+    def _bucket(self, client, now):
+        bucket = self._buckets.pop(client, None)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+            bucket = TokenBucket(self.rate, self.burst, now)
+        self._buckets[client] = bucket
+        return bucket
+
+    def check(self, client, cost=1):
+        """
+        Checks that a client can make a query now
+
+        @param client: the client's address, or C{None} if it is not known,
+            in which case it is not rate limited
+        @type client: C{str}
+
+        @param cost: what the query costs - see L{query_cost}
+        @type cost: C{int}
+
+        @raise Rejected: if it can't
+        """
+        if cost > self.max_cost:
+            raise Rejected(BAD_REQUEST, 'That query is too expensive - try '
+                           'it without leading wildcards, or with fewer terms')
+        if client is None:
+            return
+        wait = self._bucket(client, self._clock.seconds()).take(
+            self._clock.seconds())
+        if wait:
+            raise Rejected(TOO_MANY_REQUESTS, 'Too many requests - please '
+                           'slow down', int(math.ceil(wait)))
+
+    def _overloaded(self):
+        return Rejected(SERVICE_UNAVAILABLE, 'The logs are busy, please try '
+                        'again in a few seconds', self.wait_timeout)
+
+    def run(self, client, cost, f, *args, **kwargs):
+        """
+        Runs C{f(*args, **kwargs)} in a thread once the query is admitted
+
+        @return: a Deferred that fires with the result of C{f}, or fails with
+            L{Rejected}
+        """
+        try:
+            self.check(client, cost)
+        except Rejected as e:
+            return defer.fail(e)
+
+        semaphore = self._semaphore
+        if not semaphore.tokens and self.waiting() >= self.max_waiting:
+            return defer.fail(self._overloaded())
+
+        d = semaphore.acquire()
+        if d.called:
+            timeout = None
+        else:
+            timeout = self._clock.callLater(self.wait_timeout, d.cancel)
+
+        def _acquired(ignored):
+            if timeout is not None:
+                timeout.cancel()
+            result = threads.deferToThread(f, *args, **kwargs)
+            result.addBoth(lambda result: (semaphore.release(), result)[1])
+            return result
+
+        def _timed_out(failure):
+            failure.trap(defer.CancelledError)
+            raise self._overloaded()
+
+        d.addCallbacks(_acquired, _timed_out)
+        return d
+
+
+def get_gate():
+    """
+    @return: a L{Gate} configured by the settings
+    """
+    return Gate(
+        concurrency=getattr(settings, 'HTTP_QUERY_CONCURRENCY', 10),
+        max_waiting=getattr(settings, 'HTTP_QUERY_MAX_WAITING', 20),
+        wait_timeout=getattr(settings, 'HTTP_QUERY_WAIT_TIMEOUT', 5),
+        rate=getattr(settings, 'HTTP_QUERY_RATE', 2),
+        burst=getattr(settings, 'HTTP_QUERY_BURST', 10),
+        max_cost=getattr(settings, 'HTTP_QUERY_MAX_COST', 50))
+
+
+# the gate every web page and API query to the search index goes through
+gate = get_gate()
@@ -0,0 +1,400 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_api -*-
+
+"""
+JSON API for reading the logs, for tools that would otherwise scrape the web
+pages.  Both endpoints take these arguments:
+
+fields - comma separated fields to return for each message (defaults to all
+    of time, user, channel, event, host and message)
+from - start of the time range, in seconds since the epoch
+to - end of the time range, in seconds since the epoch
+limit - how many messages to return (defaults to 100, at most 1000)
+cursor - the C{next} value of the previous response, to get the next page
+facets - comma separated fields to count the values of, over the whole
+    (remaining) time range
+
+and respond with::
+
+    {"messages": [...], "next": cursor or null, "facets": {...}}
+
+Messages are returned oldest first.  The cursor records the time of the last
+message returned and how many messages at that time have been seen, so pages
+stay consistent as new messages are logged.
+"""
+import base64
+import json
+import time
+from datetime import date
+
+from zope.interface import implementer
+
+from twisted.internet import task
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from twisted.web.http import BAD_REQUEST, INTERNAL_SERVER_ERROR
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from elasticsearch import ESLogLine
+from elasticsearch.core import utils
+import admission
+import directory
+import assets
+import logreader
+import settings
+
+
+FIELDS = ('time', 'user', 'channel', 'event', 'host', 'message')
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# how many messages to encode before letting the reactor do something else
+_CHUNK_SIZE = 50
+
+
+def encode_cursor(last_time, skip):
+    """
+    @param last_time: the time of the last message returned
+    @type last_time: C{float}
+
+    @param skip: how many messages at C{last_time} have been returned
+    @type skip: C{int}
+
+    @return: an opaque, url safe C{str}
+    """
+    return base64.urlsafe_b64encode(json.dumps([last_time, skip]))
+
+
+def decode_cursor(cursor):
+    """
+    The inverse of L{encode_cursor}
+
+    @raise ValueError: if the cursor is not one produced by L{encode_cursor}
+    """
+    try:
+        last_time, skip = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        return float(last_time), int(skip)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('invalid cursor')
+
+
+def next_cursor(messages, limit, cursor=None):
+    """
+    The cursor for the page after C{messages}, if there may be one
+
+    @param messages: the messages returned, oldest first
+    @type messages: C{list}
+
+    @param limit: the most messages that could have been returned
+    @type limit: C{int}
+
+    @param cursor: the decoded cursor the messages were fetched with
+    @type cursor: C{tuple}
+
+    @return: C{str}, or C{None} if there are no more messages
+    """
+    if len(messages) < limit or not messages:
+        return None
+    last_time = messages[-1].time
+    skip = 0
+    for message in reversed(messages):
+        if message.time != last_time:
+            break
+        skip += 1
+    if cursor is not None and cursor[0] == last_time:
+        skip += cursor[1]
+    return encode_cursor(last_time, skip)
+
+
+@implementer(IPushProducer)
+class _CooperativeProducer(object):
+    """
+    Pauses writing a response while the client is not reading it
+    """
+    def __init__(self, cooperative_task):
+        self._task = cooperative_task
+
+    def pauseProducing(self):
+        self._task.pause()
+
+    def resumeProducing(self):
+        self._task.resume()
+
+    def stopProducing(self):
+        self._task.stop()
+
+
+def _first(request, name, default=None):
+    return request.args.get(name, [default])[0]
+
+
+def _split(value):
+    return [part for part in (value or '').split(',') if part]
+
+
+def _number(value):
+    if value:
+        return float(value)
+    return None
+
+
+def _field_value(message, field):
+    """
+    Messages read from the flat file logs have byte strings, which may not be
+    valid utf-8
+    """
+    value = getattr(message, field, None)
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class BaseAPIResource(Resource):
+    """
+    Queries messages in a thread, and streams them to the client as JSON
+    """
+    isLeaf = True
+
+    def _parse_args(self, request):
+        """
+        @return: C{dict} of the arguments common to all the API resources
+
+        @raise ValueError: if any of them are invalid
+        """
+        fields = _split(_first(request, 'fields')) or list(FIELDS)
+        facets = _split(_first(request, 'facets'))
+        for field in fields + facets:
+            if field not in FIELDS:
+                raise ValueError('unknown field %r' % (field,))
+
+        try:
+            limit = int(_first(request, 'limit', DEFAULT_LIMIT))
+            _from = _number(_first(request, 'from'))
+            _to = _number(_first(request, 'to'))
+        except ValueError:
+            raise ValueError('limit, from and to must be numbers')
+        if not 0 < limit <= MAX_LIMIT:
+            raise ValueError('limit must be between 1 and %d' % (MAX_LIMIT,))
+
+        cursor = _first(request, 'cursor')
+        if cursor:
+            cursor = decode_cursor(cursor)
+            _from = max(_from or 0, cursor[0])
+
+        return {'fields': fields, 'facets': facets, 'limit': limit,
+                'from': _from, 'to': _to, 'cursor': cursor or None}
+
+    def _range_query(self, args):
+        return utils.RawQuery({
+            "range": {"time": {"from": args['from'], "to": args['to']}}})
+
+    def queryset_from_args(self, request, args):
+        """
+        Builds an unevaluated queryset for the request - the page is sliced
+        out of it, and facets added, by L{_get_page}
+
+        @raise ValueError: if the request is invalid
+        """
+        raise NotImplementedError
+
+    def query_cost(self, request):
+        """
+        @return: the estimated cost of the request's query - see
+            L{admission.query_cost}
+        """
+        return 1
+
+    def _get_page(self, queryset, args):
+        """
+        Runs the query - this blocks, so should be run in a thread
+
+        @return: C{(messages, facets)}
+        """
+        offset = args['cursor'][1] if args['cursor'] else 0
+        if args['facets']:
+            queryset = queryset.facet(args['facets'])
+        queryset = queryset.order_by('time')[offset:offset + args['limit']]
+        messages = list(queryset)
+        facets = queryset.facets if args['facets'] else None
+        return messages, facets
+
+    def _chunks(self, messages, facets, args):
+        """
+        The response, in pieces
+        """
+        yield '{"messages": ['
+        fields = args['fields']
+        for i in xrange(0, len(messages), _CHUNK_SIZE):
+            rows = [json.dumps(dict((field, _field_value(message, field))
+                                    for field in fields))
+                    for message in messages[i:i + _CHUNK_SIZE]]
+            yield '%s%s' % (',' if i else '', ','.join(rows))
+        yield '], "next": %s' % (json.dumps(
+            next_cursor(messages, args['limit'], args['cursor'])),)
+        if facets is not None:
+            yield ', "facets": %s' % (json.dumps(facets),)
+        yield '}'
+
+    def _stream(self, page, request, args, disconnected):
+        """
+        Writes the response a piece at a time, pausing while the client is
+        not reading - unless the client has already gone away
+        """
+        if disconnected:
+            return None
+        messages, facets = page
+
+        def _write():
+            for chunk in self._chunks(messages, facets, args):
+                request.write(chunk)
+                yield None
+
+        cooperative_task = task.cooperate(_write())
+        request.registerProducer(_CooperativeProducer(cooperative_task), True)
+        d = cooperative_task.whenDone()
+        d.addBoth(self._unregister, request, disconnected)
+        return d
+
+    def _unregister(self, result, request, disconnected):
+        if not disconnected:
+            request.unregisterProducer()
+        return result
+
+    def _finish(self, ignored, request, disconnected):
+        if not disconnected:
+            request.finish()
+
+    def _error(self, request, code, message):
+        request.setResponseCode(code)
+        return json.dumps({'error': message})
+
+    def _failed(self, failure, request, disconnected):
+        if failure.check(task.TaskStopped):
+            # the client went away
+            return
+        if failure.check(admission.Rejected):
+            if not disconnected:
+                request.write(json.dumps(
+                    {'error': failure.value.respond(request)}))
+                request.finish()
+            return
+        log.err(failure, 'API request %s failed' % (request.uri,))
+        if disconnected:
+            return
+        if not request.startedWriting:
+            request.write(self._error(request, INTERNAL_SERVER_ERROR,
+                                      'the query failed'))
+        request.finish()
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        try:
+            args = self._parse_args(request)
+            queryset = self.queryset_from_args(request, args)
+        except ValueError as e:
+            return self._error(request, BAD_REQUEST, str(e))
+
+        # the request can't be written to, or finished, once the client has
+        # gone away
+        disconnected = []
+        request.notifyFinish().addErrback(disconnected.append)
+
+        d = admission.gate.run(admission.client_address(request),
+                               self.query_cost(request),
+                               self._get_page, queryset, args)
+        d.addCallback(self._stream, request, args, disconnected)
+        d.addCallbacks(self._finish, self._failed,
+                       callbackArgs=(request, disconnected),
+                       errbackArgs=(request, disconnected))
+        return NOT_DONE_YET
+
+
+class MessagesResource(BaseAPIResource):
+    """
+    The messages of a channel in a time range.  As well as the common
+    arguments, expects:
+
+    channel - which channel (defaults to the first logged channel)
+    user - only messages from this user
+
+    If C{from} is not given, it defaults to midnight today.  The messages are
+    read from the flat file logs if elasticsearch is unavailable.
+    """
+
+    def queryset_from_args(self, request, args):
+        channel = _first(request, 'channel') or directory.default_channel()
+        if channel is None:
+            raise ValueError('channel is required')
+        args['channel'] = channel
+        args['user'] = _first(request, 'user')
+        if args['from'] is None:
+            args['from'] = time.mktime(date.today().timetuple())
+
+        queries = [utils.TermQuery('channel', channel.lstrip('#')),
+                   self._range_query(args)]
+        if args['user']:
+            queries.append(utils.TermQuery('user', args['user']))
+        return ESLogLine.objects._get_queryset(queries)
+
+    def _get_page(self, queryset, args):
+        # finding out whether elasticsearch is available can block for as
+        # long as it takes to time out, so it is only done in the thread
+        if not ESLogLine.objects.is_available():
+            queryset = logreader.FlatFileQueryset(
+                settings.LOG_FILE_PATH, args['channel'], args['from'],
+                args['to'])
+            if args['user']:
+                queryset = queryset.filter(user=args['user'])
+        return BaseAPIResource._get_page(self, queryset, args)
+
+
+class SearchResource(BaseAPIResource):
+    """
+    Full text search over all the logs.  As well as the common arguments,
+    expects:
+
+    q - the query string to search for
+    channel - only messages in this channel
+    user - only messages from this user
+    """
+
+    def queryset_from_args(self, request, args):
+        terms = {}
+        for name in ('channel', 'user'):
+            value = _first(request, name)
+            if value:
+                terms[name] = value.lstrip('#')
+        query_string = _first(request, 'q')
+        if not query_string and not terms:
+            raise ValueError('q, channel or user is required')
+        queries = utils.parse_query(query_string, **terms)
+        if args['from'] is not None or args['to'] is not None:
+            queries.append(self._range_query(args))
+        return ESLogLine.objects._get_queryset(queries)
+
+    def query_cost(self, request):
+        return admission.query_cost(_first(request, 'q'))
+
+
+class APIResource(Resource):
+    """
+    Root of the JSON API
+    """
+    def __init__(self):
+        Resource.__init__(self)
+        self.putChild('messages', assets.gzipped(MessagesResource()))
+        self.putChild('search', assets.gzipped(SearchResource()))
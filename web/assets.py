@@ -0,0 +1,165 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_assets -*-
+
+"""
+Response compression, and the static media (css, javascript and images),
+which are loaded and compressed once at startup and served under urls
+containing a hash of their content, so they can be cached forever.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from cStringIO import StringIO
+
+from twisted.web import http
+from twisted.web.resource import EncodingResourceWrapper, NoResource, Resource
+from twisted.web.server import GzipEncoderFactory
+
+
+# the types worth compressing - images are compressed already
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript',
+                       'application/x-javascript', 'application/json',
+                       'image/svg+xml')
+
+# how long assets requested by their hashed url can be cached for
+_IMMUTABLE_MAX_AGE = 365 * 86400
+
+# how long assets requested without (or with an out of date) hash can be
+# cached for
+_MAX_AGE = 3600
+
+
+def gzipped(resource):
+    """
+    Wrap a resource so that its responses are gzipped for clients that accept
+    gzip.  Children of the resource are not wrapped.
+    """
+    return EncodingResourceWrapper(resource, [GzipEncoderFactory()])
+
+
+def _accepts_gzip(request):
+    return 'gzip' in (request.getHeader('accept-encoding') or '')
+
+
+def _gzip(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+class Asset(object):
+    """
+    A static file, loaded into memory
+
+    @ivar digest: short hash of the content
+    @ivar content_type: the MIME type
+    @ivar data: the content
+    @ivar compressed: the gzipped content, or C{None} if it is not worth
+        compressing
+    """
+
+    def __init__(self, data, content_type):
+        self.data = data
+        self.content_type = content_type
+        self.digest = hashlib.md5(data).hexdigest()[:12]
+        self.compressed = None
+        if content_type.startswith(_COMPRESSIBLE_TYPES):
+            compressed = _gzip(data)
+            if len(compressed) < len(data):
+                self.compressed = compressed
+
+
+class MediaResource(Resource):
+    """
+    Serves the static media in a directory.  A file at C{css/site.css} is
+    served at both C{/media/css/site.css} and C{/media/<digest>/css/site.css},
+    where digest is a hash of its content - see L{url}.  The hashed url
+    changes whenever the file does, so it is cached forever, while the plain
+    url is only cached for a while.
+    """
+    isLeaf = True
+
+    def __init__(self, directory, prefix='/media'):
+        """
+        @param directory: the directory of media files
+        @type directory: C{str}
+
+        @param prefix: the url the resource is at
+        @type prefix: C{str}
+        """
+        Resource.__init__(self)
+        self._prefix = prefix
+        self._assets = {}
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, directory).replace(
+                    os.sep, '/')
+                content_type = (mimetypes.guess_type(name)[0] or
+                                'application/octet-stream')
+                with open(path, 'rb') as f:
+                    self._assets[relative] = Asset(f.read(), content_type)
+
+    def url(self, path):
+        """
+        The hashed url of a media file, given its plain url
+
+        @param path: the url of the file, for instance
+            C{/media/css/site.css}, or the path relative to the media
+            directory
+        @type path: C{str}
+
+        @return: C{str} - the hashed url, or C{path} if it is not a media file
+        """
+        relative = path
+        if path.startswith(self._prefix + '/'):
+            relative = path[len(self._prefix) + 1:]
+        asset = self._assets.get(relative)
+        if asset is None:
+            return path
+        return '%s/%s/%s' % (self._prefix, asset.digest, relative)
+
+    def render_GET(self, request):
+        segments = request.postpath
+        immutable = False
+        asset = self._assets.get('/'.join(segments))
+        if asset is None and len(segments) > 1:
+            asset = self._assets.get('/'.join(segments[1:]))
+            immutable = asset is not None and asset.digest == segments[0]
+        if asset is None:
+            return NoResource().render(request)
+
+        request.setHeader('content-type', asset.content_type)
+        request.setHeader('cache-control', 'public, max-age=%d%s' % (
+            (_IMMUTABLE_MAX_AGE, ', immutable') if immutable
+            else (_MAX_AGE, '')))
+        if request.setETag('"%s"' % (asset.digest,)) == http.CACHED:
+            return ''
+
+        data = asset.data
+        if asset.compressed is not None:
+            request.setHeader('vary', 'Accept-Encoding')
+            if _accepts_gzip(request):
+                request.setHeader('content-encoding', 'gzip')
+                data = asset.compressed
+        return data
+
+
+# the media of the web interface, shared by the resource serving them and the
+# templates linking to them
+media = MediaResource(os.path.join(os.path.dirname(__file__), 'media'))
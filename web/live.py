@@ -0,0 +1,90 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_live -*-
+
+"""
+Server-Sent Events stream of a channel's new messages, fed straight from the
+bot through L{pubsub.hub}
+"""
+from twisted.internet import reactor, task
+from twisted.web.http import BAD_REQUEST
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+import directory
+import pubsub
+import settings
+
+
+class LiveResource(Resource):
+    """
+    Streams the events of a channel, as they are logged, as Server-Sent
+    Events.  Expected arguments are:
+
+    channel - which channel to stream (defaults to the first logged channel,
+        see L{directory.default_channel})
+
+    Each message is sent as a C{message} event whose data is the JSON of the
+    message, as it is indexed.  If the client falls too far behind, the oldest
+    messages are dropped and a C{dropped} event says how many.
+
+    @cvar keepalive: seconds between comments sent to keep idle connections
+        (and any proxies in the way) open
+    """
+    isLeaf = True
+    keepalive = 15
+
+    def __init__(self, hub=None, clock=reactor):
+        Resource.__init__(self)
+        self._hub = hub or pubsub.hub
+        self._clock = clock
+
+    def _send(self, request, subscription, event):
+        dropped = subscription.take_dropped()
+        if dropped:
+            request.write('event: dropped\ndata: %d\n\n' % (dropped,))
+        data = event.json
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        request.write('data: %s\n\n' % (data,))
+
+    def render_GET(self, request):
+        channel = (request.args.get('channel', [None])[0] or
+                   directory.default_channel())
+        if not channel:
+            request.setResponseCode(BAD_REQUEST)
+            request.setHeader('content-type', 'text/plain')
+            return 'channel is required'
+        request.setHeader('content-type', 'text/event-stream')
+        request.setHeader('cache-control', 'no-cache')
+        # ask proxies not to buffer the stream
+        request.setHeader('x-accel-buffering', 'no')
+
+        subscription = self._hub.subscribe(
+            channel, lambda event: self._send(request, subscription, event),
+            getattr(settings, 'LIVE_MAX_QUEUED', 100))
+        request.registerProducer(subscription, True)
+
+        # tell the client how soon to reconnect if the stream is cut off
+        request.write('retry: 3000\n\n')
+        keepalive = task.LoopingCall(request.write, ':\n\n')
+        keepalive.clock = self._clock
+        keepalive.start(self.keepalive, now=False)
+
+        def _finished(ignored):
+            self._hub.unsubscribe(subscription)
+            keepalive.stop()
+
+        request.notifyFinish().addBoth(_finished)
+        return NOT_DONE_YET
@@ -0,0 +1,37 @@
+/* Appends new messages to the log page as they are logged, using the
+ * Server-Sent Events stream at the url in the messages' data-live-url */
+$(function () {
+  var messages = $('#messages'),
+      url = messages.attr('data-live-url');
+  if (!url || !window.EventSource) {
+    return;
+  }
+
+  function pad(n) {
+    return (n < 10 ? '0' : '') + n;
+  }
+
+  function formatTime(seconds) {
+    var d = new Date(seconds * 1000);
+    return pad(d.getMonth() + 1) + '/' + pad(d.getDate()) + '/' +
+      d.getFullYear() + ' ' + pad(d.getHours()) + ':' +
+      pad(d.getMinutes()) + ':' + pad(d.getSeconds());
+  }
+
+  function cell(cls, text) {
+    return $('<div/>').addClass(cls).text(text || '');
+  }
+
+  new EventSource(url).onmessage = function (e) {
+    var msg = JSON.parse(e.data);
+    $('<div class="irc_message row-fluid"/>')
+      .append(cell('irc_channel span2', '[' + msg.channel + ']'))
+      .append(cell('irc_username span2')
+        .append($('<span class="bracket">&lt;</span>'))
+        .append(document.createTextNode(msg.user || ''))
+        .append($('<span class="bracket">&gt;</span>')))
+      .append(cell('irc_text span4', msg.message))
+      .append(cell('irc_time span2', formatTime(msg.time)))
+      .appendTo(messages);
+  };
+});
@@ -0,0 +1,217 @@
+# Copyright 2012 Rackspace
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# -*- test-case-name: slogger.test.test_pagecache -*-
+
+"""
+An on-disk cache of the pre-rendered, gzipped log pages of channel days that
+are over, which never change once they have been rendered.
+"""
+import gzip
+import os
+import time
+import urllib
+from datetime import date, timedelta
+
+from twisted.application import service
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+
+import settings
+
+
+def day_range(day):
+    """
+    The canonical time range of a day's log page
+
+    @param day: the day
+    @type day: C{datetime.date}
+
+    @return: C{(start, end)} in whole seconds since the epoch - midnight at
+        the start of the day, and the last second of the day
+    """
+    start = int(time.mktime(day.timetuple()))
+    end = int(time.mktime((day + timedelta(days=1)).timetuple())) - 1
+    return start, end
+
+
+def day_from_range(_from, _to):
+    """
+    The day whose canonical range, as per L{day_range}, is C{_from} to C{_to}
+
+    @return: C{datetime.date}, or C{None} if the range is not exactly a day
+    """
+    try:
+        _from, _to = float(_from), float(_to)
+    except (TypeError, ValueError):
+        return None
+    day = date.fromtimestamp(_from)
+    if day_range(day) != (_from, _to):
+        return None
+    return day
+
+
+class PageCache(object):
+    """
+    A directory of gzipped pages, one per channel and day, laid out as
+    C{<directory>/<quoted channel>/<YYYY-MM-DD>.html.gz}
+    """
+
+    def __init__(self, directory):
+        """
+        @param directory: the directory to keep the pages in
+        @type directory: C{str}
+        """
+        self._directory = directory
+
+    def path(self, channel, day):
+        """
+        The path of the page for a channel's day, whether or not it exists
+        """
+        return os.path.join(self._directory, urllib.quote(channel, ''),
+                            '%s.html.gz' % (day.isoformat(),))
+
+    def get(self, channel, day):
+        """
+        @return: the path of the page for a channel's day, or C{None} if it has
+            not been rendered
+        """
+        path = self.path(channel, day)
+        if os.path.exists(path):
+            return path
+        return None
+
+    def store(self, channel, day, page):
+        """
+        Gzip and store the page for a channel's day.  The file is written
+        under a temporary name and moved into place, so it is never served
+        half written.  This blocks, so should be run in a thread.
+
+        @param page: the rendered page
+        @type page: C{str}
+        """
+        path = self.path(channel, day)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        f = gzip.open(temporary, 'wb')
+        try:
+            f.write(page)
+        finally:
+            f.close()
+        os.rename(temporary, path)
+
+    def invalidate(self, channel, day):
+        """
+        Remove the page for a channel's day, if there is one
+        """
+        try:
+            os.remove(self.path(channel, day))
+        except OSError:
+            pass
+
+
+def get_page_cache():
+    """
+    @return: the L{PageCache} in settings.PAGE_CACHE_PATH, or C{None} if the
+        page cache is switched off
+    """
+    directory = getattr(settings, 'PAGE_CACHE_PATH', None)
+    if directory:
+        return PageCache(directory)
+    return None
+
+
+class DayPageRenderer(service.Service):
+    """
+    Renders the pages of each channel's previous day into the page cache,
+    shortly after midnight every day (and once on startup, in case the last
+    midnight was missed).
+
+    @ivar delay: how many seconds after midnight to render, to leave time for
+        buffered messages to reach the search index
+    """
+    delay = 300
+
+    def __init__(self, cache, render, channels, clock=reactor):
+        """
+        @param cache: where to store the pages
+        @type cache: L{PageCache}
+
+        @param render: callable taking a channel and a C{datetime.date}, and
+            returning a Deferred that fires with the page for that day
+        @type render: C{callable}
+
+        @param channels: callable returning the channels to render pages
+            for, such as L{directory.Directory.channels}
+        @type channels: C{callable}
+        """
+        self._cache = cache
+        self._render = render
+        self._channels = channels
+        self._clock = clock
+        self._call = None
+        self._rendering = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self._render_yesterday()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _schedule(self):
+        """
+        Schedule the next run for just after the coming midnight
+        """
+        tomorrow = date.fromtimestamp(self._clock.seconds()) + timedelta(1)
+        when = time.mktime(tomorrow.timetuple()) + self.delay
+        self._call = self._clock.callLater(
+            max(when - self._clock.seconds(), 0), self._render_yesterday)
+
+    def _render_yesterday(self):
+        if self.running:
+            self._schedule()
+        self._rendering = self._render_days(
+            date.fromtimestamp(self._clock.seconds()) - timedelta(1))
+
+    @defer.inlineCallbacks
+    def _render_days(self, day):
+        """
+        Render, one after the other, the pages for the day that have not been
+        rendered yet
+        """
+        for channel in self._channels():
+            if self._cache.get(channel, day) is not None:
+                continue
+            try:
+                yield self.render_day(channel, day)
+            except Exception:
+                log.err(None, 'Rendering the %s page for %s failed' % (
+                    day, channel))
+
+    def render_day(self, channel, day):
+        """
+        Render the page for a channel's day and store it in the cache
+
+        @return: a Deferred that fires when the page has been stored
+        """
+        d = self._render(channel, day)
+        d.addCallback(lambda page: threads.deferToThread(
+            self._cache.store, channel, day, page))
+        return d
+
@@ -1,5 +1,14 @@
+import os
+
 from twisted.web.template import XMLFile
 
+_TEMPLATE_DIR = './web/templates'
+
+# changes whenever the templates do, so that cached pages are not reused
+# after a change to the way they look
+VERSION = str(max(os.path.getmtime(os.path.join(_TEMPLATE_DIR, name))
+                  for name in os.listdir(_TEMPLATE_DIR)))
+
 INDEX_LOADER = XMLFile('./web/templates/index.xml')
 SEARCH_LOADER = XMLFile('./web/templates/search.xml')
 LOG_LOADER = XMLFile('./web/templates/log.xml')
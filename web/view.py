@@ -11,18 +11,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import math
 import time
-from datetime import date
+from datetime import date, timedelta
 import urllib
+import weakref
 
+from zope.interface import implementer
+
+from twisted.internet import defer, threads
+from twisted.internet.error import ConnectionLost
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from twisted.web import http, static
+from twisted.web.http import INTERNAL_SERVER_ERROR
 from twisted.web.resource import NoResource, Resource
 from twisted.web.server import NOT_DONE_YET
-from twisted.web.template import Element, renderer, flattenString, TagLoader
+from twisted.web.template import (Element, renderer, flatten, flattenString,
+                                  TagLoader)
 
 from elasticsearch import ESLogLine
 from elasticsearch.core import utils
+import directory
+import history
+import logreader
 import settings
 import templates
+import pagecache
+import admission
+import api
+import assets
+import live
 
 
 def _get_url_from_request(request, replacement_args=None):
@@ -57,6 +77,18 @@ def _get_url_from_request(request, replacement_args=None):
         '/'.join(request.prepath), urllib.urlencode(newargs, True))
 
 
+def _evaluate(queryset):
+    """
+    Forces a queryset to run its query (and compute its facets), so that
+    rendering it later doesn't block.  This blocks, so should be run in a
+    thread.
+
+    @return: the queryset
+    """
+    queryset.count()
+    return queryset
+
+
 class ChannelList_Mixin(object):
     """
     Mixin to let Elements render channels
@@ -79,6 +111,23 @@ class ChannelList_Mixin(object):
                 channel_url=self.get_channel_url(request, channel_name))
 
 
+def _day_links(request):
+    """
+    @return: C{list} of C{(label, day)} for the days before and after the one
+        a request is for - there is no link to the next day until the day
+        after it is over
+    """
+    _from = request.args.get('from', [None])[0]
+    try:
+        day = date.fromtimestamp(float(_from))
+    except (TypeError, ValueError):
+        day = date.today()
+    links = [('previous day', day - timedelta(days=1))]
+    if day + timedelta(days=1) < date.today():
+        links.append(('next day', day + timedelta(days=1)))
+    return links
+
+
 class FacetedMessageElement(Element, ChannelList_Mixin):
     """
     Element that contains displays message information that is faceted
@@ -95,14 +144,21 @@ class FacetedMessageElement(Element, ChannelList_Mixin):
         super(FacetedMessageElement, self).__init__(loader)
         self._queryset = queryset
         print 'results: %d' % (self._queryset.count(),)
-        self._channels = []
-        for item in self._queryset.facets.get('channel', []):
-            # TODO: filter out system logs elsewhere
-            channel_name = item[0]
-            if channel_name != 'system_log':
-                self._channels.append(channel_name)
-        self._user_names = [
-            item[0] for item in self._queryset.facets.get('user', [])]
+        facets = self._queryset.facets or {}
+        # channels and users are only faceted on to refine search results -
+        # otherwise they come from the directory
+        if 'channel' in facets:
+            self._channels = []
+            for item in facets['channel']:
+                # TODO: filter out system logs elsewhere
+                channel_name = item[0]
+                if channel_name != 'system_log':
+                    self._channels.append(channel_name)
+        else:
+            self._channels = directory.directory.channels()
+        self._user_names = None
+        if 'user' in facets:
+            self._user_names = [item[0] for item in facets['user']]
 
     @renderer
     def messages(self, request, tag):
@@ -110,7 +166,13 @@ class FacetedMessageElement(Element, ChannelList_Mixin):
         Renderer to render an ElasticsearchQueryset representing a set of irc
         messages to the template
         """
-        for msg in self._queryset:
+        producer = _render_producers.get(request)
+        for i, msg in enumerate(self._queryset):
+            # let the client catch up every so often
+            if producer is not None and i % 100 == 99:
+                d = producer.wait()
+                if d is not None:
+                    yield d
             # TODO: filter out system messages elsewhere
             if msg.channel.startswith('#'):
                 yield tag.clone().fillSlots(
@@ -120,6 +182,34 @@ class FacetedMessageElement(Element, ChannelList_Mixin):
                                        time.localtime(msg.time)),
                     text=msg.message)
 
+    @renderer
+    def dates(self, request, tag):
+        """
+        Renderer for links to the days before and after the one being shown,
+        and to today
+        """
+        for label, other_day in _day_links(request):
+            start, end = pagecache.day_range(other_day)
+            yield tag.clone().fillSlots(
+                date=label,
+                date_url=_get_url_from_request(
+                    request, {'from': str(start), 'to': str(end)}))
+        yield tag.clone().fillSlots(
+            date='today',
+            date_url=_get_url_from_request(request, {'from': [], 'to': []}))
+
+    @renderer
+    def live(self, request, tag):
+        """
+        Renderer for the url to stream new messages from, if the page shows
+        the channel's latest messages
+        """
+        channel = request.args.get('channel', [None])[0]
+        if not channel or request.args.get('to', [None])[0]:
+            return tag
+        return tag(**{'data-live-url': '/live?%s' % (
+            urllib.urlencode({'channel': channel}),)})
+
     faceted_channels = ChannelList_Mixin.channels.im_func
 
     @renderer
@@ -128,7 +218,13 @@ class FacetedMessageElement(Element, ChannelList_Mixin):
         Renderer to render an ElasticsearchQueryset channel user to the
         template
         """
-        for name in self._user_names:
+        user_names = self._user_names
+        if user_names is None:
+            channel = (request.args.get('channel', [None])[0] or
+                       directory.default_channel())
+            user_names = [name for name, last_seen
+                          in directory.directory.users(channel or '')]
+        for name in user_names:
             yield tag.clone().fillSlots(
                 user_name=name,
                 user_url=_get_url_from_request(request, {'user': [name]}))
@@ -139,7 +235,7 @@ class FacetedMessageElement(Element, ChannelList_Mixin):
         if not channel:
             channel = self._queryset.facets.get('channel', [None])[0]
         if not channel:
-            channel = settings.IRC_CHANNELS[0]
+            channel = directory.default_channel()
         if channel:
             return tag(channel)
         return tag
@@ -159,7 +255,7 @@ class NavElement(Element, ChannelList_Mixin):
     def __init__(self, loader, isHome=True):
         super(NavElement, self).__init__(loader)
         self._isHome = isHome
-        self._channels = settings.IRC_CHANNELS
+        self._channels = directory.directory.channels()
 
     @renderer
     def home_is_active(self, request, tag):
@@ -187,6 +283,17 @@ class IndexElement(Element, ChannelList_Mixin):
     def navbar(self, request, tag):
         return NavElement(TagLoader(tag))
 
+    @renderer
+    def asset(self, request, tag):
+        """
+        Renderer to link to the hashed, cacheable url of a media file
+        """
+        for attribute in ('href', 'src'):
+            if attribute in tag.attributes:
+                tag.attributes[attribute] = assets.media.url(
+                    tag.attributes[attribute])
+        return tag
+
     @renderer
     def container(self, request, tag):
         if request.prepath == ['search']:
@@ -198,30 +305,121 @@ class IndexElement(Element, ChannelList_Mixin):
         return tag
 
 
+@implementer(IPushProducer)
+class _RenderProducer(object):
+    """
+    Registered with a request while a page is streamed to it, so that
+    rendering can be paused while the client is not keeping up, rather than
+    the rest of the page piling up in memory.
+    """
+    def __init__(self):
+        self._paused = None
+        self.stopped = False
+
+    def pauseProducing(self):
+        if self._paused is None:
+            self._paused = defer.Deferred()
+
+    def resumeProducing(self):
+        paused, self._paused = self._paused, None
+        if paused is not None:
+            paused.callback('')
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+    def wait(self):
+        """
+        @return: C{None} if rendering can go on, otherwise a Deferred that
+            fires (with an empty string, so it can be flattened) when it can
+            go on, or fails if the client has gone away
+        """
+        if self.stopped:
+            return defer.fail(ConnectionLost())
+        if self._paused is not None:
+            d = defer.Deferred()
+            self._paused.addCallback(lambda _: d.callback(''))
+            return d
+        return None
+
+
+# the producers of the requests currently being streamed to
+_render_producers = weakref.WeakKeyDictionary()
+
+
+class _PageRequest(object):
+    """
+    Stands in for a request when a page is rendered for the page cache - only
+    the attributes the renderers use are needed
+    """
+    prepath = ['']
+
+    def __init__(self, args):
+        self.args = args
+
+
 class BaseElementRendererResource(Resource):
     """
-    Resource to render an element
+    Resource to render an element.  The page is written to the request as it
+    is rendered, so the client starts receiving it (with chunked transfer
+    encoding) straight away.
     """
-    def _finish_request(self, output, request):
+    def _finish_request(self, ignored, request, producer):
         """
-        Finishes writing the output to the request and terminates the request
+        Terminates the request, unless the client has already gone away
         """
-        if output:
-            request.write(output)
+        if producer.stopped:
+            return
+        request.unregisterProducer()
         request.finish()
 
-    def render_GET(self, request):
+    def _render_error(self, failure, request, producer):
         """
-        Renders self.element
+        Logs a failure to query or render, and tells the client about it if it
+        is still there.  Queries turned away by L{admission.gate} are not
+        logged.
         """
+        if producer.stopped:
+            return
+        request.unregisterProducer()
+        if failure.check(admission.Rejected):
+            request.write(failure.value.respond(request))
+            request.finish()
+            return
+        log.err(failure, 'Rendering %s failed' % (request.uri,))
+        if not request.startedWriting:
+            request.setResponseCode(INTERNAL_SERVER_ERROR)
+            request.write('Something went wrong, please try again later')
+        request.finish()
+
+    def _stream(self, element, request, producer):
+        """
+        Flattens the element straight into the request
+        """
+        _render_producers[request] = producer
         request.write('<!DOCTYPE html>\n')
-        d = flattenString(request, self.element_from_request(request))
-        d.addCallback(self._finish_request, request)
+        return flatten(request, element, request.write)
+
+    def render_GET(self, request):
+        """
+        Renders the element produced by L{element_from_request}, which may be
+        a Deferred
+        """
+        producer = _RenderProducer()
+        request.registerProducer(producer, True)
+        request.notifyFinish().addErrback(lambda _: producer.stopProducing())
+
+        d = defer.maybeDeferred(self.element_from_request, request)
+        d.addCallback(self._stream, request, producer)
+        d.addCallbacks(self._finish_request, self._render_error,
+                       callbackArgs=(request, producer),
+                       errbackArgs=(request, producer))
         return NOT_DONE_YET
 
     def element_from_request(self, request):
         """
-        Produces en element to be rendered
+        Produces en element to be rendered, or a Deferred that fires with one
         """
         raise NotImplementedError
 
@@ -231,24 +429,210 @@ class LogsResource(BaseElementRendererResource):
     Resource to display the Slogger flat file logs.  Expected arguments are:
 
     channel - which channel to display
+    from - start of the time range to display, in seconds since the epoch
+        (defaults to midnight today)
+    to - end of the time range to display, in seconds since the epoch
 
     If more than one value is provided for either of these argument names, only
     the first one will be used.
+
+    The logs are fetched from elasticsearch, unless it is unavailable, in which
+    case they are read from the flat file logs.  Whole days that are over are
+    served from the page cache, if they have been pre-rendered.
+
+    @cvar page_cache: the page cache, or C{None} if it is switched off
+    @type page_cache: L{pagecache.PageCache}
     """
+    page_cache = pagecache.get_page_cache()
 
-    def element_from_request(self, request):
+    def _args_from_request(self, request):
         """
+        @return: C{(channel, from, to)} - the range ends are strings as given
+            in the request, except that a missing C{from} is midnight today,
+            and the channel is C{None} if none was given and there is no
+            default channel
         """
-        channel = request.args.get('channel', settings.IRC_CHANNELS)[0]
+        channel = (request.args.get('channel', [None])[0] or
+                   directory.default_channel())
         _from = request.args.get('from', [None])[0]
         if not _from:
             # TODO: the midnight time should be cached
             _from = time.mktime(date.today().timetuple())
         _to = request.args.get('to', [None])[0]
+        return channel, _from, _to
 
+    def _closed_range_end(self, _to):
+        """
+        @return: the end of the time range as a C{float} if it is before
+            today, in which case no more messages can be logged in it and the
+            page will never change, otherwise C{None}
+        """
+        try:
+            _to = float(_to)
+        except (TypeError, ValueError):
+            return None
+        if _to < time.mktime(date.today().timetuple()):
+            return _to
+        return None
+
+    def _page_state(self, request, channel):
+        """
+        What a page for a closed range shows besides its messages, which can
+        change after the range is over: the known channels, the channel's
+        active users and the links to other days
+
+        @return: C{(state, last modified)} - C{state} is a C{tuple}, and
+            C{last modified} the last time it may have changed: when a
+            message was last logged in any of the channels, or the link to
+            the next day appeared
+        """
+        channels = directory.directory.channels()
+        users = [name for name, last_seen
+                 in directory.directory.users(channel or '')]
+        links = _day_links(request)
+        changed = [directory.directory.channel_last_seen(name)
+                   for name in channels]
+        for label, day in links:
+            if label == 'next day':
+                changed.append(time.mktime(
+                    (day + timedelta(days=1)).timetuple()))
+        return ((channels, users, [label for label, day in links]),
+                max(changed or [None]))
+
+    def _set_cache_headers(self, request):
+        """
+        Lets browsers and proxies cache the page - for longer if it is for a
+        closed time range, in which case conditional requests are also
+        answered, or only briefly if messages may still be added to it.  The
+        messages of a closed range never change, but the channels, users and
+        links around them can, so they are part of its validators.
+
+        @return: L{http.CACHED} if the client already has the page
+        """
+        channel, _from, _to = self._args_from_request(request)
+        end = self._closed_range_end(_to)
+        if end is None:
+            request.setHeader('cache-control', 'public, max-age=%d' % (
+                getattr(settings, 'HTTP_OPEN_RANGE_MAX_AGE', 30),))
+            return None
+
+        request.setHeader('cache-control', 'public, max-age=%d' % (
+            getattr(settings, 'HTTP_CLOSED_RANGE_MAX_AGE', 3600),))
+        # whole days may be served gzipped from the page cache
+        request.setHeader('vary', 'Accept-Encoding')
+        state, changed = self._page_state(request, channel)
+        etag = '"%s"' % (hashlib.md5(repr((
+            channel, str(_from), str(_to), templates.VERSION,
+            state))).hexdigest(),)
+        if request.setETag(etag) == http.CACHED:
+            return http.CACHED
+        last_modified = int(math.ceil(max(end, changed)))
+        if request.getHeader('if-none-match') is not None:
+            # If-None-Match takes precedence over If-Modified-Since
+            request.setHeader('last-modified',
+                              http.datetimeToString(last_modified))
+            return None
+        return request.setLastModified(last_modified)
+
+    def cached_page(self, request):
+        """
+        @return: the path of the pre-rendered, gzipped page for the request,
+            if it is for a whole day that has been rendered and the client
+            accepts gzip, otherwise C{None}
+        """
+        if self.page_cache is None:
+            return None
+        if not set(request.args) == set(['channel', 'from', 'to']):
+            return None
+        if 'gzip' not in (request.getHeader('accept-encoding') or ''):
+            return None
+        channel, _from, _to = self._args_from_request(request)
+        day = pagecache.day_from_range(_from, _to)
+        if day is None or day >= date.today():
+            return None
+        return self.page_cache.get(channel, day)
+
+    def render_GET(self, request):
+        """
+        Only renders the page if the client does not already have it cached,
+        and serves it from the page cache if it has been pre-rendered
+        """
+        if self._args_from_request(request)[0] is None:
+            request.setResponseCode(http.BAD_REQUEST)
+            return 'channel is required'
+        if self._set_cache_headers(request) == http.CACHED:
+            return ''
+        path = self.cached_page(request)
+        if path is not None:
+            return static.File(path).render_GET(request)
+        return BaseElementRendererResource.render_GET(self, request)
+
+    def render_day(self, channel, day):
+        """
+        Render the page for a whole day of a channel, as it would be served
+        for the day's canonical range - see L{pagecache.day_range}
+
+        @return: a Deferred that fires with the page
+        """
+        start, end = pagecache.day_range(day)
+        request = _PageRequest({'channel': [channel], 'from': [str(start)],
+                                'to': [str(end)]})
+        d = threads.deferToThread(self._get_queryset, channel, start, end)
+        d.addCallback(lambda queryset: flattenString(
+            request, IndexElement(templates.INDEX_LOADER, queryset)))
+        d.addCallback(lambda page: '<!DOCTYPE html>\n' + page)
+        return d
+
+    def element_from_request(self, request):
+        """
+        Reads the logs from the bot's recent history if it has all of them,
+        otherwise queries for them in a thread, so as not to block the
+        reactor, once L{admission.gate} lets the query through
+        """
+        channel, _from, _to = self._args_from_request(request)
+
+        queryset = self._history_queryset(channel, _from, _to)
+        if queryset is not None:
+            return IndexElement(templates.INDEX_LOADER, queryset)
+
+        d = admission.gate.run(admission.client_address(request), 1,
+                               self._get_queryset, channel, _from, _to)
+        d.addCallback(lambda queryset: IndexElement(
+            templates.INDEX_LOADER, queryset))
+        return d
+
+    def _history_queryset(self, channel, _from, _to):
+        """
+        @return: a queryset over the bot's recent history of the channel, or
+            C{None} if the time range reaches back further than it does
+        """
+        try:
+            _from = float(_from)
+            _to = _to and float(_to)
+        except ValueError:
+            return None
+        queryset = history.history.queryset(channel, _from, _to)
+        if queryset is None:
+            return None
+        return queryset.order_by('time')
+
+    def _get_queryset(self, channel, _from, _to):
+        """
+        Builds and evaluates the queryset - this blocks, so should be run in a
+        thread
+        """
+        if ESLogLine.objects.is_available():
+            queryset = self._es_queryset(channel, _from, _to)
+        else:
+            queryset = logreader.FlatFileQueryset(
+                settings.LOG_FILE_PATH, channel, float(_from),
+                _to and float(_to))
+        return _evaluate(queryset.order_by('time'))
+
+    def _es_queryset(self, channel, _from, _to):
         # this is pretty awful - but I don't know how to otherwise get a
         # range query
-        queryset = ESLogLine.objects._get_queryset([
+        return ESLogLine.objects._get_queryset([
             utils.RawQuery({
                 "query": {
                     "term": {"channel": channel.lstrip('#')}  # NOOOOOOOO
@@ -264,10 +648,6 @@ class LogsResource(BaseElementRendererResource):
             })
         ])
 
-        return IndexElement(
-            templates.INDEX_LOADER,
-            queryset.facet('user').order_by('time'))
-
 
 class SearchResource(BaseElementRendererResource):
     """
@@ -284,7 +664,7 @@ class SearchResource(BaseElementRendererResource):
     def element_from_request(self, request):
         """
         Identify the desired arguments (search string and channel name) and
-        query ES
+        query ES in a thread, once L{admission.gate} lets the query through
         """
         kwargs = {}
         queryString = None
@@ -307,15 +687,31 @@ class SearchResource(BaseElementRendererResource):
         else:
             queryset = ESLogLine.objects.all()
 
-        return IndexElement(
-            templates.INDEX_LOADER,
-            queryset.facet('channel').facet('user').order_by('time'))
+        d = admission.gate.run(
+            admission.client_address(request),
+            admission.query_cost(queryString),
+            _evaluate, queryset.facet('channel').facet('user').order_by('time'))
+        d.addCallback(lambda queryset: IndexElement(
+            templates.INDEX_LOADER, queryset))
+        return d
 
 
 class SloggerMainResource(Resource):
+    """
+    Root of the web interface.  Pages and API responses are gzipped for
+    clients that accept it - except for pre-rendered pages, which are gzipped
+    already, and the live stream, which would be held up by the compression.
+    """
     def getChild(self, path, request):
         if path == '':
-            return LogsResource()
+            resource = LogsResource()
+            if resource.cached_page(request) is not None:
+                return resource
+            return assets.gzipped(resource)
         if path == 'search':
-            return SearchResource()
+            return assets.gzipped(SearchResource())
+        if path == 'api':
+            return api.APIResource()
+        if path == 'live':
+            return live.LiveResource()
         return NoResource()